@@ -0,0 +1,155 @@
+import asyncio
+import importlib.util
+import json
+import logging
+import re
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Optional, Tuple
+
+from config import Settings
+
+logger = logging.getLogger(__name__)
+
+SYSTEM_INSTRUCTION = """
+Ты — DJ Aurora. Твоя задача:
+1. Подобрать 5 идеальных треков под запрос.
+2. Написать короткое интро (1 фраза).
+Верни ответ ТОЛЬКО в формате JSON:
+{"intro": "...", "tracks": ["Artist - Title"]}
+"""
+
+
+class GeminiDJModel:
+    """Обертка над google.generativeai: модель создается один раз и переиспользуется."""
+
+    def __init__(self, api_key: str, model_name: str):
+        self._api_key = api_key
+        self._model_name = model_name
+        self._model = None
+
+    def generate(self, prompt: str) -> str:
+        # Синхронный вызов — выполняется в пуле потоков
+        if self._model is None:
+            import google.generativeai as genai
+            genai.configure(api_key=self._api_key)
+            self._model = genai.GenerativeModel(self._model_name)
+        return self._model.generate_content(prompt).text
+
+
+class FakeDJModel:
+    """Локальная модель для тестов и бенчмарков: детерминированный ответ с задержкой."""
+
+    def __init__(self, latency_s: float = 0.0):
+        self.latency_s = latency_s
+        self.calls = 0
+        self.prompts = []
+
+    def generate(self, prompt: str) -> str:
+        self.calls += 1
+        self.prompts.append(prompt)
+        if self.latency_s:
+            time.sleep(self.latency_s)
+        topic = prompt.rsplit("Запрос:", 1)[-1].strip() or "music"
+        tracks = [f"Fake Artist {i} - {topic.title()} {i}" for i in range(1, 6)]
+        return json.dumps({"intro": f"Ловим волну: {topic}.", "tracks": tracks}, ensure_ascii=False)
+
+
+def normalize_prompt(prompt: str) -> str:
+    return " ".join(prompt.casefold().split())
+
+
+class AIDJService:
+    """
+    AI DJ вне event loop: таймаут, ограничение параллельности,
+    TTL-кэш по нормализованному запросу и склейка одинаковых запросов в полете.
+    """
+
+    def __init__(self, model: Any, timeout_s: float = 20.0, concurrency: int = 2, cache_ttl_s: int = 3600, cache_size: int = 256):
+        self._model = model
+        self._timeout_s = timeout_s
+        self._semaphore = asyncio.Semaphore(concurrency)
+        self._cache_ttl_s = cache_ttl_s
+        self._cache_size = cache_size
+        self._cache: "OrderedDict[str, Tuple[float, Dict[str, Any]]]" = OrderedDict()
+        self._in_flight: Dict[str, asyncio.Future] = {}
+
+    async def generate(self, prompt: str) -> Dict[str, Any]:
+        key = normalize_prompt(prompt)
+        if cached := self._cache_get(key):
+            return cached
+
+        future = self._in_flight.get(key)
+        if future is None:
+            # В модель уходит исходный текст пользователя; ключ — только для кэша и склейки
+            future = asyncio.ensure_future(self._generate(prompt, key))
+            self._in_flight[key] = future
+            future.add_done_callback(lambda _: self._in_flight.pop(key, None))
+        # shield: отмена одного клиента не должна отменять общий запрос
+        return await asyncio.shield(future)
+
+    async def _generate(self, prompt: str, key: str) -> Dict[str, Any]:
+        await self._semaphore.acquire()
+        loop = asyncio.get_running_loop()
+        try:
+            call = loop.run_in_executor(None, self._model.generate, f"{SYSTEM_INSTRUCTION}\n\nЗапрос: {prompt.strip()}")
+        except Exception:
+            self._semaphore.release()
+            raise
+        # Слот освобождается, только когда поток реально завершился (даже после таймаута)
+        call.add_done_callback(lambda _: self._semaphore.release())
+        started = time.perf_counter()
+        text = await asyncio.wait_for(asyncio.shield(call), timeout=self._timeout_s)
+        logger.info(f"[AI] '{prompt}' за {time.perf_counter() - started:.2f}s")
+
+        data = json.loads(re.sub(r"```json|```", "", text).strip())
+        result = {
+            "dj_intro": data.get("intro", "Система готова."),
+            "playlist": [
+                {"title": name, "artist": "AI Selection", "query": name}
+                for name in data.get("tracks", []) if isinstance(name, str) and name.strip()
+            ],
+        }
+        self._cache_set(key, result)
+        return result
+
+    def _cache_get(self, key: str) -> Optional[Dict[str, Any]]:
+        entry = self._cache.get(key)
+        if not entry:
+            return None
+        expires_at, value = entry
+        if expires_at < time.monotonic():
+            self._cache.pop(key, None)
+            return None
+        self._cache.move_to_end(key)
+        return value
+
+    def _cache_set(self, key: str, value: Dict[str, Any]):
+        self._cache[key] = (time.monotonic() + self._cache_ttl_s, value)
+        self._cache.move_to_end(key)
+        while len(self._cache) > self._cache_size:
+            self._cache.popitem(last=False)
+
+
+def build_ai_dj(settings: Settings) -> Optional[AIDJService]:
+    """Сервис AI DJ по настройкам; None, если ключа или библиотеки нет."""
+    if settings.AI_DJ_FAKE:
+        model = FakeDJModel()
+    elif settings.GEMINI_API_KEY:
+        # Сама библиотека импортируется лениво, при первом запросе
+        try:
+            has_lib = importlib.util.find_spec("google.generativeai") is not None
+        except ModuleNotFoundError:
+            has_lib = False
+        if not has_lib:
+            logger.warning("⚠️ Google GenAI lib not found. AI features disabled.")
+            return None
+        model = GeminiDJModel(settings.GEMINI_API_KEY, settings.AI_DJ_MODEL)
+    else:
+        return None
+    return AIDJService(
+        model,
+        timeout_s=settings.AI_DJ_TIMEOUT_S,
+        concurrency=settings.AI_DJ_CONCURRENCY,
+        cache_ttl_s=settings.AI_DJ_CACHE_TTL_S,
+    )
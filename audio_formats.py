@@ -0,0 +1,33 @@
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Union
+
+# Для кого готовим файл: веб-плеер играет нативные контейнеры, Telegram send_audio — только MP3/M4A
+TARGET_WEB = "web"
+TARGET_TELEGRAM = "telegram"
+
+# m4a подходит обоим получателям без перекодирования, поэтому берем его первым
+NATIVE_FORMAT = "bestaudio[ext=m4a]/bestaudio/best"
+
+AUDIO_MIME_TYPES = {
+    "m4a": "audio/mp4",
+    "mp4": "audio/mp4",
+    "webm": "audio/webm",
+    "opus": "audio/ogg",
+    "ogg": "audio/ogg",
+    "mp3": "audio/mpeg",
+}
+WEB_EXTS = ("m4a", "webm", "opus", "ogg", "mp4", "mp3")
+TELEGRAM_EXTS = ("m4a", "mp3")
+CODEC_BY_EXT = {"m4a": "aac", "mp4": "aac", "webm": "opus", "opus": "opus", "ogg": "vorbis", "mp3": "mp3"}
+
+
+def audio_mime_type(path: Union[str, Path]) -> str:
+    return AUDIO_MIME_TYPES.get(Path(path).suffix.lstrip(".").lower(), "application/octet-stream")
+
+
+def select_audio_format(formats: Optional[List[Dict[str, Any]]]) -> Optional[Dict[str, Any]]:
+    """Тот же выбор, что NATIVE_FORMAT: лучший m4a без видео, иначе лучший любой аудиоформат."""
+    audio = [f for f in formats or [] if f.get("vcodec") == "none" and f.get("acodec") not in (None, "none") and f.get("url")]
+    m4a = [f for f in audio if f.get("ext") == "m4a"]
+    candidates = m4a or audio
+    return max(candidates, key=lambda f: f.get("abr") or 0) if candidates else None
@@ -0,0 +1,237 @@
+import asyncio
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import Executor
+from dataclasses import dataclass
+from email.utils import formatdate
+from pathlib import Path
+from typing import Any, BinaryIO, Dict, Mapping, Optional, Tuple
+
+from starlette.responses import Response
+from starlette.types import Receive, Scope, Send
+
+from audio_formats import TARGET_WEB, audio_mime_type
+from disk_store import AudioStore
+from metrics import AUDIO_FD_CACHE, AUDIO_SERVED
+from response_cache import etag_matches
+
+logger = logging.getLogger(__name__)
+
+SEND_CHUNK_SIZE = 256 * 1024
+
+
+@dataclass
+class CachedAudio:
+    video_id: str
+    path: Path
+    file: BinaryIO
+    size: int
+    mtime: float
+    inode: Tuple[int, int]
+    media_type: str
+    etag: str
+    last_modified: str
+    validated_at: float
+    refs: int = 0
+    evicted: bool = False
+
+
+class OpenFileCache:
+    """
+    LRU открытых файлов опубликованного аудио вместе с результатом fstat: горячий трек отдается
+    без поиска манифеста, open() и stat() на каждый запрос. Публикация/удаление в AudioStore этого
+    процесса сбрасывает запись сразу; изменения от других воркеров видны после revalidate_s (один stat).
+    Файл закрывается, только когда его не читает ни один ответ.
+    """
+
+    def __init__(self, store: AudioStore, max_entries: int = 64, revalidate_s: float = 2.0):
+        self._store = store
+        self._max_entries = max_entries
+        self._revalidate_s = revalidate_s
+        self._entries: "OrderedDict[str, CachedAudio]" = OrderedDict()
+        # release() вызывается и из потоков чтения
+        self._lock = threading.Lock()
+        self.stats_counters: Dict[str, int] = {"hit": 0, "miss": 0, "revalidated": 0, "invalidated": 0}
+        store.add_listener(self.invalidate)
+
+    def acquire(self, video_id: str) -> Optional[CachedAudio]:
+        """Открытый файл для отдачи (или None); после ответа обязательно release()."""
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(video_id)
+            if entry is not None and now - entry.validated_at > self._revalidate_s:
+                if self._still_valid(entry):
+                    entry.validated_at = now
+                    self._count("revalidated")
+                else:
+                    self._drop(video_id)
+                    entry = None
+            if entry is not None:
+                self._entries.move_to_end(video_id)
+                entry.refs += 1
+                self._count("hit")
+                return entry
+        self._count("miss")
+        entry = self._open(video_id)
+        if entry is None: return None
+        with self._lock:
+            if (current := self._entries.get(video_id)) is not None:
+                # Параллельный промах уже открыл файл: используем его, свой закрываем
+                entry.file.close()
+                entry = current
+            else:
+                self._entries[video_id] = entry
+                while len(self._entries) > self._max_entries:
+                    self._drop(next(iter(self._entries)))
+            entry.refs += 1
+        return entry
+
+    def release(self, entry: CachedAudio):
+        with self._lock:
+            entry.refs -= 1
+            if entry.evicted and entry.refs == 0:
+                entry.file.close()
+
+    def invalidate(self, video_id: str):
+        with self._lock:
+            if video_id in self._entries:
+                self._drop(video_id)
+                self._count("invalidated")
+
+    def close_all(self):
+        with self._lock:
+            for video_id in list(self._entries):
+                self._drop(video_id)
+
+    def _open(self, video_id: str) -> Optional[CachedAudio]:
+        path = self._store.find(video_id, TARGET_WEB)
+        if path is None: return None
+        try:
+            f = open(path, "rb", buffering=0)
+        except OSError:
+            return None
+        st = os.fstat(f.fileno())
+        return CachedAudio(
+            video_id=video_id, path=path, file=f, size=st.st_size, mtime=st.st_mtime,
+            inode=(st.st_dev, st.st_ino), media_type=audio_mime_type(path),
+            etag=f'"{st.st_ino:x}-{st.st_mtime_ns:x}-{st.st_size:x}"',
+            last_modified=formatdate(st.st_mtime, usegmt=True), validated_at=time.monotonic(),
+        )
+
+    @staticmethod
+    def _still_valid(entry: CachedAudio) -> bool:
+        # Другой воркер мог атомарно заменить или удалить файл: другой inode — другой файл
+        try:
+            st = os.stat(entry.path)
+        except OSError:
+            return False
+        return (st.st_dev, st.st_ino) == entry.inode and st.st_size == entry.size
+
+    def _drop(self, video_id: str):
+        entry = self._entries.pop(video_id)
+        entry.evicted = True
+        if entry.refs == 0:
+            entry.file.close()
+
+    def _count(self, result: str):
+        self.stats_counters[result] += 1
+        AUDIO_FD_CACHE.inc(result=result)
+
+    def stats(self) -> Dict[str, Any]:
+        return {"entries": len(self._entries), "max_entries": self._max_entries, **self.stats_counters}
+
+
+def parse_range(header: Optional[str], size: int) -> Optional[Tuple[int, int]]:
+    """
+    Один диапазон "bytes=a-b" / "bytes=a-" / "bytes=-n" -> (start, end) включительно.
+    None — заголовка нет или он не поддержан (несколько диапазонов): отдаем файл целиком.
+    (size, size) — диапазон вне файла (416).
+    """
+    if not header or not header.startswith("bytes=") or "," in header:
+        return None
+    start_s, _, end_s = header[6:].strip().partition("-")
+    try:
+        if not start_s:
+            suffix = int(end_s)
+            if suffix <= 0: return (size, size)
+            return (max(0, size - suffix), size - 1)
+        start = int(start_s)
+        end = min(int(end_s), size - 1) if end_s else size - 1
+    except ValueError:
+        return None
+    if start >= size or start > end:
+        return (size, size)
+    return (start, end)
+
+
+class AudioFileResponse(Response):
+    """
+    Отдача файла из OpenFileCache с поддержкой Range и условных запросов.
+    Если ASGI-сервер объявил расширение zerocopysend (sendfile) — байты идут ядром,
+    pathsend — сервер отдает путь сам; иначе os.pread кусками по уже открытому дескриптору.
+    """
+
+    def __init__(self, entry: CachedAudio, cache: OpenFileCache, request_headers: Mapping[str, str],
+                 executor: Optional[Executor] = None, headers: Optional[Mapping[str, str]] = None):
+        self._entry = entry
+        self._cache = cache
+        self._executor = executor
+        self._range: Optional[Tuple[int, int]] = None
+        self.background = None
+        size = entry.size
+        common = {
+            "accept-ranges": "bytes", "etag": entry.etag, "last-modified": entry.last_modified,
+            "cache-control": "public, max-age=86400", **(headers or {}),
+        }
+        if etag_matches(request_headers.get("if-none-match"), entry.etag):
+            self.status_code, self._length = 304, 0
+        elif (byte_range := parse_range(request_headers.get("range"), size)) == (size, size):
+            self.status_code, self._length = 416, 0
+            common["content-range"] = f"bytes */{size}"
+        elif byte_range is not None:
+            self._range = byte_range
+            self.status_code, self._length = 206, byte_range[1] - byte_range[0] + 1
+            common["content-range"] = f"bytes {byte_range[0]}-{byte_range[1]}/{size}"
+        else:
+            self.status_code, self._length = 200, size
+        self.media_type = entry.media_type
+        self.init_headers({**common, "content-length": str(self._length), "content-type": entry.media_type})
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send):
+        try:
+            await send({"type": "http.response.start", "status": self.status_code, "headers": self.raw_headers})
+            if scope.get("method") == "HEAD" or self._length == 0:
+                await send({"type": "http.response.body", "body": b"", "more_body": False})
+                mode = "empty"
+            else:
+                mode = await self._send_body(scope, send)
+            AUDIO_SERVED.inc(mode=mode, status=str(self.status_code))
+        finally:
+            self._cache.release(self._entry)
+
+    async def _send_body(self, scope: Scope, send: Send) -> str:
+        extensions = scope.get("extensions") or {}
+        offset = self._range[0] if self._range else 0
+        if "http.response.zerocopysend" in extensions:
+            await send({"type": "http.response.zerocopysend", "file": self._entry.file,
+                        "offset": offset, "count": self._length, "more_body": False})
+            return "zerocopy"
+        if "http.response.pathsend" in extensions and self._range is None:
+            await send({"type": "http.response.pathsend", "path": str(self._entry.path)})
+            return "pathsend"
+        loop = asyncio.get_running_loop()
+        fd = self._entry.file.fileno()
+        remaining = self._length
+        while remaining > 0:
+            chunk = await loop.run_in_executor(self._executor, os.pread, fd, min(SEND_CHUNK_SIZE, remaining), offset)
+            if not chunk: break
+            offset += len(chunk)
+            remaining -= len(chunk)
+            await send({"type": "http.response.body", "body": chunk, "more_body": remaining > 0})
+        if remaining > 0:
+            # Файл укоротился под нами (удален и перезаписан не атомарно): закрываем ответ как есть
+            await send({"type": "http.response.body", "body": b"", "more_body": False})
+        return "pread"
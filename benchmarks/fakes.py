@@ -0,0 +1,186 @@
+"""
+Детерминированные заглушки внешних сервисов для офлайн-бенчмарков:
+YTMusic (воспроизведение записанных ответов), yt-dlp (синтетические mp3), Telegram Bot и CDN обложек.
+"""
+import asyncio
+import hashlib
+import io
+import itertools
+import json
+import random
+import time
+from pathlib import Path
+from typing import Any, Callable, Dict, List, Optional
+
+FIXTURES_DIR = Path(__file__).parent / "fixtures"
+
+# Заголовок кадра MPEG-1 Layer III, 128 kbps, 44.1 kHz (417 байт на кадр)
+_MP3_FRAME = b"\xff\xfb\x90\x64" + b"\x00" * 413
+_ID3_HEADER = b"ID3\x04\x00\x00\x00\x00\x00\x00"
+
+
+def _seed(*parts: Any) -> int:
+    return int.from_bytes(hashlib.sha1("|".join(map(str, parts)).encode()).digest()[:8], "big")
+
+
+class ReplayYTMusic:
+    """
+    Замена ytmusicapi.YTMusic: отвечает записанными JSON-ответами,
+    для незнакомых запросов генерирует стабильные синтетические результаты.
+    """
+
+    def __init__(self, fixture_path: Path = FIXTURES_DIR / "ytmusic_search.json", latency_s: float = 0.0, jitter_s: float = 0.0):
+        with open(fixture_path, "r", encoding="utf-8") as f:
+            self._recorded: Dict[str, List[Dict]] = json.load(f)["search"]
+        self.latency_s = latency_s
+        self.jitter_s = jitter_s
+        self.calls: List[str] = []
+
+    def search(self, query: str, filter: Optional[str] = None, limit: int = 20, **kwargs) -> List[Dict]:
+        self.calls.append(query)
+        rnd = random.Random(_seed("latency", query, len(self.calls)))
+        if self.latency_s or self.jitter_s:
+            time.sleep(self.latency_s + rnd.random() * self.jitter_s)
+        results = self._recorded.get(query.lower().strip())
+        if results is None:
+            results = self._synthesize(query, limit)
+        return [dict(e) for e in results[:limit]]
+
+    def _synthesize(self, query: str, limit: int) -> List[Dict]:
+        rnd = random.Random(_seed("search", query.lower().strip()))
+        entries = []
+        for i in range(limit):
+            video_id = hashlib.sha1(f"{query}:{i}".encode()).hexdigest()[:11]
+            entries.append({
+                "resultType": "song",
+                "videoId": video_id,
+                "title": f"{query.title()} Track {i + 1}",
+                "artists": [{"name": f"Artist {rnd.randint(1, 40)}", "id": None}],
+                "duration_seconds": rnd.randint(130, 420),
+                "thumbnails": [{"url": f"https://lh3.googleusercontent.com/{video_id}=w544-h544", "width": 544, "height": 544}],
+            })
+        return entries
+
+
+class FakeYoutubeDL:
+    """Замена yt_dlp.YoutubeDL: пишет синтетический аудиофайл в outtmpl с заданной задержкой."""
+
+    def __init__(self, opts: Dict, latency_s: float = 0.05, size_kb: int = 256):
+        self.opts = opts
+        self.latency_s = latency_s
+        self.size_kb = size_kb
+
+    @classmethod
+    def factory(cls, latency_s: float = 0.05, size_kb: int = 256) -> Callable[[Dict], "FakeYoutubeDL"]:
+        return lambda opts: cls(opts, latency_s=latency_s, size_kb=size_kb)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+    def extract_info(self, video_id: str, download: bool = False) -> Dict[str, Any]:
+        rnd = random.Random(_seed("info", video_id))
+        duration = rnd.randint(130, 420)
+        info = {
+            "id": video_id,
+            "title": f"Track {video_id}",
+            "uploader": f"Artist {rnd.randint(1, 40)}",
+            "duration": duration,
+            "thumbnail": f"https://i.ytimg.com/vi/{video_id}/hqdefault.jpg",
+            "formats": [
+                {"format_id": "140", "ext": "m4a", "acodec": "mp4a.40.2", "vcodec": "none", "abr": 129.5, "filesize": duration * 16_200},
+                {"format_id": "251", "ext": "webm", "acodec": "opus", "vcodec": "none", "abr": 135.0, "filesize": duration * 16_900},
+            ],
+        }
+        if download:
+            self.download([video_id])
+        return info
+
+    def download(self, urls: List[str]) -> int:
+        for video_id in urls:
+            time.sleep(self.latency_s)
+            # Как yt-dlp: mp3 только с FFmpegExtractAudio, иначе нативный m4a
+            ext = "mp3" if self.opts.get("postprocessors") else "m4a"
+            target = Path(self.opts["outtmpl"].replace("%(id)s", video_id).replace("%(ext)s", ext))
+            target.parent.mkdir(parents=True, exist_ok=True)
+            frames = max(1, self.size_kb * 1024 // len(_MP3_FRAME))
+            with open(target, "wb") as f:
+                f.write(_ID3_HEADER)
+                f.write(_MP3_FRAME * frames)
+        return 0
+
+
+class FakeThumbnailFetcher:
+    """Замена HttpThumbnailFetcher: синтетическая обложка 544x544 (JPEG через Pillow, если он есть)."""
+
+    def __init__(self, latency_s: float = 0.0, fail_ids: tuple = ()):
+        self.latency_s = latency_s
+        self.fail_ids = fail_ids
+        self.calls: List[str] = []
+
+    async def __call__(self, url: str) -> bytes:
+        self.calls.append(url)
+        await asyncio.sleep(self.latency_s)
+        if any(video_id in url for video_id in self.fail_ids):
+            raise OSError(f"404 for {url}")
+        rnd = random.Random(_seed("thumb", url))
+        try:
+            from PIL import Image
+        except ImportError:
+            return b"\xff\xd8\xff\xe0" + rnd.randbytes(40 * 1024) + b"\xff\xd9"
+        out = io.BytesIO()
+        Image.new("RGB", (544, 544), tuple(rnd.randrange(256) for _ in range(3))).save(out, "JPEG")
+        return out.getvalue()
+
+
+class _FakeAudio:
+    def __init__(self, file_id: str):
+        self.file_id = file_id
+
+
+class FakeMessage:
+    _ids = itertools.count(1)
+
+    def __init__(self, bot: "RecordingBot", chat_id: int, audio: Optional[_FakeAudio] = None):
+        self.message_id = next(self._ids)
+        self.chat_id = chat_id
+        self.audio = audio
+        self._bot = bot
+
+    async def edit_text(self, text: str, **kwargs):
+        self._bot._record("edit_message_text", self.chat_id, text=text)
+        return self
+
+    async def delete(self):
+        self._bot._record("delete_message", self.chat_id)
+        return True
+
+
+class RecordingBot:
+    """Замена telegram.Bot: записывает все вызовы, загрузку файла имитирует чтением."""
+
+    def __init__(self, upload_latency_s: float = 0.0):
+        self.upload_latency_s = upload_latency_s
+        self.calls: List[Dict[str, Any]] = []
+        self._file_ids = itertools.count(1)
+
+    def _record(self, method: str, chat_id: int, **kwargs):
+        self.calls.append({"method": method, "chat_id": chat_id, "ts": time.monotonic(), **kwargs})
+
+    def calls_for(self, method: str) -> List[Dict[str, Any]]:
+        return [c for c in self.calls if c["method"] == method]
+
+    async def send_message(self, chat_id: int, text: str, **kwargs) -> FakeMessage:
+        self._record("send_message", chat_id, text=text)
+        return FakeMessage(self, chat_id)
+
+    async def send_audio(self, chat_id: int, audio: Any, **kwargs) -> FakeMessage:
+        size = 0
+        if hasattr(audio, "read"):
+            size = len(audio.read())
+            if self.upload_latency_s:
+                await asyncio.sleep(self.upload_latency_s)
+        self._record("send_audio", chat_id, size=size, reused=isinstance(audio, str))
+        return FakeMessage(self, chat_id, audio=_FakeAudio(audio if isinstance(audio, str) else f"fake-file-{next(self._file_ids)}"))
@@ -0,0 +1,125 @@
+"""
+Память на радио-сессию и на закэшированную выдачу поиска (tracemalloc), при 1k и 10k сессий.
+Треки создаются из JSON, как при восстановлении сессий и разборе ответов YTMusic:
+каждая строка — отдельный объект, повторяющиеся артисты экономятся только интернированием.
+
+    python -m benchmarks.memory --out memory.json
+    python -m benchmarks.memory --sessions 1000 10000 --compare memory.json
+"""
+import argparse
+import gc
+import json
+import pickle
+import platform
+import random
+import sys
+import time
+import tracemalloc
+from typing import Any, Callable, Dict, List
+
+from benchmarks.run import compare
+from models import TrackInfo
+from radio import RadioSession
+
+
+def track_payloads(count: int, artists: int, seed: int) -> List[str]:
+    rnd = random.Random(seed)
+    return [json.dumps({
+        "identifier": f"{rnd.getrandbits(64):011x}"[:11],
+        "title": f"Track {i} ({rnd.choice(['Live', 'Remix', 'Radio Edit', 'Original Mix'])})",
+        "artist": f"Artist {rnd.randrange(artists)}",
+        "duration": rnd.randrange(120, 420),
+        "source": "youtube",
+        "thumbnail_url": f"https://lh3.googleusercontent.com/{rnd.getrandbits(128):032x}=w544-h544-l90-rj",
+    }) for i in range(count)]
+
+
+def measure(build: Callable[[], List[Any]]) -> int:
+    """Прирост памяти (байт) на объекты, которые строит build и которые живы после него."""
+    gc.collect()
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    objects = build()
+    after = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    del objects
+    return after - before
+
+
+def bench_sessions(count: int, args: argparse.Namespace) -> Dict[str, Any]:
+    payloads = track_payloads(args.playlist + args.history, args.artists, seed=count)
+
+    def build():
+        sessions = []
+        for chat_id in range(count):
+            session = RadioSession(chat_id=chat_id, bot=None, downloader=None, settings=None,
+                                   query="synthwave", display_name="Synthwave")
+            tracks = [TrackInfo.from_dict(json.loads(p)) for p in payloads]
+            session.playlist = tracks[:args.playlist]
+            session.played_ids = {t.identifier for t in tracks[args.playlist:]}
+            session.played_keys = {t.recording_key for t in tracks[args.playlist:]}
+            sessions.append(session)
+        return sessions
+
+    total = measure(build)
+    return {"sessions": count, "bytes_per_session": round(total / count), "total_mb": round(total / 2**20, 2)}
+
+
+def bench_search_cache(args: argparse.Namespace) -> Dict[str, Any]:
+    tracks = [TrackInfo.from_dict(json.loads(p)) for p in track_payloads(args.search_size, args.artists, seed=1)]
+    blob = pickle.dumps({"limit": args.search_size, "tracks": tracks})
+    loads = 1000
+    total = measure(lambda: [pickle.loads(blob) for _ in range(loads)])
+    t0 = time.perf_counter()
+    for _ in range(loads): pickle.loads(blob)
+    return {
+        "tracks": args.search_size,
+        "pickled_bytes": len(blob),
+        "bytes_per_unpickled": round(total / loads),
+        "unpickle_us": round((time.perf_counter() - t0) / loads * 1e6, 1),
+    }
+
+
+def run(args: argparse.Namespace) -> Dict[str, Any]:
+    scenarios = {f"sessions_{n}": bench_sessions(n, args) for n in args.sessions}
+    scenarios["search_cache"] = bench_search_cache(args)
+    return {
+        "meta": {
+            "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "python": sys.version.split()[0],
+            "platform": platform.platform(),
+            "params": {k: v for k, v in vars(args).items() if k not in ("out", "compare")},
+        },
+        "scenarios": scenarios,
+    }
+
+
+def parse_args(argv=None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Per-session and per-cached-search memory footprint")
+    parser.add_argument("--sessions", type=int, nargs="+", default=[1000, 10000])
+    parser.add_argument("--playlist", type=int, default=15, help="Треков в очереди сессии")
+    parser.add_argument("--history", type=int, default=50, help="Сыгранных треков (played_ids / played_keys)")
+    parser.add_argument("--artists", type=int, default=40, help="Различных артистов (жанр повторяет одних и тех же)")
+    parser.add_argument("--search-size", type=int, default=20)
+    parser.add_argument("--out", default="memory_output.json")
+    parser.add_argument("--compare", help="JSON предыдущего прогона для сравнения")
+    return parser.parse_args(argv)
+
+
+def main(argv=None) -> int:
+    args = parse_args(argv)
+    report = run(args)
+    with open(args.out, "w", encoding="utf-8") as f:
+        json.dump(report, f, ensure_ascii=False, indent=2)
+    for name, result in report["scenarios"].items():
+        print(f"[memory] {name}: {json.dumps(result, ensure_ascii=False)}")
+    print(f"[memory] Results written to {args.out}")
+    if args.compare:
+        with open(args.compare, "r", encoding="utf-8") as f:
+            baseline = json.load(f)
+        print("\n".join(compare(report["scenarios"], baseline.get("scenarios", {}))))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
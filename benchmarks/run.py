@@ -0,0 +1,405 @@
+"""
+Офлайн-бенчмарки: поиск, загрузки, параллельные радио-сессии, шквал вебхуков, отдача /audio и /thumb,
+смена трека в веб-плеере с прогревом следующего и без.
+Сеть не нужна — YTMusic, yt-dlp и Telegram подменены заглушками из benchmarks.fakes.
+
+    python -m benchmarks.run --out bench.json
+    python -m benchmarks.run --out new.json --compare bench.json
+"""
+import argparse
+import asyncio
+import json
+import platform
+import shutil
+import statistics
+import sys
+import tempfile
+import time
+from pathlib import Path
+from typing import Any, Callable, Dict, List
+
+from benchmarks.fakes import FakeThumbnailFetcher, FakeYoutubeDL, RecordingBot, ReplayYTMusic
+from cache_service import CacheService
+from config import Settings
+from youtube import YouTubeDownloader
+
+
+def percentile(values: List[float], pct: float) -> float:
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    idx = min(len(ordered) - 1, max(0, round(pct / 100 * (len(ordered) - 1))))
+    return ordered[idx]
+
+
+def summarize(latencies: List[float]) -> Dict[str, float]:
+    """Латентности в миллисекундах."""
+    ms = [v * 1000 for v in latencies]
+    return {
+        "count": len(ms),
+        "p50_ms": round(percentile(ms, 50), 3),
+        "p90_ms": round(percentile(ms, 90), 3),
+        "p99_ms": round(percentile(ms, 99), 3),
+        "mean_ms": round(statistics.fmean(ms), 3) if ms else 0.0,
+        "max_ms": round(max(ms), 3) if ms else 0.0,
+    }
+
+
+class BenchEnv:
+    """Изолированное окружение: временные каталоги, кэш в памяти и заглушки."""
+
+    def __init__(self, args: argparse.Namespace):
+        self.args = args
+        self.tmp = Path(tempfile.mkdtemp(prefix="bench_"))
+        self.settings = Settings(
+            BOT_TOKEN="12345:bench",
+            WEBHOOK_URL="https://bench.local/telegram",
+            BASE_URL="",
+            DOWNLOADS_DIR=self.tmp / "downloads",
+            TEMP_AUDIO_DIR=self.tmp / "temp_audio",
+            CACHE_DB_PATH=self.tmp / "cache.db",
+            RADIO_RESUME_ENABLED=False,
+        )
+        self.cache = CacheService(self.settings.CACHE_DB_PATH)
+        self.ytmusic = ReplayYTMusic(latency_s=args.search_latency, jitter_s=args.search_jitter)
+        self.downloader: YouTubeDownloader = None
+
+    async def __aenter__(self) -> "BenchEnv":
+        await self.cache.initialize()
+        self.downloader = YouTubeDownloader(
+            self.settings, self.cache, ytmusic=self.ytmusic,
+            ydl_factory=FakeYoutubeDL.factory(latency_s=self.args.download_latency, size_kb=self.args.file_kb),
+        )
+        return self
+
+    async def __aexit__(self, *exc):
+        await self.cache.close()
+        shutil.rmtree(self.tmp, ignore_errors=True)
+
+
+# ==================== СЦЕНАРИИ ====================
+
+async def bench_search(env: BenchEnv) -> Dict[str, Any]:
+    queries = [f"bench genre {i}" for i in range(env.args.queries)] + ["numb", "lofi hip hop radio", "classic rock greatest hits"]
+    cold, warm = [], []
+    for q in queries:
+        t0 = time.perf_counter()
+        await env.downloader.search(q, search_mode="track", limit=15)
+        cold.append(time.perf_counter() - t0)
+    for q in queries:
+        t0 = time.perf_counter()
+        await env.downloader.search(q, search_mode="track", limit=15)
+        warm.append(time.perf_counter() - t0)
+    return {"cold": summarize(cold), "warm": summarize(warm), "upstream_calls": len(env.ytmusic.calls)}
+
+
+async def bench_download(env: BenchEnv) -> Dict[str, Any]:
+    video_ids = [f"dl{i:09d}" for i in range(env.args.downloads)]
+    latencies = []
+
+    async def one(video_id: str):
+        t0 = time.perf_counter()
+        result = await env.downloader.download(video_id)
+        latencies.append(time.perf_counter() - t0)
+        return result.success
+
+    t0 = time.perf_counter()
+    results = await asyncio.gather(*(one(v) for v in video_ids))
+    elapsed = time.perf_counter() - t0
+    return {
+        "downloads": len(video_ids),
+        "succeeded": sum(results),
+        "elapsed_s": round(elapsed, 3),
+        "tracks_per_s": round(len(video_ids) / elapsed, 2) if elapsed else 0.0,
+        "latency": summarize(latencies),
+    }
+
+
+async def bench_radio(env: BenchEnv) -> Dict[str, Any]:
+    from radio import RadioManager
+
+    bot = RecordingBot(upload_latency_s=env.args.upload_latency)
+    manager = RadioManager(bot=bot, settings=env.settings, downloader=env.downloader)
+    sessions = env.args.sessions
+    t0 = time.monotonic()
+    await asyncio.gather(*(manager.start(chat_id=1000 + i, query=f"radio genre {i % 10}") for i in range(sessions)))
+
+    deadline = t0 + env.args.radio_timeout
+    while time.monotonic() < deadline:
+        if len({c["chat_id"] for c in bot.calls_for("send_audio")}) >= sessions:
+            break
+        await asyncio.sleep(0.01)
+
+    first_audio: Dict[int, float] = {}
+    for call in bot.calls_for("send_audio"):
+        first_audio.setdefault(call["chat_id"], call["ts"] - t0)
+    await manager.stop_all()
+    return {
+        "sessions": sessions,
+        "sessions_playing": len(first_audio),
+        "time_to_first_audio": summarize(list(first_audio.values())),
+        "bot_calls": len(bot.calls),
+    }
+
+
+class _FakeTelegramApp:
+    """Минимальная замена telegram.ext.Application для вебхука."""
+
+    def __init__(self, work_s: float):
+        from telegram import Bot
+        self.bot = Bot(token="12345:bench")
+        self.work_s = work_s
+        self.processed = 0
+
+    async def process_update(self, update):
+        if self.work_s:
+            await asyncio.sleep(self.work_s)
+        self.processed += 1
+
+
+async def bench_webhook(env: BenchEnv) -> Dict[str, Any]:
+    import httpx
+    from main import app
+
+    tg_app = _FakeTelegramApp(work_s=env.args.webhook_work)
+    app.state.tg_app = tg_app
+    app.state.downloader = env.downloader
+    payloads = [{
+        "update_id": i,
+        "message": {
+            "message_id": i, "date": 0, "text": "/skip",
+            "chat": {"id": 2000 + i % 50, "type": "private"},
+            "from": {"id": 2000 + i % 50, "is_bot": False, "first_name": "Bench"},
+            "entities": [{"type": "bot_command", "offset": 0, "length": 5}],
+        },
+    } for i in range(env.args.webhooks)]
+
+    latencies = []
+    async with httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://bench") as client:
+        async def one(payload):
+            t0 = time.perf_counter()
+            resp = await client.post("/telegram", json=payload)
+            latencies.append(time.perf_counter() - t0)
+            return resp.status_code == 200
+
+        t0 = time.perf_counter()
+        results = await asyncio.gather(*(one(p) for p in payloads))
+        elapsed = time.perf_counter() - t0
+    return {
+        "requests": len(payloads),
+        "ok": sum(results),
+        "processed": tg_app.processed,
+        "elapsed_s": round(elapsed, 3),
+        "requests_per_s": round(len(payloads) / elapsed, 1) if elapsed else 0.0,
+        "latency": summarize(latencies),
+    }
+
+
+async def bench_audio(env: BenchEnv) -> Dict[str, Any]:
+    """/audio для готовых файлов: FileResponse с поиском на каждый запрос против кэша открытых файлов."""
+    import httpx
+    from audio_serving import OpenFileCache
+    from main import app
+
+    store = env.downloader.audio_store
+    video_ids = [f"aud{i:08d}" for i in range(env.args.audio_files)]
+    payload = b"\0" * (env.args.file_kb * 1024)
+    for video_id in video_ids:
+        tmp = store.temp_path(video_id)
+        tmp.write_bytes(payload)
+        store.publish(tmp, video_id, "m4a", duration=180, source="bench")
+    app.state.downloader = env.downloader
+    # Половина запросов — перемотка (Range), как у <audio> при seek
+    requests = [(video_ids[i % len(video_ids)], {"range": "bytes=65536-"} if i % 2 else {})
+                for i in range(env.args.audio_requests)]
+
+    async def measure(audio_files) -> Dict[str, Any]:
+        app.state.audio_files = audio_files
+        latencies, statuses = [], []
+        async with httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://bench") as client:
+            async def one(video_id, headers):
+                t0 = time.perf_counter()
+                resp = await client.get(f"/audio/{video_id}", headers=headers)
+                latencies.append(time.perf_counter() - t0)
+                statuses.append(resp.status_code)
+
+            cpu0, t0 = time.process_time(), time.perf_counter()
+            for i in range(0, len(requests), 20):
+                await asyncio.gather(*(one(v, h) for v, h in requests[i:i + 20]))
+            elapsed, cpu = time.perf_counter() - t0, time.process_time() - cpu0
+        return {
+            "requests_per_s": round(len(requests) / elapsed, 1) if elapsed else 0.0,
+            "cpu_ms_per_request": round(cpu * 1000 / len(requests), 3),
+            "partial_206": statuses.count(206),
+            "latency": summarize(latencies),
+        }
+
+    audio_files = OpenFileCache(store, max_entries=env.args.audio_files)
+    try:
+        return {
+            "file_response": await measure(None),
+            "fd_cache": await measure(audio_files),
+            "fd_cache_stats": audio_files.stats(),
+        }
+    finally:
+        audio_files.close_all()
+        app.state.audio_files = None
+
+
+async def bench_thumb(env: BenchEnv) -> Dict[str, Any]:
+    """/thumb: холодный проход (одна загрузка исходника на видео при параллельных запросах) и теплый."""
+    import httpx
+    from dependencies import get_settings_dep
+    from main import app
+    from thumbnails import ThumbnailCache
+
+    app.dependency_overrides[get_settings_dep] = lambda: env.settings
+    fetcher = FakeThumbnailFetcher(latency_s=env.args.thumb_latency)
+    app.state.thumbnails = ThumbnailCache(env.tmp / "thumbs", fetcher=fetcher)
+    video_ids = [f"thm{i:08d}" for i in range(env.args.thumb_ids)]
+    # Как Media Session: каждый трек запрашивается во всех размерах сразу
+    requests = [(video_id, size) for video_id in video_ids for size in (96, 192, 512)]
+
+    async with httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://bench") as client:
+        async def one(video_id, size, latencies):
+            t0 = time.perf_counter()
+            resp = await client.get(f"/thumb/{video_id}", params={"size": size})
+            latencies.append(time.perf_counter() - t0)
+            return resp.status_code == 200
+
+        passes = {}
+        for name in ("cold", "warm"):
+            latencies = []
+            t0 = time.perf_counter()
+            ok = await asyncio.gather(*(one(v, s, latencies) for v, s in requests))
+            passes[name] = {"ok": sum(ok), "elapsed_s": round(time.perf_counter() - t0, 3), "latency": summarize(latencies)}
+    result = {
+        "requests_per_pass": len(requests),
+        "source_fetches": len(fetcher.calls),
+        **passes,
+        "cache": app.state.thumbnails.stats(),
+    }
+    await app.state.thumbnails.close()
+    app.dependency_overrides.clear()
+    return result
+
+
+async def bench_prefetch(env: BenchEnv) -> Dict[str, Any]:
+    """Веб-плеер проигрывает очередь: задержка /audio при смене трека без прогрева и с ?next= + /api/player/prefetch."""
+    import httpx
+    from dependencies import get_settings_dep
+    from main import app
+
+    app.dependency_overrides[get_settings_dep] = lambda: env.settings
+    app.state.downloader = env.downloader
+    app.state.audio_files = None
+
+    async with httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://bench") as client:
+        async def play_queue(prefix: str, prefetch: bool) -> Dict[str, Any]:
+            queue = [f"{prefix}{i:08d}"[:11] for i in range(env.args.prefetch_tracks)]
+            latencies, hinted = [], 0
+            for i, video_id in enumerate(queue):
+                upcoming = queue[i + 1:i + 3]
+                params = {"next": upcoming[0]} if prefetch and upcoming else {}
+                if prefetch and upcoming:
+                    await client.post("/api/player/prefetch", json={"identifiers": upcoming})
+                t0 = time.perf_counter()
+                resp = await client.get(f"/audio/{video_id}", params=params)
+                latencies.append(time.perf_counter() - t0)
+                assert resp.status_code == 200, resp.status_code
+                hinted += "link" in resp.headers
+                # Трек "играет": в это время прогрев успевает скачать следующий
+                await asyncio.sleep(env.args.prefetch_play_s)
+            return {"track_change": summarize(latencies), "link_hints": hinted}
+
+        try:
+            return {"no_prefetch": await play_queue("pfa", False), "prefetch": await play_queue("pfb", True)}
+        finally:
+            app.dependency_overrides.clear()
+
+
+SCENARIOS: Dict[str, Callable[[BenchEnv], Any]] = {
+    "search": bench_search,
+    "download": bench_download,
+    "radio": bench_radio,
+    "webhook": bench_webhook,
+    "audio": bench_audio,
+    "thumb": bench_thumb,
+    "prefetch": bench_prefetch,
+}
+
+
+# ==================== ЗАПУСК ====================
+
+def compare(current: Dict[str, Any], baseline: Dict[str, Any], prefix: str = "") -> List[str]:
+    """Построчное сравнение числовых метрик с базовым прогоном."""
+    lines = []
+    for key, value in current.items():
+        name = f"{prefix}{key}"
+        base = baseline.get(key) if isinstance(baseline, dict) else None
+        if isinstance(value, dict):
+            lines.extend(compare(value, base or {}, f"{name}."))
+        elif isinstance(value, (int, float)) and isinstance(base, (int, float)) and base:
+            lines.append(f"{name:<50} {base:>12} -> {value:>12}  ({(value - base) / base * 100:+.1f}%)")
+    return lines
+
+
+async def run(args: argparse.Namespace) -> Dict[str, Any]:
+    results: Dict[str, Any] = {}
+    for name in args.scenarios:
+        # Каждый сценарий в чистом окружении, чтобы кэш одного не влиял на другой
+        async with BenchEnv(args) as env:
+            t0 = time.perf_counter()
+            results[name] = await SCENARIOS[name](env)
+            results[name]["wall_s"] = round(time.perf_counter() - t0, 3)
+        print(f"[bench] {name}: {json.dumps(results[name], ensure_ascii=False)}")
+    return {
+        "meta": {
+            "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "python": sys.version.split()[0],
+            "platform": platform.platform(),
+            "params": {k: v for k, v in vars(args).items() if k not in ("out", "compare")},
+        },
+        "scenarios": results,
+    }
+
+
+def parse_args(argv=None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Offline performance benchmarks")
+    parser.add_argument("--scenarios", nargs="+", choices=list(SCENARIOS), default=list(SCENARIOS))
+    parser.add_argument("--out", default="bench_output.json", help="Файл для JSON-результатов")
+    parser.add_argument("--compare", help="JSON предыдущего прогона для сравнения")
+    parser.add_argument("--queries", type=int, default=40)
+    parser.add_argument("--downloads", type=int, default=30)
+    parser.add_argument("--sessions", type=int, default=20)
+    parser.add_argument("--webhooks", type=int, default=500)
+    parser.add_argument("--audio-files", type=int, default=20)
+    parser.add_argument("--audio-requests", type=int, default=400)
+    parser.add_argument("--thumb-ids", type=int, default=50)
+    parser.add_argument("--thumb-latency", type=float, default=0.05)
+    parser.add_argument("--prefetch-tracks", type=int, default=10)
+    parser.add_argument("--prefetch-play-s", type=float, default=0.3)
+    parser.add_argument("--search-latency", type=float, default=0.02)
+    parser.add_argument("--search-jitter", type=float, default=0.03)
+    parser.add_argument("--download-latency", type=float, default=0.05)
+    parser.add_argument("--upload-latency", type=float, default=0.01)
+    parser.add_argument("--webhook-work", type=float, default=0.0)
+    parser.add_argument("--file-kb", type=int, default=256)
+    parser.add_argument("--radio-timeout", type=float, default=60.0)
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    report = asyncio.run(run(args))
+    with open(args.out, "w", encoding="utf-8") as f:
+        json.dump(report, f, ensure_ascii=False, indent=2)
+    print(f"[bench] Results written to {args.out}")
+    if args.compare:
+        with open(args.compare, "r", encoding="utf-8") as f:
+            baseline = json.load(f)
+        print("\n".join(compare(report["scenarios"], baseline.get("scenarios", {}))))
+
+
+if __name__ == "__main__":
+    main()
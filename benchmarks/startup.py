@@ -0,0 +1,111 @@
+"""
+Профиль старта: где тратится время импорта main (python -X importtime) и укладывается ли он в бюджет.
+Каждый прогон — отдельный процесс, чтобы импорт был холодным (кроме кэша .pyc).
+
+    python -m benchmarks.startup --out startup.json
+    python -m benchmarks.startup --budget-ms 2000 --top 15
+
+Код выхода 1, если медиана импорта больше бюджета или тяжелые модули загружены при импорте.
+"""
+import argparse
+import json
+import platform
+import re
+import statistics
+import subprocess
+import sys
+import time
+from pathlib import Path
+from typing import Any, Dict, List, Tuple
+
+from benchmarks.run import compare
+
+ROOT = Path(__file__).resolve().parent.parent
+# Должны загружаться только при первом использовании или в фоновом прогреве
+LAZY_MODULES = ("yt_dlp", "ytmusicapi", "google.generativeai")
+IMPORTTIME_LINE = re.compile(r"import time:\s+(\d+) \|\s+(\d+) \| (\s*)(\S+)")
+
+
+def parse_importtime(stderr: str) -> List[Tuple[str, int, int, int]]:
+    """(модуль, self_us, cumulative_us, глубина) для каждой строки -X importtime."""
+    rows = []
+    for line in stderr.splitlines():
+        if m := IMPORTTIME_LINE.match(line):
+            rows.append((m.group(4), int(m.group(1)), int(m.group(2)), len(m.group(3)) // 2))
+    return rows
+
+
+def profile_once(module: str) -> Dict[str, Any]:
+    probe = f"import sys, json; import {module}; print(json.dumps([m for m in {LAZY_MODULES!r} if m in sys.modules]))"
+    t0 = time.perf_counter()
+    proc = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", probe],
+        cwd=ROOT, capture_output=True, text=True, check=True,
+    )
+    wall_s = time.perf_counter() - t0
+    rows = parse_importtime(proc.stderr)
+    total_us = next((cum for name, _, cum, depth in rows if name == module and depth == 0), 0)
+    return {"wall_s": wall_s, "import_us": total_us, "rows": rows, "eager_heavy": json.loads(proc.stdout.strip().splitlines()[-1])}
+
+
+def run(args: argparse.Namespace) -> Dict[str, Any]:
+    runs = [profile_once(args.module) for _ in range(args.runs)]
+    import_ms = [r["import_us"] / 1000 for r in runs]
+    wall_ms = [r["wall_s"] * 1000 for r in runs]
+    last = runs[-1]["rows"]
+    # Прямые зависимости main: что именно тянет каждый импорт верхнего уровня
+    direct = sorted(((name, cum) for name, _, cum, depth in last if depth == 1), key=lambda r: -r[1])
+    by_self = sorted(((name, own) for name, own, _, _ in last), key=lambda r: -r[1])
+    median_import = statistics.median(import_ms)
+    return {
+        "meta": {
+            "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "python": sys.version.split()[0],
+            "platform": platform.platform(),
+            "params": {k: v for k, v in vars(args).items() if k not in ("out", "compare")},
+        },
+        "scenarios": {
+            "startup": {
+                "import_ms": {"p50": round(median_import, 1), "min": round(min(import_ms), 1), "max": round(max(import_ms), 1)},
+                "process_wall_ms": {"p50": round(statistics.median(wall_ms), 1)},
+                "budget_ms": args.budget_ms,
+                "within_budget": median_import <= args.budget_ms,
+                "eager_heavy_modules": runs[-1]["eager_heavy"],
+                "top_direct_imports_ms": {name: round(cum / 1000, 1) for name, cum in direct[:args.top]},
+                "top_self_ms": {name: round(own / 1000, 1) for name, own in by_self[:args.top]},
+            }
+        },
+    }
+
+
+def parse_args(argv=None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Import-time startup profile")
+    parser.add_argument("--module", default="main")
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--top", type=int, default=10)
+    parser.add_argument("--budget-ms", type=float, default=2500.0, help="Бюджет на импорт main (медиана)")
+    parser.add_argument("--out", default="startup_output.json")
+    parser.add_argument("--compare", help="JSON предыдущего прогона для сравнения")
+    return parser.parse_args(argv)
+
+
+def main(argv=None) -> int:
+    args = parse_args(argv)
+    report = run(args)
+    result = report["scenarios"]["startup"]
+    with open(args.out, "w", encoding="utf-8") as f:
+        json.dump(report, f, ensure_ascii=False, indent=2)
+    print(f"[startup] {json.dumps(result, ensure_ascii=False)}")
+    print(f"[startup] Results written to {args.out}")
+    if args.compare:
+        with open(args.compare, "r", encoding="utf-8") as f:
+            baseline = json.load(f)
+        print("\n".join(compare(report["scenarios"], baseline.get("scenarios", {}))))
+    ok = result["within_budget"] and not result["eager_heavy_modules"]
+    if not ok:
+        print(f"[startup] Over budget or heavy modules imported eagerly: {result['eager_heavy_modules']}")
+    return 0 if ok else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
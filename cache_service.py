@@ -6,6 +6,8 @@ from typing import Optional, Any, Union
 import aiosqlite
 from datetime import datetime, timedelta
 
+from metrics import CACHE_REQUESTS
+
 logger = logging.getLogger(__name__)
 
 class CacheService:
@@ -45,14 +47,17 @@ class CacheService:
                     "SELECT value, expires_at FROM cache WHERE key = ?", (key,)
                 )
                 row = await cursor.fetchone()
+                prefix = key.split(":", 1)[0]
                 if row:
                     value, expires_at = row
                     if expires_at is None or datetime.fromisoformat(expires_at) > datetime.now():
+                        CACHE_REQUESTS.inc(prefix=prefix, result="hit")
                         return pickle.loads(value)
                     else:
                         # Запись просрочена, удаляем ее
                         await self._db.execute("DELETE FROM cache WHERE key = ?", (key,))
                         await self._db.commit()
+                CACHE_REQUESTS.inc(prefix=prefix, result="miss")
                 return None
         except Exception as e:
             logger.error(f"Cache get error for {key}: {e}")
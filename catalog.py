@@ -1,3 +1,8 @@
+import hashlib
+import random
+from dataclasses import dataclass
+from typing import Dict, List, Optional, Tuple
+
 # ===========================
 # ГЛОБАЛЬНЫЙ КАТАЛОГ ЖАНРОВ
 # ===========================
@@ -124,7 +129,8 @@ MUSIC_CATALOG = {
         "Synth / Retro": {
             "Synthwave": "synthwave retrowave",
             "Retrowave": "retro wave 80s style"
-        }
+        },
+        "Phonk": "drift phonk mix"
     },
 
     # =========================
@@ -151,7 +157,8 @@ MUSIC_CATALOG = {
         "Soviet & Retro": {
             "Golden Hits": "лучшие песни ссср 70 80",
             "Movies": "песни из советских фильмов",
-            "VIA": "виа ссср песняры самоцветы"
+            "VIA": "виа ссср песняры самоцветы",
+            "Bards": "владимир высоцкий лучшие песни"
         },
         "Russian Rock": {
             "Legends": "русский рок кино би 2 сплин",
@@ -167,7 +174,8 @@ MUSIC_CATALOG = {
             "Old School": "русский рэп 2000 баста гуф",
             "New School": "русский рэп новинки",
             "Chill / Lyric": "лирика русский рэп"
-        }
+        },
+        "Chanson": "золотой шансон михаил круг"
     },
 
     # =========================
@@ -177,6 +185,7 @@ MUSIC_CATALOG = {
         "Work / Focus": "deep focus music for work",
         "Gym": "gym workout motivation music",
         "Chill / Relax": "chill lofi beats",
+        "Lofi Hip-Hop": "lofi hip hop radio beats to relax",
         "Party": "party dance hits",
         "Night Drive": "night drive music",
         "Sleep / Ambient": "ambient music for sleep",
@@ -186,4 +195,72 @@ MUSIC_CATALOG = {
             "Modern": "modern classical music"
         }
     }
-}
\ No newline at end of file
+}
+
+# ===========================
+# СКОМПИЛИРОВАННЫЙ ИНДЕКС
+# ===========================
+
+@dataclass(frozen=True)
+class CatalogNode:
+    node_id: str
+    name: str
+    path: Tuple[str, ...]
+    parent_id: Optional[str] = None
+    query: Optional[str] = None             # Есть только у листьев
+    children: Tuple[str, ...] = ()
+
+    @property
+    def is_leaf(self) -> bool:
+        return self.query is not None
+
+
+def make_node_id(path: Tuple[str, ...]) -> str:
+    """Короткий стабильный ID узла: хэш пути (не зависит от порядка в каталоге)."""
+    return hashlib.blake2s("\x1f".join(path).encode("utf-8"), digest_size=4).hexdigest()
+
+
+class CatalogIndex:
+    """
+    Каталог, скомпилированный один раз при импорте:
+    узлы по короткому ID (для callback_data) и плоский массив листьев для рандома.
+    """
+
+    def __init__(self, catalog: Dict):
+        self.nodes: Dict[str, CatalogNode] = {}
+        self.leaves: List[CatalogNode] = []
+        self.roots: Tuple[str, ...] = self._compile(catalog, (), None)
+
+    def _compile(self, level: Dict, path: Tuple[str, ...], parent_id: Optional[str]) -> Tuple[str, ...]:
+        ids = []
+        for name, value in level.items():
+            node_path = path + (name,)
+            node_id = make_node_id(node_path)
+            if node_id in self.nodes:
+                raise ValueError(f"Catalog ID collision: {node_path} vs {self.nodes[node_id].path}")
+            if isinstance(value, dict):
+                # Резервируем ID до обхода детей, чтобы коллизии ловились и внутри поддерева
+                self.nodes[node_id] = CatalogNode(node_id, name, node_path, parent_id)
+                children = self._compile(value, node_path, node_id)
+                self.nodes[node_id] = CatalogNode(node_id, name, node_path, parent_id, children=children)
+            else:
+                node = CatalogNode(node_id, name, node_path, parent_id, query=str(value))
+                self.nodes[node_id] = node
+                self.leaves.append(node)
+            ids.append(node_id)
+        return tuple(ids)
+
+    def get(self, node_id: str) -> Optional[CatalogNode]:
+        return self.nodes.get(node_id)
+
+    def resolve(self, token: str) -> Optional[CatalogNode]:
+        """ID узла или старый формат пути 'A|B|C' (кнопки в уже отправленных сообщениях)."""
+        if node := self.nodes.get(token):
+            return node
+        return self.nodes.get(make_node_id(tuple(token.split("|"))))
+
+    def random_leaf(self) -> CatalogNode:
+        return random.choice(self.leaves)
+
+
+CATALOG_INDEX = CatalogIndex(MUSIC_CATALOG)
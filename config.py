@@ -35,6 +35,89 @@ class Settings(BaseSettings):
     CLEANUP_INTERVAL_SECONDS: int = 3600  # Раз в час
     FILE_MAX_AGE_SECONDS: int = 86400     # 24 часа
 
+    # Восстановление радио-сессий после рестарта
+    RADIO_RESUME_ENABLED: bool = True
+    RADIO_RESUME_STAGGER_S: float = 3.0   # Пауза между стартами восстановленных эфиров
+
+    # Метрики (/api/metrics)
+    METRICS_ENABLED: bool = True
+
+    # Мониторинг event loop (/api/health)
+    LOOP_MONITOR_ENABLED: bool = True
+    LOOP_LAG_INTERVAL_S: float = 0.5
+    LOOP_SLOW_CALLBACK_REPORT: bool = False   # Поток-сторож со стеком блокирующего кода
+    LOOP_SLOW_CALLBACK_S: float = 0.5
+    LOOP_LAG_UNHEALTHY_S: float = 5.0         # Лаг, при котором /api/health отдает 503
+    LOOP_HEALTH_WINDOW_S: float = 30.0
+
+    # AI DJ (Gemini)
+    GEMINI_API_KEY: str = ""
+    AI_DJ_MODEL: str = "gemini-1.5-flash"
+    AI_DJ_TIMEOUT_S: float = 20.0
+    AI_DJ_CONCURRENCY: int = 2
+    AI_DJ_CACHE_TTL_S: int = 3600
+    AI_DJ_FAKE: bool = False   # Локальная заглушка вместо Gemini (тесты, бенчмарки)
+
+    # /api/player/resolve: превращение списка "Artist - Title" в треки
+    RESOLVE_CONCURRENCY: int = 4
+    RESOLVE_TIMEOUT_S: float = 20.0
+    RESOLVE_MAX_QUERIES: int = 25
+
+    # HTTP-кэш /api/player/playlist
+    RESPONSE_CACHE_MAX_ENTRIES: int = 512
+    RESPONSE_CACHE_TTL_S: int = 300
+    PLAYLIST_HTTP_MAX_AGE_S: int = 60
+    PLAYLIST_HTTP_SWR_S: int = 600
+
+    # Потоковая отдача: источник -> (ffmpeg) -> файл/HTTP без промежуточной копии
+    AUDIO_STREAMING_ENABLED: bool = True
+    DOWNLOAD_LOCK_TIMEOUT_S: float = 120.0   # Сколько ждать чужую загрузку того же видео
+    AUDIO_FD_CACHE_SIZE: int = 64            # Открытых файлов /audio в LRU (каждый держит дескриптор)
+    AUDIO_FD_REVALIDATE_S: float = 2.0       # Как часто перепроверять stat: файл мог заменить другой воркер
+    PREFETCH_MAX_IDS: int = 3                # Сколько следующих треков плеер может прогреть одним запросом
+    PREFETCH_CONCURRENCY: int = 2            # Одновременных загрузок прогрева (уступают пользовательским)
+    PREFETCH_MAX_QUEUED: int = 32
+
+    # Обложки /thumb: уменьшенные копии на диске (Pillow, если установлен)
+    THUMB_CACHE_DIR: Path = BASE_DIR / "thumb_cache"
+    THUMB_CACHE_MAX_MB: int = 64
+    THUMB_FETCH_TIMEOUT_S: float = 10.0
+    THUMB_HTTP_MAX_AGE_S: int = 30 * 86400
+
+    # Несколько воркеров (uvicorn --workers N): "sqlite" — аренды сессий в CACHE_DB_PATH, "local" — один процесс
+    COORDINATION_BACKEND: str = "local"
+    LEASE_TTL_S: float = 30.0             # Через сколько сессия упавшего воркера переходит другому
+    LEASE_RENEW_INTERVAL_S: float = 10.0
+    COMMAND_POLL_INTERVAL_S: float = 0.5  # Задержка доставки /stop, /skip владельцу сессии
+
+    # Upstream (YTMusic, yt-dlp): AIMD-лимит параллельности от стартового значения до максимума
+    YTMUSIC_CONCURRENCY: int = 5
+    YTMUSIC_MAX_CONCURRENCY: int = 12
+    YTMUSIC_LATENCY_TARGET_S: float = 3.0     # Медленнее — сигнал перегрузки, лимит снижается
+    YTMUSIC_DEADLINE_S: float = 8.0           # Дедлайн одного поиска (включая повторную попытку)
+    YTMUSIC_HEDGE_QUANTILE: float = 0.9       # Повторная попытка, если нет ответа дольше p90; 0 — без хеджирования
+    YTMUSIC_HEDGE_BUDGET: float = 0.1         # Доля вызовов, которую можно продублировать
+    YTDLP_CONCURRENCY: int = 3
+    YTDLP_MAX_CONCURRENCY: int = 8
+    YTDLP_LATENCY_TARGET_S: float = 30.0
+    BREAKER_FAILURE_RATIO: float = 0.5        # Доля ошибок в окне из 20 вызовов, при которой цепь размыкается
+    BREAKER_MIN_CALLS: int = 5
+    BREAKER_OPEN_S: float = 30.0
+    BREAKER_MAX_OPEN_S: float = 300.0
+    SEARCH_STALE_TTL_S: int = 7 * 86400       # Сколько хранить выдачу на случай недоступности YTMusic
+
+    # Отдельные пулы потоков по классам нагрузки (поиск, метаданные, загрузки, файловый I/O)
+    EXECUTOR_SEARCH_WORKERS: int = 12
+    EXECUTOR_METADATA_WORKERS: int = 8
+    EXECUTOR_DOWNLOAD_WORKERS: int = 8
+    EXECUTOR_IO_WORKERS: int = 4
+    EXTRACT_IN_PROCESS: bool = False          # extract_info в процессном пуле (разбор yt-dlp нагружает CPU и держит GIL)
+    EXTRACT_PROCESS_WORKERS: int = 2
+
+    # Старт: тяжелые клиенты (yt-dlp, YTMusic) создаются лениво и прогреваются в фоне после вебхука
+    PREWARM_ENABLED: bool = True
+    STARTUP_BUDGET_S: float = 8.0             # Импорт + lifespan дольше — предупреждение в логе
+
     @field_validator("ADMIN_ID_LIST", mode="before")
     @classmethod
     def _assemble_admin_ids(cls, v, info) -> List[int]:
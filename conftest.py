@@ -6,6 +6,12 @@ from typing import AsyncGenerator
 # No application imports at module level
 
 
+@pytest.fixture(scope="session")
+def anyio_backend():
+    """Асинхронные тесты (@pytest.mark.anyio) и фикстуры идут на asyncio."""
+    return "asyncio"
+
+
 @pytest.fixture(scope="session")
 def test_settings():
     """
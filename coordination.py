@@ -0,0 +1,256 @@
+import asyncio
+import itertools
+import json
+import logging
+import os
+import socket
+import time
+import uuid
+from pathlib import Path
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Set, Tuple, Union
+
+import aiosqlite
+
+logger = logging.getLogger(__name__)
+
+Command = Tuple[int, Dict[str, Any]]
+
+
+def make_worker_id() -> str:
+    return f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:6]}"
+
+
+class LocalCoordinationBackend:
+    """Один процесс: аренды и команды в памяти. Поведение как до появления координации."""
+
+    def __init__(self):
+        self._leases: Dict[int, Tuple[str, float]] = {}
+        self._commands: List[Tuple[int, str, int, Dict[str, Any]]] = []
+        self._ids = itertools.count(1)
+
+    async def initialize(self):
+        pass
+
+    async def close(self):
+        pass
+
+    async def acquire(self, chat_id: int, owner: str, ttl_s: float) -> bool:
+        current = self._leases.get(chat_id)
+        if current and current[0] != owner and current[1] > time.time():
+            return False
+        self._leases[chat_id] = (owner, time.time() + ttl_s)
+        return True
+
+    async def renew(self, owner: str, ttl_s: float) -> Set[int]:
+        expires_at = time.time() + ttl_s
+        held = {chat_id for chat_id, (o, _) in self._leases.items() if o == owner}
+        for chat_id in held:
+            self._leases[chat_id] = (owner, expires_at)
+        return held
+
+    async def release(self, chat_id: int, owner: str):
+        if self._leases.get(chat_id, ("",))[0] == owner:
+            del self._leases[chat_id]
+
+    async def owner_of(self, chat_id: int) -> Optional[str]:
+        current = self._leases.get(chat_id)
+        return current[0] if current and current[1] > time.time() else None
+
+    async def send_command(self, owner: str, chat_id: int, command: Dict[str, Any]):
+        self._commands.append((next(self._ids), owner, chat_id, command))
+
+    async def take_commands(self, owner: str) -> List[Command]:
+        mine = [(chat_id, command) for _, o, chat_id, command in self._commands if o == owner]
+        self._commands = [c for c in self._commands if c[1] != owner]
+        return mine
+
+
+class SQLiteCoordinationBackend:
+    """
+    Аренды и очередь команд в общей SQLite-базе: подходит для нескольких воркеров uvicorn на одной машине.
+    Время — wall clock (time.time()), потому что сравнивается между процессами.
+    """
+
+    def __init__(self, db_path: Union[str, Path]):
+        self._db_path = Path(db_path)
+        self._db: Optional[aiosqlite.Connection] = None
+        self._lock = asyncio.Lock()
+
+    async def initialize(self):
+        self._db = await aiosqlite.connect(self._db_path)
+        # Несколько процессов пишут в один файл: ждем блокировку, а не падаем с "database is locked"
+        await self._db.execute("PRAGMA busy_timeout = 5000")
+        await self._db.executescript("""
+            CREATE TABLE IF NOT EXISTS radio_leases (
+                chat_id INTEGER PRIMARY KEY,
+                owner TEXT NOT NULL,
+                expires_at REAL NOT NULL
+            );
+            CREATE TABLE IF NOT EXISTS radio_commands (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                owner TEXT NOT NULL,
+                chat_id INTEGER NOT NULL,
+                command TEXT NOT NULL,
+                created_at REAL NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS idx_radio_commands_owner ON radio_commands(owner);
+        """)
+        await self._db.commit()
+        logger.info(f"Coordination backend initialized at {self._db_path}")
+
+    async def close(self):
+        if self._db:
+            await self._db.close()
+            self._db = None
+
+    async def acquire(self, chat_id: int, owner: str, ttl_s: float) -> bool:
+        now = time.time()
+        async with self._lock:
+            # Захват атомарный: строка меняется, только если аренда наша или уже истекла
+            await self._db.execute("""
+                INSERT INTO radio_leases (chat_id, owner, expires_at) VALUES (?, ?, ?)
+                ON CONFLICT(chat_id) DO UPDATE SET owner = excluded.owner, expires_at = excluded.expires_at
+                WHERE radio_leases.owner = excluded.owner OR radio_leases.expires_at < ?
+            """, (chat_id, owner, now + ttl_s, now))
+            await self._db.commit()
+            cursor = await self._db.execute("SELECT owner FROM radio_leases WHERE chat_id = ?", (chat_id,))
+            row = await cursor.fetchone()
+        return bool(row and row[0] == owner)
+
+    async def renew(self, owner: str, ttl_s: float) -> Set[int]:
+        now = time.time()
+        async with self._lock:
+            # Истекшую аренду не продлеваем: ее мог уже забрать другой воркер
+            await self._db.execute(
+                "UPDATE radio_leases SET expires_at = ? WHERE owner = ? AND expires_at >= ?", (now + ttl_s, owner, now))
+            await self._db.commit()
+            cursor = await self._db.execute(
+                "SELECT chat_id FROM radio_leases WHERE owner = ? AND expires_at >= ?", (owner, now))
+            rows = await cursor.fetchall()
+        return {row[0] for row in rows}
+
+    async def release(self, chat_id: int, owner: str):
+        async with self._lock:
+            await self._db.execute("DELETE FROM radio_leases WHERE chat_id = ? AND owner = ?", (chat_id, owner))
+            await self._db.commit()
+
+    async def owner_of(self, chat_id: int) -> Optional[str]:
+        async with self._lock:
+            cursor = await self._db.execute(
+                "SELECT owner FROM radio_leases WHERE chat_id = ? AND expires_at >= ?", (chat_id, time.time()))
+            row = await cursor.fetchone()
+        return row[0] if row else None
+
+    async def send_command(self, owner: str, chat_id: int, command: Dict[str, Any]):
+        async with self._lock:
+            await self._db.execute(
+                "INSERT INTO radio_commands (owner, chat_id, command, created_at) VALUES (?, ?, ?, ?)",
+                (owner, chat_id, json.dumps(command, ensure_ascii=False), time.time()))
+            await self._db.commit()
+
+    async def take_commands(self, owner: str) -> List[Command]:
+        async with self._lock:
+            cursor = await self._db.execute(
+                "SELECT id, chat_id, command FROM radio_commands WHERE owner = ? ORDER BY id", (owner,))
+            rows = await cursor.fetchall()
+            if rows:
+                await self._db.execute(f"DELETE FROM radio_commands WHERE id IN ({','.join('?' * len(rows))})", [r[0] for r in rows])
+                await self._db.commit()
+        return [(chat_id, json.loads(raw)) for _, chat_id, raw in rows]
+
+
+class Coordinator:
+    """
+    Владение радио-сессиями между воркерами: каждая сессия принадлежит одному воркеру по продлеваемой аренде.
+    Фоновый цикл продлевает аренды, забирает адресованные этому воркеру команды и раз в период
+    вызывает on_tick (подхват сессий упавших воркеров).
+    """
+
+    def __init__(self, backend: Any, worker_id: Optional[str] = None, lease_ttl_s: float = 30.0,
+                 renew_interval_s: float = 10.0, command_poll_s: float = 0.5):
+        self.backend = backend
+        self.worker_id = worker_id or make_worker_id()
+        self._lease_ttl_s = lease_ttl_s
+        self._renew_interval_s = renew_interval_s
+        self._command_poll_s = command_poll_s
+        self._held: Set[int] = set()
+        self._task: Optional[asyncio.Task] = None
+        self._on_lost: Optional[Callable[[int], Awaitable[None]]] = None
+        self._on_command: Optional[Callable[[int, Dict[str, Any]], Awaitable[None]]] = None
+        self._on_tick: Optional[Callable[[], Awaitable[None]]] = None
+        self.stats_counters: Dict[str, int] = {"acquired": 0, "lost": 0, "commands_sent": 0, "commands_received": 0}
+
+    async def acquire(self, chat_id: int) -> bool:
+        if not await self.backend.acquire(chat_id, self.worker_id, self._lease_ttl_s):
+            return False
+        if chat_id not in self._held: self.stats_counters["acquired"] += 1
+        self._held.add(chat_id)
+        return True
+
+    async def release(self, chat_id: int):
+        self._held.discard(chat_id)
+        await self.backend.release(chat_id, self.worker_id)
+
+    async def remote_owner(self, chat_id: int) -> Optional[str]:
+        """Живой владелец сессии, если это другой воркер."""
+        owner = await self.backend.owner_of(chat_id)
+        return owner if owner and owner != self.worker_id else None
+
+    async def send(self, owner: str, chat_id: int, op: str, **args: Any):
+        self.stats_counters["commands_sent"] += 1
+        await self.backend.send_command(owner, chat_id, {"op": op, **args})
+
+    def start(self, on_lost: Callable[[int], Awaitable[None]], on_command: Callable[[int, Dict[str, Any]], Awaitable[None]],
+              on_tick: Optional[Callable[[], Awaitable[None]]] = None):
+        self._on_lost, self._on_command, self._on_tick = on_lost, on_command, on_tick
+        self._task = asyncio.create_task(self._run())
+        logger.info(f"🤝 Coordinator started as {self.worker_id} ({type(self.backend).__name__})")
+
+    async def stop(self):
+        if self._task:
+            self._task.cancel()
+            try: await self._task
+            except asyncio.CancelledError: pass
+            self._task = None
+
+    async def _run(self):
+        last_renew = 0.0
+        while True:
+            try:
+                for chat_id, command in await self.backend.take_commands(self.worker_id):
+                    self.stats_counters["commands_received"] += 1
+                    await self._safe(self._on_command(chat_id, command), f"command {command} for {chat_id}")
+                if time.monotonic() - last_renew >= self._renew_interval_s:
+                    last_renew = time.monotonic()
+                    await self._renew()
+                    if self._on_tick: await self._safe(self._on_tick(), "tick")
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"[Coordinator] Loop error: {e}")
+            await asyncio.sleep(self._command_poll_s)
+
+    async def _renew(self):
+        held = await self.backend.renew(self.worker_id, self._lease_ttl_s)
+        # Аренда истекла (процесс подвис дольше TTL) и, возможно, уже у другого воркера: сессию здесь гасим
+        for chat_id in self._held - held:
+            self.stats_counters["lost"] += 1
+            logger.warning(f"[Coordinator] Lease for {chat_id} lost")
+            await self._safe(self._on_lost(chat_id), f"lease loss for {chat_id}")
+        self._held &= held
+
+    @staticmethod
+    async def _safe(coro: Awaitable[None], what: str):
+        try: await coro
+        except Exception as e: logger.error(f"[Coordinator] {what} failed: {e}")
+
+    def stats(self) -> Dict[str, Any]:
+        return {"worker_id": self.worker_id, "backend": type(self.backend).__name__, "leases": len(self._held), **self.stats_counters}
+
+
+def build_coordination_backend(kind: str, db_path: Union[str, Path]):
+    if kind == "sqlite":
+        return SQLiteCoordinationBackend(db_path)
+    if kind != "local":
+        logger.warning(f"Unknown coordination backend '{kind}', using local")
+    return LocalCoordinationBackend()
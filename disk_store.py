@@ -0,0 +1,267 @@
+import asyncio
+import json
+import logging
+import os
+import shutil
+import time
+import uuid
+from concurrent.futures import Executor
+from contextlib import AsyncExitStack, asynccontextmanager
+from pathlib import Path
+from typing import Any, AsyncIterator, Callable, Dict, List, Optional, Tuple
+
+from audio_formats import CODEC_BY_EXT, TARGET_TELEGRAM, TARGET_WEB, TELEGRAM_EXTS, WEB_EXTS
+
+try:
+    import fcntl
+except ImportError:  # Windows: только блокировка внутри процесса
+    fcntl = None
+
+logger = logging.getLogger(__name__)
+
+
+class DownloadLockTimeout(Exception):
+    pass
+
+
+class AudioStore:
+    """
+    Общая для процессов папка загрузок.
+    Протокол записи: advisory-блокировка на видео (.locks/<name>.lock, flock) -> запись во временную
+    папку (.tmp/) -> атомарный rename в <id>.<ext> -> манифест <id>.<ext>.json (размер, длительность, кодек).
+    Файл считается готовым только при наличии манифеста с совпадающим размером.
+    """
+
+    def __init__(self, directory: Path, lock_timeout_s: float = 120.0, poll_s: float = 0.1):
+        self.directory = Path(directory)
+        self._lock_dir = self.directory / ".locks"
+        self._tmp_dir = self.directory / ".tmp"
+        self._lock_timeout_s = lock_timeout_s
+        self._poll_s = poll_s
+        self._local_locks: Dict[str, asyncio.Lock] = {}
+        self._lock_users: Dict[str, int] = {}
+        self._listeners: List[Callable[[str], None]] = []
+        for d in (self.directory, self._lock_dir, self._tmp_dir):
+            d.mkdir(parents=True, exist_ok=True)
+
+    def add_listener(self, callback: Callable[[str], None]):
+        """callback(video_id) после каждой публикации/удаления варианта (сброс кэшей открытых файлов)."""
+        self._listeners.append(callback)
+
+    def _notify(self, video_id: str):
+        for callback in self._listeners:
+            try: callback(video_id)
+            except Exception as e: logger.warning(f"[Store] Listener failed for {video_id}: {e}")
+
+    # ==================== ЧТЕНИЕ ====================
+
+    def manifest_path(self, path: Path) -> Path:
+        return path.with_name(f"{path.name}.json")
+
+    def manifest(self, path: Path) -> Optional[Dict[str, Any]]:
+        try:
+            with open(self.manifest_path(path), "r", encoding="utf-8") as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def is_complete(self, path: Path) -> bool:
+        manifest = self.manifest(path)
+        try:
+            return bool(manifest) and path.stat().st_size == manifest.get("size")
+        except OSError:
+            return False
+
+    def find(self, video_id: str, target: str, max_bytes: Optional[int] = None) -> Optional[Path]:
+        """Опубликованный файл для получателя: для веба любой нативный вариант, для Telegram — MP3/M4A в лимите."""
+        for ext in (TELEGRAM_EXTS if target == TARGET_TELEGRAM else WEB_EXTS):
+            path = self.directory / f"{video_id}.{ext}"
+            manifest = self.manifest(path)
+            if not manifest: continue
+            try:
+                size = path.stat().st_size
+            except OSError:
+                continue
+            if size == manifest.get("size") and (max_bytes is None or size <= max_bytes):
+                return path
+        return None
+
+    # ==================== ЗАПИСЬ ====================
+
+    @asynccontextmanager
+    async def lock(self, name: str, timeout_s: Optional[float] = None, blocking: bool = True) -> AsyncIterator[None]:
+        """
+        Эксклюзивная блокировка имени (видео или его варианта) между процессами и корутинами.
+        blocking=False: если занято — сразу DownloadLockTimeout.
+        """
+        local = self._local_locks.setdefault(name, asyncio.Lock())
+        # Счетчик держателей и ждущих: запись удаляется, когда имя никому не нужно
+        self._lock_users[name] = self._lock_users.get(name, 0) + 1
+        try:
+            if not blocking and local.locked(): raise DownloadLockTimeout(name)
+            timeout_s = self._lock_timeout_s if timeout_s is None else timeout_s
+            try:
+                await asyncio.wait_for(local.acquire(), timeout=timeout_s)
+            except asyncio.TimeoutError:
+                raise DownloadLockTimeout(name)
+            fd = None
+            try:
+                if fcntl:
+                    lock_path = self._lock_dir / f"{name}.lock"
+                    fd = os.open(lock_path, os.O_RDWR | os.O_CREAT, 0o644)
+                    deadline = time.monotonic() + timeout_s
+                    while True:
+                        try:
+                            fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                        except BlockingIOError:
+                            # Файл качает другой процесс: ждем, не блокируя event loop
+                            if not blocking or time.monotonic() > deadline: raise DownloadLockTimeout(name)
+                            await asyncio.sleep(self._poll_s)
+                            continue
+                        if self._is_current(fd, lock_path):
+                            break
+                        # Пока ждали, evict() удалил файл блокировки: берем блокировку на новом файле
+                        os.close(fd)
+                        fd = None
+                        fd = os.open(lock_path, os.O_RDWR | os.O_CREAT, 0o644)
+                yield
+            finally:
+                if fd is not None:
+                    # Закрытие дескриптора снимает flock (и при падении процесса тоже)
+                    os.close(fd)
+                local.release()
+        finally:
+            self._lock_users[name] -= 1
+            if not self._lock_users[name]:
+                del self._lock_users[name]
+                del self._local_locks[name]
+
+    @staticmethod
+    def _is_current(fd: int, path: Path) -> bool:
+        try:
+            return os.fstat(fd).st_ino == os.stat(path).st_ino
+        except FileNotFoundError:
+            return False
+
+    def is_locked(self, name: str) -> bool:
+        """Занято ли имя сейчас (этим или другим процессом); проверка без ожидания."""
+        if (local := self._local_locks.get(name)) and local.locked():
+            return True
+        if not fcntl:
+            return False
+        try:
+            fd = os.open(self._lock_dir / f"{name}.lock", os.O_RDWR)
+        except FileNotFoundError:
+            return False
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            return True
+        finally:
+            # Закрытие снимает пробную блокировку, если она взялась
+            os.close(fd)
+        return False
+
+    def temp_dir(self, name: str) -> Path:
+        path = self._tmp_dir / f"{name}.{uuid.uuid4().hex[:8]}"
+        path.mkdir(parents=True, exist_ok=True)
+        return path
+
+    def temp_path(self, name: str) -> Path:
+        return self._tmp_dir / f"{name}.{uuid.uuid4().hex[:8]}"
+
+    def publish(self, tmp_path: Path, video_id: str, ext: str, duration: Optional[int] = None, source: str = "") -> Path:
+        """Атомарно переносит готовый файл на место и пишет манифест (он и есть признак готовности)."""
+        final_path = self.directory / f"{video_id}.{ext}"
+        manifest = {
+            "video_id": video_id,
+            "ext": ext,
+            "codec": CODEC_BY_EXT.get(ext, ext),
+            "size": tmp_path.stat().st_size,
+            "duration": duration,
+            "source": source,
+            "created_at": time.time(),
+        }
+        # Сначала убираем старый манифест: между rename и записью нового файл не должен выглядеть готовым
+        self._unlink(self.manifest_path(final_path))
+        os.replace(tmp_path, final_path)
+        manifest_tmp = self.temp_path(f"{video_id}.{ext}.json")
+        with open(manifest_tmp, "w", encoding="utf-8") as f:
+            json.dump(manifest, f)
+        os.replace(manifest_tmp, self.manifest_path(final_path))
+        self._notify(video_id)
+        return final_path
+
+    def remove(self, path: Path):
+        """Удаление варианта вместе с манифестом (манифест первым: файл сразу перестает считаться готовым)."""
+        self._unlink(self.manifest_path(path))
+        self._unlink(path)
+        self._notify(path.name.split(".")[0])
+
+    # ==================== ОЧИСТКА ====================
+
+    async def evict(self, max_age_s: float, executor: Optional[Executor] = None) -> int:
+        """
+        Удаляет варианты старше max_age_s (по created_at манифеста), брошенные временные файлы
+        и файлы блокировок. Занятые видео пропускаются; каталог сканируется в executor.
+        Возвращает число удаленных вариантов.
+        """
+        loop = asyncio.get_running_loop()
+        expired, stale_tmp = await loop.run_in_executor(executor, self._expired, time.time() - max_age_s)
+        for path in stale_tmp:
+            await loop.run_in_executor(executor, self.discard, path)
+        removed = 0
+        for video_id, paths in expired.items():
+            try:
+                async with AsyncExitStack() as stack:
+                    # Все имена видео (нативный файл, mp3, веб-поток): никто не должен писать или ждать их
+                    names = (video_id, f"{video_id}.mp3", f"{video_id}.stream")
+                    for name in names:
+                        await stack.enter_async_context(self.lock(name, blocking=False))
+                    for path in paths:
+                        # Могли перекачать, пока шло сканирование
+                        if (manifest := self.manifest(path)) and manifest.get("created_at", 0) < time.time() - max_age_s:
+                            self.remove(path)
+                            removed += 1
+                    if not self.find(video_id, TARGET_WEB) and not self.find(video_id, TARGET_TELEGRAM):
+                        # Удаляем под самой блокировкой: ждущие ее увидят подмену файла и откроют новый
+                        for name in names:
+                            self._unlink(self._lock_dir / f"{name}.lock")
+            except DownloadLockTimeout:
+                continue
+        if removed: logger.info(f"[Store] Evicted {removed} files older than {max_age_s:.0f}s")
+        return removed
+
+    def _expired(self, cutoff: float) -> Tuple[Dict[str, List[Path]], List[Path]]:
+        expired: Dict[str, List[Path]] = {}
+        published = set()
+        for manifest_path in self.directory.glob("*.json"):
+            path = manifest_path.with_suffix("")
+            video_id = path.name.split(".")[0]
+            manifest = self.manifest(path)
+            if manifest and manifest.get("created_at", 0) < cutoff:
+                expired.setdefault(video_id, []).append(path)
+            else:
+                published.add(video_id)
+        # Блокировки неудачных загрузок: файла нет, а .lock остался
+        for lock_path in self._lock_dir.glob("*.lock"):
+            video_id = lock_path.name.split(".")[0]
+            if video_id not in published and self._mtime(lock_path) < cutoff:
+                expired.setdefault(video_id, [])
+        stale_tmp = [p for p in self._tmp_dir.iterdir() if self._mtime(p) < cutoff]
+        return expired, stale_tmp
+
+    @staticmethod
+    def _mtime(path: Path) -> float:
+        try: return path.stat().st_mtime
+        except OSError: return float("inf")
+
+    def discard(self, path: Path):
+        if path.is_dir(): shutil.rmtree(path, ignore_errors=True)
+        else: self._unlink(path)
+
+    @staticmethod
+    def _unlink(path: Path):
+        try: path.unlink()
+        except FileNotFoundError: pass
+        except OSError as e: logger.warning(f"[Store] Cannot remove {path}: {e}")
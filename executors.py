@@ -0,0 +1,109 @@
+import asyncio
+import logging
+import multiprocessing
+import threading
+from concurrent.futures import Executor, Future, ProcessPoolExecutor, ThreadPoolExecutor
+from typing import Any, Callable, Dict, Optional
+
+from metrics import EXECUTOR_QUEUE_DEPTH, EXECUTOR_UTILIZATION
+
+logger = logging.getLogger(__name__)
+
+# Классы нагрузки: долгие загрузки не должны занимать потоки быстрых поисков и чтения файлов
+SEARCH, METADATA, DOWNLOAD, IO, EXTRACT = "search", "metadata", "download", "io", "extract"
+
+
+class TrackedExecutor(Executor):
+    """Обертка пула: считает отправленные и незавершенные задачи (очередь = сверх max_workers)."""
+
+    def __init__(self, name: str, executor: Executor, max_workers: int):
+        self.name = name
+        self.executor = executor
+        self.max_workers = max_workers
+        self.in_flight = 0
+        self.completed = 0
+        # done-колбэки приходят из потоков пула
+        self._lock = threading.Lock()
+
+    def submit(self, fn: Callable[..., Any], /, *args: Any, **kwargs: Any) -> Future:
+        future = self.executor.submit(fn, *args, **kwargs)
+        with self._lock:
+            self.in_flight += 1
+        self._publish()
+        future.add_done_callback(self._on_done)
+        return future
+
+    def _on_done(self, _: Future):
+        with self._lock:
+            self.in_flight -= 1
+            self.completed += 1
+        self._publish()
+
+    def shutdown(self, wait: bool = True, *, cancel_futures: bool = False):
+        self.executor.shutdown(wait=wait, cancel_futures=cancel_futures)
+
+    @property
+    def busy(self) -> int:
+        return min(self.in_flight, self.max_workers)
+
+    @property
+    def queue_depth(self) -> int:
+        return max(0, self.in_flight - self.max_workers)
+
+    def _publish(self):
+        EXECUTOR_QUEUE_DEPTH.set(self.queue_depth, executor=self.name)
+        EXECUTOR_UTILIZATION.set(self.busy / self.max_workers, executor=self.name)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "kind": "process" if isinstance(self.executor, ProcessPoolExecutor) else "thread",
+            "max_workers": self.max_workers, "busy": self.busy, "queue_depth": self.queue_depth,
+            "utilization": round(self.busy / self.max_workers, 2), "completed": self.completed,
+        }
+
+
+class Executors:
+    """
+    Именованные пулы по классам нагрузки, размеры из Settings.
+    extract — процессный пул для CPU-тяжелого разбора yt-dlp (вне GIL), если включен;
+    иначе извлечение идет в потоковый пул metadata.
+    """
+
+    def __init__(self, sizes: Dict[str, int], extract_processes: int = 0):
+        self._pools: Dict[str, TrackedExecutor] = {
+            name: TrackedExecutor(name, ThreadPoolExecutor(max_workers=size, thread_name_prefix=f"pool-{name}"), size)
+            for name, size in sizes.items()
+        }
+        if extract_processes > 0:
+            # spawn: fork процесса с потоками (loop, пулы) небезопасен
+            pool = ProcessPoolExecutor(max_workers=extract_processes, mp_context=multiprocessing.get_context("spawn"))
+            self._pools[EXTRACT] = TrackedExecutor(EXTRACT, pool, extract_processes)
+
+    @classmethod
+    def from_settings(cls, settings: Any) -> "Executors":
+        return cls(
+            {
+                SEARCH: settings.EXECUTOR_SEARCH_WORKERS,
+                METADATA: settings.EXECUTOR_METADATA_WORKERS,
+                DOWNLOAD: settings.EXECUTOR_DOWNLOAD_WORKERS,
+                IO: settings.EXECUTOR_IO_WORKERS,
+            },
+            extract_processes=settings.EXTRACT_PROCESS_WORKERS if settings.EXTRACT_IN_PROCESS else 0,
+        )
+
+    def has(self, name: str) -> bool:
+        return name in self._pools
+
+    def get(self, name: str) -> Optional[TrackedExecutor]:
+        return self._pools.get(name)
+
+    def run(self, name: str, fn: Callable[..., Any], *args: Any) -> "asyncio.Future[Any]":
+        """Как loop.run_in_executor, но в пул name (неизвестное имя — пул по умолчанию)."""
+        return asyncio.get_running_loop().run_in_executor(self._pools.get(name), fn, *args)
+
+    def stats(self) -> Dict[str, Dict[str, Any]]:
+        return {name: pool.stats() for name, pool in self._pools.items()}
+
+    def shutdown(self, wait: bool = False):
+        for pool in self._pools.values():
+            pool.shutdown(wait=wait, cancel_futures=True)
@@ -14,8 +14,9 @@ from telegram.ext import (
 
 from radio import RadioManager
 from config import Settings
-from catalog import MUSIC_CATALOG # Импорт из нового файла
+from catalog import CATALOG_INDEX
 from youtube import YouTubeDownloader
+from metrics import UPLOAD
 from keyboards import (
     get_track_search_keyboard, 
     get_pagination_keyboard, 
@@ -120,18 +121,15 @@ async def button_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
     elif data == "main_menu_genres":
         await query.edit_message_text("🗂 *Жанры:*", parse_mode=ParseMode.MARKDOWN, reply_markup=get_main_menu_keyboard())
     elif data.startswith("cat|"):
-        path_str = data[4:]
-        if not path_str: await start(update, context); return
-        await query.edit_message_text(f"💿 *{path_str.split('|')[-1]}:*", parse_mode=ParseMode.MARKDOWN, reply_markup=get_subcategory_keyboard(path_str))
+        node = CATALOG_INDEX.resolve(data[4:])
+        if not node or node.is_leaf: await start(update, context); return
+        await query.edit_message_text(f"💿 *{node.name}:*", parse_mode=ParseMode.MARKDOWN, reply_markup=get_subcategory_keyboard(node.node_id))
     elif data.startswith("play_cat|"):
-        path = data[9:].split('|')
-        try:
-            current = MUSIC_CATALOG
-            for p in path[:-1]: current = current[p]
-            q = current[path[-1]]
-        except: q = " ".join(path)
-        await query.edit_message_text(f"🎵 Играет: *{path[-1]}*...", parse_mode=ParseMode.MARKDOWN)
-        asyncio.create_task(context.application.radio_manager.start(query.message.chat.id, str(q), query.message.chat.type))
+        node = CATALOG_INDEX.resolve(data[9:])
+        if node and node.is_leaf: q, name = node.query, node.name
+        else: q = name = " ".join(data[9:].split('|'))
+        await query.edit_message_text(f"🎵 Играет: *{name}*...", parse_mode=ParseMode.MARKDOWN)
+        asyncio.create_task(context.application.radio_manager.start(query.message.chat.id, q, query.message.chat.type, display_name=name))
     elif data == "play_random":
         await query.edit_message_text("🎲 Рандом...")
         asyncio.create_task(context.application.radio_manager.start(query.message.chat.id, "random", query.message.chat.type))
@@ -153,9 +151,9 @@ async def _send_track(context: ContextTypes.DEFAULT_TYPE, chat_id: int, video_id
         if res.file_id:
             await context.bot.send_audio(chat_id, audio=res.file_id, title=res.track_info.title, performer=res.track_info.artist)
         elif res.file_path:
-            with open(res.file_path, 'rb') as f:
+            with open(res.file_path, 'rb') as f, UPLOAD.time(via="command"):
                 msg = await context.bot.send_audio(chat_id, f, title=res.track_info.title, performer=res.track_info.artist)
-                if msg.audio: await dl.cache_file_id(video_id, msg.audio.file_id)
+            if msg.audio: await dl.cache_file_id(video_id, msg.audio.file_id)
     finally:
         # Убрали os.unlink, теперь файл остается для Web Player
         pass
@@ -1,46 +1,44 @@
+from typing import Dict
+
 from telegram import InlineKeyboardButton, InlineKeyboardMarkup
-from catalog import MUSIC_CATALOG # Импорт из нового файла
+from catalog import CATALOG_INDEX, CatalogIndex
 
-def get_main_menu_keyboard():
-    """Генерирует клавиатуру главного меню."""
-    categories = list(MUSIC_CATALOG.keys())
-    keyboard = []
-    for cat in categories:
-        # Используем полный путь в callback_data
-        cb = f"cat|{cat}"
-        keyboard.append([InlineKeyboardButton(cat, callback_data=cb)])
-    keyboard.append([InlineKeyboardButton("🎲 Случайный микс", callback_data="play_random")])
-    return InlineKeyboardMarkup(keyboard)
 
-def get_subcategory_keyboard(path_str: str):
-    """Генерирует клавиатуру для подкатегорий на основе полного пути."""
-    try:
-        path = path_str.split('|')
-        current_level = MUSIC_CATALOG
-        for p in path:
-            current_level = current_level[p]
-    except KeyError:
-        return InlineKeyboardMarkup([[InlineKeyboardButton("❌ Ошибка меню", callback_data="main_menu")]])
+def _build_menu_keyboards(index: CatalogIndex) -> Dict[str, InlineKeyboardMarkup]:
+    """Все клавиатуры каталога строятся один раз: callback_data содержит только короткий ID узла."""
+    keyboards: Dict[str, InlineKeyboardMarkup] = {}
 
-    keyboard = []
-    for name, val in current_level.items():
-        # Сокращаем путь для кнопок, если он слишком длинный
-        full_path = f"{path_str}|{name}"
-        
-        # Если это папка (dict)
-        if isinstance(val, dict):
-            cb = f"cat|{full_path}"
-            if len(cb.encode()) <= 64:
-                keyboard.append([InlineKeyboardButton(f"📂 {name}", callback_data=cb)])
-        else:
-            cb = f"play_cat|{full_path}"
-            if len(cb.encode()) <= 64:
-                keyboard.append([InlineKeyboardButton(f"▶️ {name}", callback_data=cb)])
-            
-    # Кнопка назад
-    keyboard.append([InlineKeyboardButton("🔙 Назад", callback_data="main_menu_genres")])
-        
-    return InlineKeyboardMarkup(keyboard)
+    main_rows = [[InlineKeyboardButton(index.nodes[nid].name, callback_data=f"cat|{nid}")] for nid in index.roots]
+    main_rows.append([InlineKeyboardButton("🎲 Случайный микс", callback_data="play_random")])
+    keyboards[""] = InlineKeyboardMarkup(main_rows)
+
+    for node in index.nodes.values():
+        if node.is_leaf:
+            continue
+        rows = []
+        for child_id in node.children:
+            child = index.nodes[child_id]
+            if child.is_leaf:
+                rows.append([InlineKeyboardButton(f"▶️ {child.name}", callback_data=f"play_cat|{child_id}")])
+            else:
+                rows.append([InlineKeyboardButton(f"📂 {child.name}", callback_data=f"cat|{child_id}")])
+        # Кнопка назад ведет на уровень выше
+        back_cb = f"cat|{node.parent_id}" if node.parent_id else "main_menu_genres"
+        rows.append([InlineKeyboardButton("🔙 Назад", callback_data=back_cb)])
+        keyboards[node.node_id] = InlineKeyboardMarkup(rows)
+    return keyboards
+
+
+_MENU_KEYBOARDS = _build_menu_keyboards(CATALOG_INDEX)
+_ERROR_KEYBOARD = InlineKeyboardMarkup([[InlineKeyboardButton("❌ Ошибка меню", callback_data="main_menu_genres")]])
+
+def get_main_menu_keyboard():
+    """Клавиатура главного меню (предсобранная)."""
+    return _MENU_KEYBOARDS[""]
+
+def get_subcategory_keyboard(node_id: str):
+    """Клавиатура подкатегории по ID узла каталога (предсобранная)."""
+    return _MENU_KEYBOARDS.get(node_id, _ERROR_KEYBOARD)
 
 # ========= ФУНКЦИИ ДЛЯ ПОИСКА (ОСТАЮТСЯ БЕЗ ИЗМЕНЕНИЙ) =========
 def get_track_search_keyboard(tracks, page: int = 1):
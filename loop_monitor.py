@@ -0,0 +1,121 @@
+import asyncio
+import logging
+import sys
+import threading
+import time
+import traceback
+from collections import deque
+from typing import Any, Deque, Dict, List, Optional, Tuple
+
+from metrics import LOOP_LAG
+
+logger = logging.getLogger(__name__)
+
+
+def _percentile(values: List[float], pct: float) -> float:
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, round(pct / 100 * (len(ordered) - 1)))]
+
+
+def executor_stats(executor: Any) -> Dict[str, Any]:
+    """Очередь и загрузка ThreadPoolExecutor (через приватные поля, без них — пусто)."""
+    if executor is None:
+        return {"max_workers": 0, "threads": 0, "queue_depth": 0}
+    work_queue = getattr(executor, "_work_queue", None)
+    return {
+        "max_workers": getattr(executor, "_max_workers", 0),
+        "threads": len(getattr(executor, "_threads", ())),
+        "queue_depth": work_queue.qsize() if work_queue is not None else 0,
+    }
+
+
+class LoopMonitor:
+    """
+    Фоновый замер задержки event loop: задача спит interval_s и смотрит, насколько проснулась позже.
+    Опционально поток-сторож снимает стек потока loop, если тот не отвечает дольше slow_callback_s.
+    """
+
+    def __init__(self, interval_s: float = 0.5, window: int = 600, slow_callback_s: Optional[float] = None):
+        self.interval_s = interval_s
+        self.slow_callback_s = slow_callback_s
+        self._samples: Deque[Tuple[float, float]] = deque(maxlen=window)
+        self._offenders: Deque[Dict[str, Any]] = deque(maxlen=10)
+        self._heartbeat = time.monotonic()
+        self._task: Optional[asyncio.Task] = None
+        self._watchdog: Optional[threading.Thread] = None
+        self._stop = threading.Event()
+        self._loop_thread_id: Optional[int] = None
+
+    def start(self):
+        if self._task:
+            return
+        self._loop_thread_id = threading.get_ident()
+        self._heartbeat = time.monotonic()
+        self._task = asyncio.create_task(self._sample_loop())
+        if self.slow_callback_s:
+            self._stop.clear()
+            self._watchdog = threading.Thread(target=self._watch, name="loop-watchdog", daemon=True)
+            self._watchdog.start()
+        logger.info(f"Loop monitor started (interval={self.interval_s}s, slow_callback={self.slow_callback_s})")
+
+    async def stop(self):
+        self._stop.set()
+        if self._task:
+            self._task.cancel()
+            try: await self._task
+            except asyncio.CancelledError: pass
+            self._task = None
+
+    async def _sample_loop(self):
+        while True:
+            started = time.perf_counter()
+            await asyncio.sleep(self.interval_s)
+            lag = max(0.0, time.perf_counter() - started - self.interval_s)
+            self._heartbeat = time.monotonic()
+            self._samples.append((self._heartbeat, lag))
+            LOOP_LAG.observe(lag)
+
+    def _watch(self):
+        """Поток-сторож: если loop молчит дольше порога, логируем, чем он занят."""
+        reported_heartbeat = None
+        check_every = max(0.05, self.slow_callback_s / 4)
+        while not self._stop.wait(check_every):
+            heartbeat = self._heartbeat
+            stalled = time.monotonic() - heartbeat - self.interval_s
+            if stalled < self.slow_callback_s or heartbeat == reported_heartbeat:
+                continue
+            reported_heartbeat = heartbeat
+            frame = sys._current_frames().get(self._loop_thread_id)
+            if frame is None:
+                continue
+            stack = traceback.format_stack(frame)
+            self._offenders.append({
+                "at": time.strftime("%Y-%m-%dT%H:%M:%S"),
+                "stalled_s": round(stalled, 3),
+                "where": stack[-1].strip().splitlines()[0] if stack else "?",
+            })
+            logger.warning(f"🐢 Event loop blocked for {stalled:.2f}s:\n{''.join(stack[-12:])}")
+
+    @property
+    def current_stall_s(self) -> float:
+        """Сколько loop не отвечает прямо сейчас (0, если сэмплер идет по графику)."""
+        return max(0.0, time.monotonic() - self._heartbeat - self.interval_s)
+
+    def max_lag(self, window_s: float) -> float:
+        since = time.monotonic() - window_s
+        recent = [lag for ts, lag in self._samples if ts >= since]
+        return max(recent + [self.current_stall_s])
+
+    def stats(self) -> Dict[str, Any]:
+        lags = [lag for _, lag in self._samples]
+        return {
+            "samples": len(lags),
+            "p50_ms": round(_percentile(lags, 50) * 1000, 2),
+            "p90_ms": round(_percentile(lags, 90) * 1000, 2),
+            "p99_ms": round(_percentile(lags, 99) * 1000, 2),
+            "max_ms": round(max(lags) * 1000, 2) if lags else 0.0,
+            "current_stall_ms": round(self.current_stall_s * 1000, 2),
+            "slow_callbacks": list(self._offenders),
+        }
@@ -1,65 +1,124 @@
+import time
+_import_started = time.perf_counter()
 import logging
 import asyncio
 from contextlib import asynccontextmanager
-import time
 from datetime import timedelta
-from typing import List
-import os
 import json
-import re
-
-# Условный импорт Google
-try:
-    import google.generativeai as genai
-    HAS_AI_LIB = True
-except ImportError:
-    HAS_AI_LIB = False
-    print("⚠️ Google GenAI lib not found. AI features disabled.")
-
-from fastapi import FastAPI, Request
-from fastapi.responses import RedirectResponse, JSONResponse, FileResponse
+from typing import List, Optional
+
+from fastapi import FastAPI, Request, Depends, Query
+from fastapi.responses import RedirectResponse, JSONResponse, FileResponse, Response, StreamingResponse
 from fastapi.staticfiles import StaticFiles
 from fastapi.middleware.cors import CORSMiddleware
+from starlette.background import BackgroundTask
 from telegram import Update
 from telegram.ext import Application
+from pydantic import BaseModel, Field
 
 from config import get_settings, Settings
+from dependencies import get_settings_dep
 from logging_setup import setup_logging
 from radio import RadioManager
 from youtube import YouTubeDownloader
 from handlers import setup_handlers
 from cache_service import CacheService
+from session_store import SessionStore
+from coordination import Coordinator, build_coordination_backend
+from track_index import TrackIndex
+from response_cache import ResponseCache, etag_matches, make_etag
+from text_keys import canonicalize_query
+from audio_formats import AUDIO_MIME_TYPES, TARGET_WEB, audio_mime_type
+from loop_monitor import LoopMonitor, executor_stats
+from executors import IO, Executors
+from audio_serving import AudioFileResponse, OpenFileCache
+from thumbnails import VIDEO_ID_RE, HttpThumbnailFetcher, ThumbnailCache
 from models import TrackInfo
-
-# Настройка AI
-GEMINI_KEY = os.getenv("GEMINI_API_KEY")
-if GEMINI_KEY and HAS_AI_LIB:
-    try:
-        genai.configure(api_key=GEMINI_KEY)
-    except Exception as e:
-        print(f"⚠️ Gemini Config Error: {e}")
+from ai_dj import AIDJService, build_ai_dj
+import metrics
 
 logger = logging.getLogger(__name__)
 _start_time = time.time()
+_imports_s = time.perf_counter() - _import_started
 
 def get_uptime():
     return str(timedelta(seconds=int(time.time() - _start_time)))
 
+def startup_report(settings: Settings, lifespan_started: float) -> dict:
+    """Куда ушло время старта: импорт модулей и lifespan до готовности. Сверх бюджета — предупреждение."""
+    lifespan_s = time.perf_counter() - lifespan_started
+    report = {
+        "imports_s": round(_imports_s, 3),
+        "lifespan_s": round(lifespan_s, 3),
+        "total_s": round(_imports_s + lifespan_s, 3),
+        "budget_s": settings.STARTUP_BUDGET_S,
+    }
+    for phase in ("imports", "lifespan", "total"):
+        metrics.STARTUP_SECONDS.set(report[f"{phase}_s"], phase=phase)
+    if report["total_s"] > settings.STARTUP_BUDGET_S:
+        logger.warning(f"🐢 Startup took {report['total_s']}s (budget {settings.STARTUP_BUDGET_S}s): {report}")
+    else:
+        logger.info(f"✅ Ready in {report['total_s']}s (imports {report['imports_s']}s)")
+    return report
+
 @asynccontextmanager
 async def lifespan(app: FastAPI):
     """Жизненный цикл приложения."""
+    lifespan_started = time.perf_counter()
     setup_logging()
     logger.info("⚡ Application starting up...")
     
     settings: Settings = get_settings()
+    metrics.configure(settings.METRICS_ENABLED)
+    
+    loop_monitor = None
+    if settings.LOOP_MONITOR_ENABLED:
+        loop_monitor = LoopMonitor(
+            interval_s=settings.LOOP_LAG_INTERVAL_S,
+            slow_callback_s=settings.LOOP_SLOW_CALLBACK_S if settings.LOOP_SLOW_CALLBACK_REPORT else None
+        )
+        loop_monitor.start()
+    app.state.loop_monitor = loop_monitor
+    
     settings.DOWNLOADS_DIR.mkdir(parents=True, exist_ok=True)
     settings.TEMP_AUDIO_DIR.mkdir(parents=True, exist_ok=True)
     
     cache = CacheService(settings.CACHE_DB_PATH)
     await cache.initialize()
     
-    downloader = YouTubeDownloader(settings, cache)
+    session_store = SessionStore(settings.CACHE_DB_PATH)
+    await session_store.initialize()
+    
+    coordination_backend = build_coordination_backend(settings.COORDINATION_BACKEND, settings.CACHE_DB_PATH)
+    await coordination_backend.initialize()
+    coordinator = Coordinator(
+        coordination_backend,
+        lease_ttl_s=settings.LEASE_TTL_S,
+        renew_interval_s=settings.LEASE_RENEW_INTERVAL_S,
+        command_poll_s=settings.COMMAND_POLL_INTERVAL_S,
+    )
+    app.state.coordinator = coordinator
+    
+    track_index = TrackIndex(settings.CACHE_DB_PATH)
+    await track_index.initialize()
+    
+    executors = Executors.from_settings(settings)
+    app.state.executors = executors
+    
+    downloader = YouTubeDownloader(settings, cache, track_index=track_index, executors=executors)
     app.state.downloader = downloader
+    app.state.audio_files = OpenFileCache(
+        downloader.audio_store, max_entries=settings.AUDIO_FD_CACHE_SIZE, revalidate_s=settings.AUDIO_FD_REVALIDATE_S
+    )
+    app.state.thumbnails = ThumbnailCache(
+        settings.THUMB_CACHE_DIR, fetcher=HttpThumbnailFetcher(settings.THUMB_FETCH_TIMEOUT_S),
+        resolver=track_index.thumbnail_url, max_bytes=settings.THUMB_CACHE_MAX_MB * 1024 * 1024,
+        executor=executors.get(IO),
+    )
+    app.state.ai_dj = build_ai_dj(settings)
+    app.state.response_cache = ResponseCache(
+        max_entries=settings.RESPONSE_CACHE_MAX_ENTRIES, ttl_s=settings.RESPONSE_CACHE_TTL_S
+    )
     
     builder = Application.builder().token(settings.BOT_TOKEN)
     if settings.PROXY_URL:
@@ -71,7 +130,9 @@ async def lifespan(app: FastAPI):
     radio_manager = RadioManager(
         bot=tg_app.bot,
         settings=settings,
-        downloader=downloader
+        downloader=downloader,
+        store=session_store,
+        coordinator=coordinator
     )
     
     setup_handlers(
@@ -96,6 +157,19 @@ async def lifespan(app: FastAPI):
     await tg_app.bot.set_webhook(url=webhook_url)
     logger.info(f"✅ Bot started. Webhook: {webhook_url}")
     
+    await radio_manager.resume_all()
+    radio_manager.start_coordination()
+    
+    # Клиенты YTMusic/yt-dlp создаются лениво; прогрев — уже после регистрации вебхука, не задерживая готовность
+    if settings.PREWARM_ENABLED:
+        app.state.prewarm_task = asyncio.create_task(downloader.prewarm())
+    # Нативные файлы переиспользуются и не удаляются после отправки: диск держит в рамках очистка по возрасту
+    app.state.evict_task = asyncio.create_task(downloader.evict_loop())
+    
+    app.state.startup = startup_report(settings, lifespan_started)
+    
+    metrics.ACTIVE_SESSIONS.set_function(lambda: radio_manager.active_sessions)
+    
     app.state.tg_app = tg_app
     app.state.radio_manager = radio_manager
     app.state.cache = cache
@@ -103,10 +177,19 @@ async def lifespan(app: FastAPI):
     yield
     
     logger.info("🛑 Shutting down...")
+    if prewarm_task := getattr(app.state, "prewarm_task", None): prewarm_task.cancel()
+    app.state.evict_task.cancel()
     await radio_manager.stop_all()
     await tg_app.stop()
     await tg_app.shutdown()
+    await coordination_backend.close()
+    await session_store.close()
+    await track_index.close()
     await cache.close()
+    app.state.audio_files.close_all()
+    await app.state.thumbnails.close()
+    executors.shutdown(wait=False)
+    if loop_monitor: await loop_monitor.stop()
     logger.info("✅ Shutdown complete.")
 
 # 🔥 Инициализация app ПЕРЕД роутами
@@ -121,74 +204,247 @@ app.add_middleware(
 )
 
 @app.get("/api/ai/dj")
-async def ai_dj_generate(prompt: str):
-    if not GEMINI_KEY or not HAS_AI_LIB:
+async def ai_dj_generate(prompt: str, request: Request):
+    ai_dj: Optional[AIDJService] = getattr(request.app.state, "ai_dj", None)
+    if not ai_dj:
         return {"error": "AI Brain not connected"}
 
-    print(f"[AI] Получен запрос: {prompt}")
-
-    system_instruction = """
-    Ты — DJ Aurora. Твоя задача:
-    1. Подобрать 5 идеальных треков под запрос.
-    2. Написать короткое интро (1 фраза).
-    Верни ответ ТОЛЬКО в формате JSON:
-    {"intro": "...", "tracks": ["Artist - Title"]}
-    """
-
+    logger.info(f"[AI] Получен запрос: {prompt}")
     try:
-        model = genai.GenerativeModel('gemini-1.5-flash')
-        response = model.generate_content(f"{system_instruction}\n\nЗапрос: {prompt}")
-        clean_text = re.sub(r"```json|```", "", response.text).strip()
-        data = json.loads(clean_text)
-        
-        playlist = []
-        for track_name in data.get("tracks", []):
-            playlist.append({
-                "title": track_name,
-                "artist": "AI Selection",
-                "query": track_name
-            })
-
-        return {
-            "dj_intro": data.get("intro", "Система готова."),
-            "playlist": playlist
-        }
-
+        return await ai_dj.generate(prompt)
+    except asyncio.TimeoutError:
+        logger.warning(f"[AI] Таймаут для '{prompt}'")
+        return JSONResponse(status_code=504, content={"error": "AI timeout"})
     except Exception as e:
-        print(f"[AI Error] {e}")
+        logger.error(f"[AI Error] {e}")
         return JSONResponse(status_code=500, content={"error": str(e)})
 
-@app.get("/audio/{video_id}.mp3")
-async def get_audio_file(video_id: str, request: Request):
+def preload_headers(next_id: Optional[str]) -> dict:
+    """
+    Link-подсказки: следующий трек и его обложка начнут грузиться, пока играет текущий.
+    Подсказка указывает на канонический /audio/<id> без параметров — клиент должен запрашивать
+    следующий трек ровно по этому URL, иначе предзагруженный ответ не переиспользуется.
+    """
+    if not next_id or not VIDEO_ID_RE.match(next_id):
+        return {}
+    return {"Link": f"</audio/{next_id}>; rel=preload; as=audio, </thumb/{next_id}?size=512>; rel=preload; as=image"}
+
+def cached_audio_response(request: Request, video_id: str, headers: Optional[dict] = None) -> Optional[Response]:
+    """Готовый файл из кэша открытых дескрипторов (Range, ETag, sendfile если сервер умеет) или None."""
+    audio_files: Optional[OpenFileCache] = getattr(request.app.state, "audio_files", None)
+    if audio_files is None or (entry := audio_files.acquire(video_id)) is None:
+        return None
+    executors: Optional[Executors] = getattr(request.app.state, "executors", None)
+    return AudioFileResponse(
+        entry, audio_files, request.headers, executor=executors.get(IO) if executors else None,
+        headers={"content-disposition": f'attachment; filename="{entry.path.name}"', **(headers or {})},
+    )
+
+@app.api_route("/audio/{name}", methods=["GET", "HEAD"])
+async def get_audio_file(name: str, request: Request, next_id: Optional[str] = Query(None, alias="next")):
     downloader: YouTubeDownloader = request.app.state.downloader
+    # /audio/<id> и старый /audio/<id>.mp3: отдаем тот контейнер, что лежит на диске
+    video_id = name.split(".", 1)[0]
+    # ?next=<id> (для внешних клиентов): следующий трек — прогреваем на сервере и подсказываем браузеру
+    hints = preload_headers(next_id)
+    if hints: downloader.prefetch([next_id])
     
+    if response := cached_audio_response(request, video_id, hints):
+        return response
     file_path = downloader._find_downloaded_file(video_id)
-    if file_path and file_path.exists():
-        return FileResponse(file_path, media_type="audio/mpeg", filename=f"{video_id}.mp3")
-    
-    logger.info(f"Audio file not found for {video_id}, attempting to download and wait...")
-    await downloader.download(video_id)
-    final_path = await downloader.wait_for_download_completion(video_id)
+    if not file_path and request.method == "HEAD":
+        # HEAD не запускает загрузку: отвечаем только по тому, что уже лежит на диске
+        return Response(status_code=404)
+    if not file_path:
+        # Первое воспроизведение: отдаем байты по мере загрузки, файл сохраняется параллельно
+        if stream := await downloader.stream_audio(video_id):
+            ext, chunks = stream
+            # aclose в фоне: при обрыве клиента ffmpeg/HTTP-источник и .part убираются сразу, а не сборщиком мусора
+            return StreamingResponse(chunks, media_type=AUDIO_MIME_TYPES.get(ext, "application/octet-stream"),
+                                     headers=hints, background=BackgroundTask(chunks.aclose))
+        logger.info(f"Audio file not found for {video_id}, attempting to download and wait...")
+        result = await downloader.download(video_id, target=TARGET_WEB)
+        file_path = result.file_path if result.success else None
+        if file_path and (response := cached_audio_response(request, video_id, hints)):
+            return response
     
-    if final_path:
-        return FileResponse(final_path, media_type="audio/mpeg", filename=f"{video_id}.mp3")
+    if file_path:
+        return FileResponse(file_path, media_type=audio_mime_type(file_path), filename=file_path.name, headers=hints)
 
     return JSONResponse(status_code=404, content={"message": "Audio file not found"})
 
+@app.get("/thumb/{video_id}")
+async def get_thumbnail(video_id: str, request: Request, size: int = 512, settings: Settings = Depends(get_settings_dep)):
+    thumbnails: ThumbnailCache = request.app.state.thumbnails
+    data = await thumbnails.get(video_id, size)
+    if data is None:
+        return JSONResponse(status_code=404, content={"message": "Thumbnail not found"})
+    etag = make_etag(data)
+    headers = {"ETag": etag, "Cache-Control": f"public, max-age={settings.THUMB_HTTP_MAX_AGE_S}"}
+    if etag_matches(request.headers.get("if-none-match"), etag):
+        return Response(status_code=304, headers=headers)
+    return Response(content=data, media_type="image/jpeg", headers=headers)
+
 @app.get("/api/health")
-async def health():
-    return {"status": "ok", "uptime": get_uptime()}
+async def health(request: Request, detail: bool = False, settings: Settings = Depends(get_settings_dep)):
+    result = {"status": "ok", "uptime": get_uptime()}
+    
+    # Если loop недавно «вставал» дольше порога — отдаем 503, чтобы health check это увидел
+    loop_monitor: LoopMonitor = getattr(request.app.state, "loop_monitor", None)
+    if loop_monitor and loop_monitor.max_lag(settings.LOOP_HEALTH_WINDOW_S) > settings.LOOP_LAG_UNHEALTHY_S:
+        result["status"] = "stalled"
+    
+    if detail:
+        radio_manager = getattr(request.app.state, "radio_manager", None)
+        downloader = getattr(request.app.state, "downloader", None)
+        result["loop_lag"] = loop_monitor.stats() if loop_monitor else None
+        result["startup"] = getattr(request.app.state, "startup", None)
+        result["executor"] = executor_stats(getattr(asyncio.get_running_loop(), "_default_executor", None))
+        if executors := getattr(request.app.state, "executors", None):
+            result["executors"] = executors.stats()
+        result["downloads_in_flight"] = downloader.in_flight_downloads if downloader else 0
+        result["search_cache"] = downloader.search_cache_stats.summary() if downloader else None
+        result["upstreams"] = downloader.upstream_stats() if downloader else None
+        if audio_files := getattr(request.app.state, "audio_files", None):
+            result["audio_files"] = audio_files.stats()
+        if thumbnails := getattr(request.app.state, "thumbnails", None):
+            result["thumbnails"] = thumbnails.stats()
+        if response_cache := getattr(request.app.state, "response_cache", None):
+            result["response_cache"] = {"entries": len(response_cache), "hits": response_cache.hits, "misses": response_cache.misses}
+        if coordinator := getattr(request.app.state, "coordinator", None):
+            result["coordination"] = coordinator.stats()
+        if radio_manager:
+            result["active_sessions"] = radio_manager.active_sessions
+            result["resume"] = radio_manager.resume_stats()
+    
+    if result["status"] != "ok":
+        return JSONResponse(status_code=503, content=result)
+    return result
+
+@app.get("/api/metrics")
+async def get_metrics():
+    if not metrics.REGISTRY.enabled:
+        return JSONResponse(status_code=404, content={"message": "Metrics disabled"})
+    return Response(content=metrics.REGISTRY.render(), media_type=metrics.CONTENT_TYPE)
+
+def playlist_cache_key(query: str, offset: int, limit: int) -> str:
+    return f"playlist:{canonicalize_query(query, 'track')}:{offset}:{limit}"
 
-@app.get("/api/player/playlist", response_model=dict)
-async def get_playlist(query: str, request: Request):
+@app.get("/api/player/playlist")
+async def get_playlist(query: str, request: Request, offset: int = 0, limit: int = 15, settings: Settings = Depends(get_settings_dep)):
     downloader: YouTubeDownloader = request.app.state.downloader
-    logger.info(f"API: Поиск плейлиста по запросу: '{query}'")
-    try:
-        tracks: List[TrackInfo] = await downloader.search(query=query, search_mode='track', limit=15)
-        return {"playlist": tracks}
-    except Exception as e:
-        logger.error(f"API: Ошибка при поиске плейлиста: {e}", exc_info=True)
-        return JSONResponse(status_code=500, content={"message": "Internal server error"})
+    response_cache: ResponseCache = request.app.state.response_cache
+    offset, limit = max(0, offset), max(1, min(limit, 50))
+    cache_key = playlist_cache_key(query, offset, limit)
+    
+    entry = response_cache.get(cache_key)
+    if entry is None:
+        logger.info(f"API: Поиск плейлиста по запросу: '{query}'")
+        try:
+            # +1 трек, чтобы узнать, есть ли следующая страница
+            tracks: List[TrackInfo] = await downloader.search(query=query, search_mode='track', limit=offset + limit + 1)
+        except Exception as e:
+            logger.error(f"API: Ошибка при поиске плейлиста: {e}", exc_info=True)
+            return JSONResponse(status_code=500, content={"message": "Internal server error"})
+        page = tracks[offset:offset + limit]
+        body = json.dumps({
+            "playlist": [t.to_dict() for t in page],
+            "offset": offset,
+            "limit": limit,
+            "has_more": len(tracks) > offset + limit,
+        }, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+        if not page:
+            # Пустой результат не кэшируем: это может быть временный сбой поиска
+            return Response(content=body, media_type="application/json", headers={"Cache-Control": "no-store"})
+        entry = response_cache.set(cache_key, body)
+    
+    headers = {
+        "ETag": entry.etag,
+        "Cache-Control": f"public, max-age={settings.PLAYLIST_HTTP_MAX_AGE_S}, stale-while-revalidate={settings.PLAYLIST_HTTP_SWR_S}",
+    }
+    if etag_matches(request.headers.get("if-none-match"), entry.etag):
+        return Response(status_code=304, headers=headers)
+    return Response(content=entry.body, media_type="application/json", headers=headers)
+
+@app.get("/api/player/playlist/stream")
+async def stream_playlist(query: str, request: Request, limit: int = 15):
+    """
+    Треки по мере нахождения: NDJSON по умолчанию, SSE при Accept: text/event-stream.
+    Последняя запись — {"done": true, "count": N}.
+    """
+    downloader: YouTubeDownloader = request.app.state.downloader
+    limit = max(1, min(limit, 50))
+    use_sse = "text/event-stream" in request.headers.get("accept", "")
+    logger.info(f"API: Стрим плейлиста по запросу: '{query}' (sse={use_sse})")
+    
+    def encode(event: str, payload: dict) -> str:
+        data = json.dumps(payload, ensure_ascii=False)
+        return f"event: {event}\ndata: {data}\n\n" if use_sse else data + "\n"
+    
+    async def events():
+        count = 0
+        try:
+            async for track in downloader.search_stream(query=query, search_mode='track', limit=limit):
+                count += 1
+                yield encode("track", {"track": track.to_dict()})
+        except Exception as e:
+            logger.error(f"API: Ошибка стрима плейлиста: {e}", exc_info=True)
+            yield encode("error", {"error": "Internal server error"})
+        yield encode("done", {"done": True, "count": count})
+    
+    return StreamingResponse(
+        events(),
+        media_type="text/event-stream" if use_sse else "application/x-ndjson",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+class ResolveRequest(BaseModel):
+    queries: List[str] = Field(..., min_length=1)
+    prefetch: int = Field(1, ge=0, le=5)   # Сколько первых треков сразу начать скачивать
+    stream: bool = False
+
+@app.post("/api/player/resolve")
+async def resolve_playlist(body: ResolveRequest, request: Request, settings: Settings = Depends(get_settings_dep)):
+    downloader: YouTubeDownloader = request.app.state.downloader
+    queries = [q.strip() for q in body.queries if q and q.strip()][:settings.RESOLVE_MAX_QUERIES]
+    logger.info(f"API: Resolve {len(queries)} запросов (stream={body.stream})")
+    
+    def results():
+        return downloader.resolve_queries(queries, concurrency=settings.RESOLVE_CONCURRENCY, timeout=settings.RESOLVE_TIMEOUT_S)
+    
+    def maybe_prefetch(idx: int, track: Optional[TrackInfo]):
+        if track and idx < body.prefetch:
+            downloader.schedule_download(track.identifier)
+    
+    if body.stream:
+        async def ndjson():
+            resolved = 0
+            async for idx, query, track in results():
+                maybe_prefetch(idx, track)
+                resolved += track is not None
+                line = {"index": idx, "query": query, "track": track.to_dict() if track else None}
+                yield json.dumps(line, ensure_ascii=False) + "\n"
+            yield json.dumps({"done": True, "resolved": resolved, "total": len(queries)}) + "\n"
+        return StreamingResponse(ndjson(), media_type="application/x-ndjson")
+    
+    ordered: List[Optional[TrackInfo]] = [None] * len(queries)
+    async for idx, _, track in results():
+        maybe_prefetch(idx, track)
+        ordered[idx] = track
+    return {
+        "playlist": [t for t in ordered if t],
+        "unresolved": [q for q, t in zip(queries, ordered) if not t],
+    }
+
+class PrefetchRequest(BaseModel):
+    identifiers: List[str] = Field(..., min_length=1, max_length=20)   # Следующие треки очереди, ближайший первым
+
+@app.post("/api/player/prefetch")
+async def prefetch_tracks(body: PrefetchRequest, request: Request, settings: Settings = Depends(get_settings_dep)):
+    downloader: YouTubeDownloader = request.app.state.downloader
+    identifiers = [i for i in dict.fromkeys(body.identifiers) if VIDEO_ID_RE.match(i)][:settings.PREFETCH_MAX_IDS]
+    # 202: загрузки идут в фоне, ответ не ждет их
+    return JSONResponse(status_code=202, content={"prefetch": downloader.prefetch(identifiers)})
 
 @app.post("/telegram")
 async def telegram_webhook(request: Request):
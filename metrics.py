@@ -0,0 +1,280 @@
+"""
+Встроенные метрики в формате Prometheus (text exposition 0.0.4).
+Без внешних зависимостей; при METRICS_ENABLED=False запись метрик — пустая операция.
+"""
+import threading
+import time
+from contextlib import contextmanager
+from typing import Callable, Dict, Iterator, List, Optional, Sequence, Tuple
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+
+def _escape(value: str) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(names: Sequence[str], values: Sequence[str], extra: str = "") -> str:
+    parts = [f'{n}="{_escape(v)}"' for n, v in zip(names, values)]
+    if extra:
+        parts.append(extra)
+    return "{" + ",".join(parts) + "}" if parts else ""
+
+
+def _format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if not float(value).is_integer() else str(int(value))
+
+
+class _Metric:
+    kind = ""
+
+    def __init__(self, registry: "MetricsRegistry", name: str, documentation: str, labelnames: Sequence[str] = ()):
+        self._registry = registry
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+        registry.register(self)
+
+    def _key(self, labels: Dict[str, str]) -> Tuple[str, ...]:
+        return tuple(str(labels.get(n, "")) for n in self.labelnames)
+
+    def collect(self) -> List[str]:
+        raise NotImplementedError
+
+    def reset(self):
+        raise NotImplementedError
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def __init__(self, *args, **kwargs):
+        self._values: Dict[Tuple[str, ...], float] = {}
+        super().__init__(*args, **kwargs)
+
+    def inc(self, amount: float = 1.0, **labels: str):
+        if not self._registry.enabled:
+            return
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0.0) + amount
+
+    def value(self, **labels: str) -> float:
+        return self._values.get(self._key(labels), 0.0)
+
+    def collect(self) -> List[str]:
+        with self._lock:
+            items = list(self._values.items())
+        return [f"{self.name}{_format_labels(self.labelnames, k)} {_format_value(v)}" for k, v in items]
+
+    def reset(self):
+        with self._lock:
+            self._values.clear()
+
+
+class Gauge(_Metric):
+    """Gauge: либо явные set/inc/dec, либо функция, вычисляемая в момент сбора."""
+    kind = "gauge"
+
+    def __init__(self, *args, **kwargs):
+        self._values: Dict[Tuple[str, ...], float] = {}
+        self._function: Optional[Callable[[], float]] = None
+        super().__init__(*args, **kwargs)
+
+    def set(self, value: float, **labels: str):
+        if not self._registry.enabled:
+            return
+        with self._lock:
+            self._values[self._key(labels)] = float(value)
+
+    def inc(self, amount: float = 1.0, **labels: str):
+        if not self._registry.enabled:
+            return
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0.0) + amount
+
+    def dec(self, amount: float = 1.0, **labels: str):
+        self.inc(-amount, **labels)
+
+    def set_function(self, fn: Optional[Callable[[], float]]):
+        self._function = fn
+
+    def collect(self) -> List[str]:
+        if self._function is not None:
+            try:
+                return [f"{self.name} {_format_value(self._function())}"]
+            except Exception:
+                return []
+        with self._lock:
+            items = list(self._values.items())
+        return [f"{self.name}{_format_labels(self.labelnames, k)} {_format_value(v)}" for k, v in items]
+
+    def reset(self):
+        with self._lock:
+            self._values.clear()
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, *args, buckets: Sequence[float] = DEFAULT_BUCKETS, **kwargs):
+        self.buckets = tuple(sorted(buckets))
+        # label key -> [счетчики по бакетам..., sum, count]
+        self._values: Dict[Tuple[str, ...], List[float]] = {}
+        super().__init__(*args, **kwargs)
+
+    def observe(self, value: float, **labels: str):
+        if not self._registry.enabled:
+            return
+        key = self._key(labels)
+        with self._lock:
+            row = self._values.get(key)
+            if row is None:
+                row = self._values[key] = [0.0] * (len(self.buckets) + 2)
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    row[i] += 1
+                    break
+            row[-2] += value
+            row[-1] += 1
+
+    @contextmanager
+    def time(self, **labels: str) -> Iterator[None]:
+        if not self._registry.enabled:
+            yield
+            return
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, **labels)
+
+    def collect(self) -> List[str]:
+        with self._lock:
+            items = [(k, list(v)) for k, v in self._values.items()]
+        lines = []
+        for key, row in items:
+            cumulative = 0.0
+            for bound, count in zip(self.buckets, row):
+                cumulative += count
+                le = 'le="%s"' % _format_value(bound)
+                lines.append(f"{self.name}_bucket{_format_labels(self.labelnames, key, le)} {_format_value(cumulative)}")
+            inf = 'le="+Inf"'
+            lines.append(f"{self.name}_bucket{_format_labels(self.labelnames, key, inf)} {_format_value(row[-1])}")
+            lines.append(f"{self.name}_sum{_format_labels(self.labelnames, key)} {_format_value(row[-2])}")
+            lines.append(f"{self.name}_count{_format_labels(self.labelnames, key)} {_format_value(row[-1])}")
+        return lines
+
+    def reset(self):
+        with self._lock:
+            self._values.clear()
+
+
+class MetricsRegistry:
+    def __init__(self, enabled: bool = True):
+        self.enabled = enabled
+        self._metrics: Dict[str, _Metric] = {}
+
+    def register(self, metric: _Metric):
+        if metric.name in self._metrics:
+            raise ValueError(f"Metric {metric.name} already registered")
+        self._metrics[metric.name] = metric
+
+    def counter(self, name: str, documentation: str, labelnames: Sequence[str] = ()) -> Counter:
+        return Counter(self, name, documentation, labelnames)
+
+    def gauge(self, name: str, documentation: str, labelnames: Sequence[str] = ()) -> Gauge:
+        return Gauge(self, name, documentation, labelnames)
+
+    def histogram(self, name: str, documentation: str, labelnames: Sequence[str] = (), buckets: Sequence[float] = DEFAULT_BUCKETS) -> Histogram:
+        return Histogram(self, name, documentation, labelnames, buckets=buckets)
+
+    def render(self) -> str:
+        lines = []
+        for metric in self._metrics.values():
+            lines.append(f"# HELP {metric.name} {metric.documentation}")
+            lines.append(f"# TYPE {metric.name} {metric.kind}")
+            lines.extend(metric.collect())
+        return "\n".join(lines) + "\n"
+
+    def reset(self):
+        for metric in self._metrics.values():
+            metric.reset()
+
+
+REGISTRY = MetricsRegistry()
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+
+def configure(enabled: bool):
+    REGISTRY.enabled = enabled
+
+
+# ==================== МЕТРИКИ ПРИЛОЖЕНИЯ ====================
+
+SEARCH_LATENCY = REGISTRY.histogram(
+    "musicbot_search_variant_seconds", "YTMusic search latency per query suffix variant", ["suffix"])
+CACHE_REQUESTS = REGISTRY.counter(
+    "musicbot_cache_requests_total", "Cache lookups by key prefix and result (hit/miss)", ["prefix", "result"])
+SEARCH_CACHE_LOOKUPS = REGISTRY.counter(
+    "musicbot_search_cache_lookups_total",
+    "Search cache lookups: actual (canonical) vs estimated with the old lower().strip() key (legacy)",
+    ["scheme", "result"])
+
+EXECUTOR_QUEUE_DEPTH = REGISTRY.gauge(
+    "musicbot_executor_queue_depth", "Tasks waiting for a worker in a named executor", ["executor"])
+EXECUTOR_UTILIZATION = REGISTRY.gauge(
+    "musicbot_executor_utilization", "Busy workers / max workers of a named executor", ["executor"])
+UPSTREAM_WAIT = REGISTRY.histogram(
+    "musicbot_upstream_slot_wait_seconds", "Time spent waiting for an adaptive concurrency slot", ["upstream"])
+UPSTREAM_CALLS = REGISTRY.counter(
+    "musicbot_upstream_calls_total", "Upstream calls by result (ok/error/throttled/rejected by open circuit)", ["upstream", "result"])
+UPSTREAM_LIMIT = REGISTRY.gauge(
+    "musicbot_upstream_concurrency_limit", "Current AIMD concurrency limit", ["upstream"])
+UPSTREAM_CIRCUIT_STATE = REGISTRY.gauge(
+    "musicbot_upstream_circuit_state", "Circuit breaker state: 0 closed, 1 half-open, 2 open", ["upstream"])
+UPSTREAM_HEDGES = REGISTRY.counter(
+    "musicbot_upstream_hedges_total", "Hedged second attempts: sent and won (answered before the first)", ["upstream", "result"])
+UPSTREAM_STALE_SERVED = REGISTRY.counter(
+    "musicbot_upstream_stale_served_total", "Responses served from stale cache because the upstream failed", ["upstream"])
+YTDLP_DOWNLOAD = REGISTRY.histogram(
+    "musicbot_ytdlp_download_seconds", "yt-dlp transfer time (without postprocessing)")
+FFMPEG_POSTPROCESS = REGISTRY.histogram(
+    "musicbot_ffmpeg_postprocess_seconds", "ffmpeg postprocessor time", ["postprocessor"])
+UPLOAD = REGISTRY.histogram(
+    "musicbot_telegram_upload_seconds", "send_audio duration for file uploads", ["via"])
+
+ACTIVE_SESSIONS = REGISTRY.gauge(
+    "musicbot_radio_active_sessions", "Running radio sessions")
+PLAYLIST_DEPTH = REGISTRY.histogram(
+    "musicbot_radio_playlist_depth", "Queued tracks in a session when the next track starts",
+    buckets=(0, 1, 2, 3, 5, 10, 15, 25, 50))
+TELEGRAM_RETRY_AFTER = REGISTRY.counter(
+    "musicbot_telegram_429_total", "Telegram RetryAfter (HTTP 429) responses", ["method"])
+LOOP_LAG = REGISTRY.histogram(
+    "musicbot_event_loop_lag_seconds", "Event loop scheduling lag",
+    buckets=(0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0))
+DOWNLOADS_IN_FLIGHT = REGISTRY.gauge(
+    "musicbot_downloads_in_flight", "yt-dlp downloads currently running")
+AUDIO_FD_CACHE = REGISTRY.counter(
+    "musicbot_audio_fd_cache_total", "Open-file cache lookups for /audio (hit/miss/revalidated/invalidated)", ["result"])
+AUDIO_SERVED = REGISTRY.counter(
+    "musicbot_audio_served_total", "Cached /audio responses by send mode (zerocopy/pathsend/pread/empty) and status", ["mode", "status"])
+THUMB_REQUESTS = REGISTRY.counter(
+    "musicbot_thumbnail_requests_total", "/thumb lookups by result (hit/miss/error/failed_recently)", ["result"])
+PREFETCH_REQUESTS = REGISTRY.counter(
+    "musicbot_prefetch_total", "Web player next-track prefetch by result (queued/cached/rejected/deferred/done/failed)", ["result"])
+STREAM_FIRST_BYTE = REGISTRY.histogram(
+    "musicbot_stream_first_byte_seconds", "Time to first output byte of a streaming pipeline", ["mode"])
+DOWNLOADS_REJECTED = REGISTRY.counter(
+    "musicbot_downloads_rejected_total", "Downloads rejected before transfer by the size/live gate", ["reason"])
+TRACK_INDEX_LOOKUPS = REGISTRY.counter(
+    "musicbot_track_index_lookups_total", "Local FTS track index lookups for track searches", ["result"])
+STARTUP_SECONDS = REGISTRY.gauge(
+    "musicbot_startup_seconds", "Startup time by phase (imports, lifespan, total)", ["phase"])
+RESUME_TIME = REGISTRY.histogram(
+    "musicbot_radio_time_to_resume_seconds", "Time from startup resume to first track in a restored session")
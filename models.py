@@ -1,8 +1,11 @@
+import sys
 from dataclasses import dataclass
 from enum import Enum
 from pathlib import Path
 from typing import Optional, Any, Dict
 
+from text_keys import recording_key
+
 
 class Source(Enum):
     YOUTUBE = "youtube"
@@ -10,14 +13,25 @@ class Source(Enum):
     SOUNDCLOUD = "soundcloud"
 
 
-@dataclass
+@dataclass(slots=True)
 class TrackInfo:
+    """
+    slots: без __dict__ на каждый трек (их тысячи в очередях сессий и выдачах поиска).
+    Имя артиста интернируется: в жанровых очередях одни и те же артисты повторяются.
+    """
     identifier: str
     title: str
     artist: str
     duration: int
     source: Source = Source.YOUTUBE
     thumbnail_url: Optional[str] = None
+
+    def __post_init__(self):
+        self.artist = sys.intern(self.artist)
+
+    def __reduce__(self):
+        # Позиционные поля вместо словаря состояния: pickle в кэше короче, загрузка идет через __init__
+        return (self.__class__, (self.identifier, self.title, self.artist, self.duration, self.source, self.thumbnail_url))
     
     @classmethod
     def from_yt_info(cls, info: Dict[str, Any]) -> Optional["TrackInfo"]:
@@ -63,14 +77,43 @@ class TrackInfo:
             thumbnail_url=thumbnail
         )
 
+    @property
+    def recording_key(self) -> str:
+        """Ключ записи для дедупликации разных videoId одной песни."""
+        return recording_key(self.artist, self.title, self.duration)
 
-@dataclass
+    def to_dict(self) -> Dict[str, Any]:
+        """Сериализация в JSON-совместимый словарь (для хранения сессий)."""
+        return {
+            "identifier": self.identifier,
+            "title": self.title,
+            "artist": self.artist,
+            "duration": self.duration,
+            "source": self.source.value,
+            "thumbnail_url": self.thumbnail_url,
+        }
+
+    @classmethod
+    def from_dict(cls, data: Dict[str, Any]) -> "TrackInfo":
+        return cls(
+            identifier=data["identifier"],
+            title=data.get("title", "Unknown"),
+            artist=data.get("artist", "Unknown"),
+            duration=int(data.get("duration") or 0),
+            source=Source(data.get("source", Source.YOUTUBE.value)),
+            thumbnail_url=data.get("thumbnail_url"),
+        )
+
+
+@dataclass(slots=True)
 class DownloadResult:
     success: bool
     file_path: Optional[Path] = None
     file_id: Optional[str] = None
     track_info: Optional[TrackInfo] = None
     error_message: Optional[str] = None
+    # file_path — mp3-копия только для Telegram: после отправки ее заменяет file_id
+    transcoded: bool = False
 
 
 @dataclass
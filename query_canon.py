@@ -0,0 +1,79 @@
+import time
+from collections import OrderedDict
+from typing import Dict, List, Optional
+
+from cache_service import CacheService
+from metrics import SEARCH_CACHE_LOOKUPS
+
+
+def results_fingerprint(identifiers: List[str], size: int = 3) -> Optional[str]:
+    """Отпечаток выдачи: первые identifiers. Одинаковая выдача -> эквивалентные запросы."""
+    if len(identifiers) < size:
+        return None
+    return ",".join(identifiers[:size])
+
+
+class CacheHitStats:
+    """
+    Доля попаданий в кэш поиска до и после канонизации.
+    "legacy" — попал бы старый ключ query.lower().strip(); оценивается по ключам, сохраненным в этом процессе.
+    """
+
+    def __init__(self, ttl_s: int = 3600, max_keys: int = 10000):
+        self._ttl_s = ttl_s
+        self._max_keys = max_keys
+        self._legacy_keys: "OrderedDict[str, float]" = OrderedDict()
+        self.counts: Dict[str, int] = {"lookups": 0, "legacy_hits": 0, "canonical_hits": 0, "alias_hits": 0}
+
+    def record_lookup(self, legacy_key: str, hit: bool, via_alias: bool):
+        stored_at = self._legacy_keys.get(legacy_key)
+        legacy_hit = stored_at is not None and time.monotonic() - stored_at < self._ttl_s
+        self.counts["lookups"] += 1
+        self.counts["legacy_hits"] += legacy_hit
+        self.counts["canonical_hits"] += hit
+        self.counts["alias_hits"] += hit and via_alias
+        SEARCH_CACHE_LOOKUPS.inc(scheme="legacy", result="hit" if legacy_hit else "miss")
+        SEARCH_CACHE_LOOKUPS.inc(scheme="canonical", result="hit" if hit else "miss")
+
+    def record_store(self, legacy_key: str):
+        self._legacy_keys[legacy_key] = time.monotonic()
+        self._legacy_keys.move_to_end(legacy_key)
+        while len(self._legacy_keys) > self._max_keys:
+            self._legacy_keys.popitem(last=False)
+
+    def summary(self) -> Dict[str, float]:
+        lookups = self.counts["lookups"] or 1
+        return {
+            **self.counts,
+            "legacy_hit_rate": round(self.counts["legacy_hits"] / lookups, 3),
+            "canonical_hit_rate": round(self.counts["canonical_hits"] / lookups, 3),
+        }
+
+
+class QueryAliases:
+    """
+    Таблица выученных синонимов: если два канонических запроса дали одну и ту же выдачу,
+    второй становится псевдонимом первого и дальше читает его запись кэша.
+    """
+
+    def __init__(self, cache: CacheService, ttl_s: int = 7 * 86400):
+        self._cache = cache
+        self._ttl_s = ttl_s
+
+    async def resolve(self, canonical: str, search_mode: str) -> str:
+        primary = await self._cache.get(f"alias:{search_mode}:{canonical}")
+        return primary or canonical
+
+    async def learn(self, canonical: str, search_mode: str, identifiers: List[str]) -> Optional[str]:
+        """Запоминает отпечаток выдачи; возвращает основной запрос, если найден эквивалент."""
+        fingerprint = results_fingerprint(identifiers)
+        if not fingerprint:
+            return None
+        fp_key = f"alias_fp:{search_mode}:{fingerprint}"
+        primary = await self._cache.get(fp_key)
+        if primary and primary != canonical:
+            await self._cache.set(f"alias:{search_mode}:{canonical}", primary, ttl=self._ttl_s)
+            return primary
+        if not primary:
+            await self._cache.set(fp_key, canonical, ttl=self._ttl_s)
+        return None
@@ -1,8 +1,8 @@
 import asyncio
 import logging
 import random
-import os
-from typing import List, Optional, Dict, Set
+import time
+from typing import List, Optional, Dict, Set, Any, Callable, Awaitable
 from dataclasses import dataclass, field
 
 from telegram import Bot, Message, InlineKeyboardMarkup, InlineKeyboardButton, WebAppInfo
@@ -12,13 +12,11 @@ from telegram.error import BadRequest, RetryAfter
 from config import Settings
 from models import TrackInfo, DownloadResult
 from youtube import YouTubeDownloader
-
-import json
-from pathlib import Path
-
-# Load MUSIC_CATALOG from genres.json
-with open(Path(__file__).parent / "genres.json", "r", encoding="utf-8") as f:
-    MUSIC_CATALOG = json.load(f)
+from session_store import SessionStore
+from coordination import Coordinator
+from catalog import CATALOG_INDEX
+from text_keys import is_known_recording
+from metrics import PLAYLIST_DEPTH, RESUME_TIME, TELEGRAM_RETRY_AFTER, UPLOAD
 
 logger = logging.getLogger("radio")
 
@@ -32,7 +30,7 @@ def get_now_playing_message(track: TrackInfo, genre_name: str) -> str:
     artist = track.artist[:30].strip()
     return f"{icon} *{title}*\n👤 {artist}\n⏱ {format_duration(track.duration)} | 📻 _{genre_name}_"
 
-@dataclass
+@dataclass(slots=True)
 class RadioSession:
     chat_id: int
     bot: Bot
@@ -46,10 +44,34 @@ class RadioSession:
     is_running: bool = field(init=False, default=False)
     playlist: List[TrackInfo] = field(default_factory=list)
     played_ids: Set[str] = field(default_factory=set)
+    # Ключи записей: тот же трек под другим videoId тоже считается сыгранным
+    played_keys: Set[str] = field(default_factory=set)
     current_task: Optional[asyncio.Task] = None
     skip_event: asyncio.Event = field(default_factory=asyncio.Event)
     status_message: Optional[Message] = None
     _is_searching: bool = field(init=False, default=False)
+    # Колбэки менеджера: сохранение состояния и метрика восстановления
+    on_change: Optional[Callable[["RadioSession"], Awaitable[None]]] = None
+    on_resumed: Optional[Callable[["RadioSession", float], None]] = None
+    resume_started_at: Optional[float] = None
+
+    def snapshot(self) -> Dict[str, Any]:
+        """Состояние сессии для восстановления после рестарта."""
+        return {
+            "chat_id": self.chat_id,
+            "query": self.query,
+            "decade": self.decade,
+            "display_name": self.display_name,
+            "chat_type": str(self.chat_type) if self.chat_type else None,
+            "playlist": [t.to_dict() for t in self.playlist],
+            "history": list(self.played_ids),
+            "played_keys": list(self.played_keys),
+        }
+
+    async def _notify_change(self):
+        if self.on_change:
+            try: await self.on_change(self)
+            except Exception as e: logger.warning(f"[{self.chat_id}] Session persist error: {e}")
     
     async def start(self):
         if self.is_running: return
@@ -77,6 +99,7 @@ class RadioSession:
                     self.status_message = None
             self.status_message = await self.bot.send_message(self.chat_id, text, parse_mode=ParseMode.MARKDOWN)
         except RetryAfter as e:
+            TELEGRAM_RETRY_AFTER.inc(method="send_message")
             await asyncio.sleep(e.retry_after)
         except Exception as e:
             logger.warning(f"Status error: {e}")
@@ -95,11 +118,16 @@ class RadioSession:
         await self._update_status(f"📡 Сканирование эфира: *{self.display_name}*...")
         try:
             tracks = await self.downloader.search(target_query, decade=self.decade, limit=25)
-            new_tracks = [t for t in tracks if t.identifier not in self.played_ids]
+            known_keys = self.played_keys | {t.recording_key for t in self.playlist}
+            new_tracks = [
+                t for t in tracks
+                if t.identifier not in self.played_ids and not is_known_recording(t.recording_key, known_keys)
+            ]
             if new_tracks:
                 random.shuffle(new_tracks)
                 self.playlist.extend(new_tracks)
                 logger.info(f"[{self.chat_id}] Найдено треков: {len(new_tracks)}")
+                await self._notify_change()
             else:
                 logger.warning(f"[{self.chat_id}] Поиск '{target_query}' пуст.")
         except Exception as e:
@@ -121,13 +149,22 @@ class RadioSession:
                         await asyncio.sleep(10)
                         continue
 
+                PLAYLIST_DEPTH.observe(len(self.playlist))
                 track = self.playlist.pop(0)
                 self.played_ids.add(track.identifier)
+                self.played_keys.add(track.recording_key)
                 if len(self.played_ids) > 200: self.played_ids = set(list(self.played_ids)[100:])
+                if len(self.played_keys) > 200: self.played_keys = set(list(self.played_keys)[100:])
+                await self._notify_change()
 
                 success = await self._play_track(track)
                 if success:
                     consecutive_errors = 0
+                    if self.resume_started_at is not None:
+                        elapsed = time.monotonic() - self.resume_started_at
+                        self.resume_started_at = None
+                        logger.info(f"[{self.chat_id}] ♻️ Эфир восстановлен за {elapsed:.1f}s")
+                        if self.on_resumed: self.on_resumed(self, elapsed)
                     wait_time = min(track.duration, 240) if track.duration > 0 else 180
                     try: await asyncio.wait_for(self.skip_event.wait(), timeout=wait_time)
                     except asyncio.TimeoutError: pass 
@@ -160,54 +197,188 @@ class RadioSession:
             if result.file_id:
                 await self.bot.send_audio(self.chat_id, audio=result.file_id, caption=caption, parse_mode=ParseMode.MARKDOWN, reply_markup=markup)
             elif result.file_path:
-                with open(result.file_path, 'rb') as f:
+                with open(result.file_path, 'rb') as f, UPLOAD.time(via="radio"):
                     msg = await self.bot.send_audio(self.chat_id, audio=f, caption=caption, parse_mode=ParseMode.MARKDOWN, reply_markup=markup)
-                    if msg.audio: await self.downloader.cache_file_id(track.identifier, msg.audio.file_id)
+                if msg.audio: await self.downloader.cache_file_id(track.identifier, msg.audio.file_id)
             
             await self._delete_status()
             return True
+        except RetryAfter as e:
+            TELEGRAM_RETRY_AFTER.inc(method="send_audio")
+            logger.warning(f"[{self.chat_id}] Flood control: ждем {e.retry_after}s")
+            await asyncio.sleep(e.retry_after)
+            return False
         except Exception as e:
             logger.error(f"Play error: {e}")
             return False
         finally:
-            if result and result.file_path and os.path.exists(result.file_path):
-                try: os.unlink(result.file_path)
-                except: pass
+            # Удаляем только mp3-копию для Telegram: дальше есть file_id, а нативный файл нужен вебу
+            if result and result.transcoded and result.file_path:
+                self.downloader.discard_file(result.file_path)
 
 class RadioManager:
-    def __init__(self, bot: Bot, settings: Settings, downloader: YouTubeDownloader):
+    def __init__(self, bot: Bot, settings: Settings, downloader: YouTubeDownloader, store: Optional[SessionStore] = None, coordinator: Optional[Coordinator] = None):
         self._bot, self._settings, self._downloader = bot, settings, downloader
+        self._store = store
+        # Несколько воркеров: сессией владеет воркер с арендой, команды уходят ему
+        self._coordinator = coordinator
         self._sessions: Dict[int, RadioSession] = {}
         self._locks: Dict[int, asyncio.Lock] = {}
+        self._resume_task: Optional[asyncio.Task] = None
+        self._resume_stats: Dict[str, Any] = {"pending": 0, "started": 0, "resumed": 0, "time_to_resume_s": []}
 
     def _get_lock(self, chat_id: int) -> asyncio.Lock:
         self._locks.setdefault(chat_id, asyncio.Lock())
         return self._locks[chat_id]
 
+    def start_coordination(self):
+        if self._coordinator:
+            self._coordinator.start(on_lost=self._on_lease_lost, on_command=self._on_command, on_tick=self._adopt_orphans)
+
+    async def _route(self, chat_id: int, op: str, **args: Any) -> bool:
+        """Сессией владеет другой воркер: отправляем команду ему. True — команда ушла."""
+        if not self._coordinator or chat_id in self._sessions: return False
+        owner = await self._coordinator.remote_owner(chat_id)
+        if not owner: return False
+        logger.info(f"[{chat_id}] '{op}' -> {owner}")
+        await self._coordinator.send(owner, chat_id, op, **args)
+        return True
+
     async def start(self, chat_id: int, query: str, chat_type: Optional[str] = None, display_name: Optional[str] = None, decade: Optional[str] = None):
+        if await self._route(chat_id, "start", query=query, chat_type=chat_type, display_name=display_name, decade=decade): return
         async with self._get_lock(chat_id):
+            if self._coordinator and not await self._coordinator.acquire(chat_id):
+                # Другой воркер успел стать владельцем между проверкой и захватом
+                await self._route(chat_id, "start", query=query, chat_type=chat_type, display_name=display_name, decade=decade)
+                return
             if chat_id in self._sessions: await self._sessions[chat_id].stop()
             if query == "random": query, decade, display_name = self._get_random_query()
-            session = RadioSession(chat_id=chat_id, bot=self._bot, downloader=self._downloader, settings=self._settings, query=query, display_name=(display_name or query), decade=decade, chat_type=chat_type)
+            session = self._new_session(chat_id=chat_id, query=query, display_name=(display_name or query), decade=decade, chat_type=chat_type)
             self._sessions[chat_id] = session
+            await self._persist(session)
             await session.start()
 
-    async def stop(self, chat_id: int):
+    async def stop(self, chat_id: int, forget: bool = True):
+        """Остановка эфира. forget=False оставляет состояние в хранилище (для рестарта или другого воркера)."""
+        if await self._route(chat_id, "stop", forget=forget): return
         async with self._get_lock(chat_id):
-            if session := self._sessions.pop(chat_id, None): await session.stop()
+            if session := self._sessions.pop(chat_id, None):
+                await session.stop()
+                if not forget: await self._persist(session)
+            if forget and self._store: await self._store.delete(chat_id)
+            if self._coordinator: await self._coordinator.release(chat_id)
 
     async def skip(self, chat_id: int):
+        if await self._route(chat_id, "skip"): return
         if session := self._sessions.get(chat_id): await session.skip()
 
     async def stop_all(self):
-        for chat_id in list(self._sessions.keys()): await self.stop(chat_id)
+        """Остановка при выключении процесса: сессии сохраняются, аренды отпускаются — их подхватит живой воркер или рестарт."""
+        if self._resume_task: self._resume_task.cancel()
+        for chat_id in list(self._sessions.keys()): await self.stop(chat_id, forget=False)
+        if self._coordinator: await self._coordinator.stop()
+
+    # ==================== КООРДИНАЦИЯ ====================
+
+    async def _on_command(self, chat_id: int, command: Dict[str, Any]):
+        op = command.pop("op", None)
+        if op == "start": await self.start(chat_id, **command)
+        elif op == "stop": await self.stop(chat_id, **command)
+        elif op == "skip": await self.skip(chat_id)
+        else: logger.warning(f"[{chat_id}] Unknown routed command: {op}")
+
+    async def _on_lease_lost(self, chat_id: int):
+        # Сессию уже ведет другой воркер: гасим локальную копию, состояние не трогаем
+        async with self._get_lock(chat_id):
+            if session := self._sessions.pop(chat_id, None):
+                session.on_change = None
+                await session.stop()
+
+    async def _adopt_orphans(self):
+        """Подхват сессий, чьи владельцы умерли (аренда истекла, состояние осталось в хранилище)."""
+        if not self._store or not self._settings.RADIO_RESUME_ENABLED: return
+        if self._resume_task and not self._resume_task.done(): return
+        orphans = []
+        for state in await self._store.load_all():
+            chat_id = int(state["chat_id"])
+            if chat_id not in self._sessions and not await self._coordinator.backend.owner_of(chat_id):
+                orphans.append(state)
+        if orphans:
+            logger.info(f"♻️ Подхват {len(orphans)} осиротевших радио-сессий")
+            self._resume_stats["pending"] += len(orphans)
+            self._resume_task = asyncio.create_task(self._resume_staggered(orphans))
+
+    def _new_session(self, **kwargs) -> RadioSession:
+        return RadioSession(
+            bot=self._bot, downloader=self._downloader, settings=self._settings,
+            on_change=self._persist, on_resumed=self._record_resume, **kwargs
+        )
+
+    async def _persist(self, session: RadioSession):
+        if self._store: await self._store.save(session.chat_id, session.snapshot())
+
+    # ==================== ВОССТАНОВЛЕНИЕ ====================
+
+    async def resume_all(self) -> int:
+        """Запускает фоновое восстановление сохраненных сессий. Возвращает их количество."""
+        if not self._store or not self._settings.RADIO_RESUME_ENABLED: return 0
+        states = await self._store.load_all()
+        if not states: return 0
+        self._resume_stats["pending"] = len(states)
+        logger.info(f"♻️ Восстановление {len(states)} радио-сессий...")
+        self._resume_task = asyncio.create_task(self._resume_staggered(states))
+        return len(states)
+
+    async def _resume_staggered(self, states: List[Dict[str, Any]]):
+        # Разносим старты во времени, чтобы не устроить шквал поисков и загрузок
+        resume_started_at = time.monotonic()
+        for idx, state in enumerate(states):
+            if idx: await asyncio.sleep(self._settings.RADIO_RESUME_STAGGER_S)
+            try:
+                await self._resume_one(state, resume_started_at)
+            except Exception as e:
+                logger.error(f"[{state.get('chat_id')}] Resume error: {e}")
+            finally:
+                self._resume_stats["pending"] -= 1
+
+    async def _resume_one(self, state: Dict[str, Any], resume_started_at: float):
+        chat_id = int(state["chat_id"])
+        async with self._get_lock(chat_id):
+            if chat_id in self._sessions: return
+            # Сессию мог уже подхватить другой воркер
+            if self._coordinator and not await self._coordinator.acquire(chat_id): return
+            session = self._new_session(
+                chat_id=chat_id, query=state["query"], display_name=state.get("display_name") or state["query"],
+                decade=state.get("decade"), chat_type=state.get("chat_type"),
+                playlist=[TrackInfo.from_dict(t) for t in state.get("playlist", [])],
+                played_ids=set(state.get("history", [])),
+                played_keys=set(state.get("played_keys", [])),
+            )
+            session.resume_started_at = resume_started_at
+            self._sessions[chat_id] = session
+            await session.start()
+            self._resume_stats["started"] += 1
+
+    @property
+    def active_sessions(self) -> int:
+        return len(self._sessions)
+
+    def _record_resume(self, session: RadioSession, elapsed: float):
+        RESUME_TIME.observe(elapsed)
+        self._resume_stats["resumed"] += 1
+        self._resume_stats["time_to_resume_s"].append(round(elapsed, 3))
+
+    def resume_stats(self) -> Dict[str, Any]:
+        """Метрика time-to-resume: от начала восстановления до первого трека в чате."""
+        times = self._resume_stats["time_to_resume_s"]
+        return {
+            "pending": self._resume_stats["pending"],
+            "started": self._resume_stats["started"],
+            "resumed": self._resume_stats["resumed"],
+            "avg_s": round(sum(times) / len(times), 3) if times else None,
+            "max_s": max(times) if times else None,
+        }
 
     def _get_random_query(self) -> tuple[str, Optional[str], str]:
-        all_queries = []
-        def _flatten(cat):
-            for k, v in cat.items():
-                if isinstance(v, dict): _flatten(v)
-                else: all_queries.append((k, v))
-        _flatten(MUSIC_CATALOG)
-        res = random.choice(all_queries)
-        return (res[1], None, res[0])
\ No newline at end of file
+        leaf = CATALOG_INDEX.random_leaf()
+        return (leaf.query, None, leaf.name)
\ No newline at end of file
@@ -0,0 +1,95 @@
+import asyncio
+import json
+import logging
+from datetime import datetime
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Union
+
+import aiosqlite
+
+logger = logging.getLogger(__name__)
+
+
+class SessionStore:
+    """
+    Хранилище состояния радио-сессий (переживает рестарт процесса).
+    Одна строка на чат, состояние хранится в JSON.
+    """
+
+    def __init__(self, db_path: Union[str, Path]):
+        self._db_path = Path(db_path)
+        self._db: Optional[aiosqlite.Connection] = None
+        self._lock = asyncio.Lock()
+
+    async def initialize(self):
+        """Создание таблицы сессий."""
+        self._db = await aiosqlite.connect(self._db_path)
+        await self._db.execute("""
+            CREATE TABLE IF NOT EXISTS radio_sessions (
+                chat_id INTEGER PRIMARY KEY,
+                state TEXT NOT NULL,
+                updated_at TIMESTAMP
+            )
+        """)
+        await self._db.commit()
+        logger.info(f"Session store initialized at {self._db_path}")
+
+    async def close(self):
+        if self._db:
+            await self._db.close()
+            self._db = None
+
+    async def save(self, chat_id: int, state: Dict[str, Any]) -> bool:
+        """Сохранение (перезапись) состояния сессии чата."""
+        if not self._db:
+            return False
+
+        try:
+            async with self._lock:
+                await self._db.execute(
+                    "INSERT OR REPLACE INTO radio_sessions (chat_id, state, updated_at) VALUES (?, ?, ?)",
+                    (chat_id, json.dumps(state, ensure_ascii=False), datetime.now().isoformat())
+                )
+                await self._db.commit()
+                return True
+        except Exception as e:
+            logger.error(f"Session save error for {chat_id}: {e}")
+            return False
+
+    async def delete(self, chat_id: int) -> bool:
+        if not self._db:
+            return False
+
+        try:
+            async with self._lock:
+                await self._db.execute("DELETE FROM radio_sessions WHERE chat_id = ?", (chat_id,))
+                await self._db.commit()
+                return True
+        except Exception as e:
+            logger.error(f"Session delete error for {chat_id}: {e}")
+            return False
+
+    async def load_all(self) -> List[Dict[str, Any]]:
+        """Все сохраненные сессии, от самых свежих к старым."""
+        if not self._db:
+            return []
+
+        try:
+            async with self._lock:
+                cursor = await self._db.execute(
+                    "SELECT chat_id, state FROM radio_sessions ORDER BY updated_at DESC"
+                )
+                rows = await cursor.fetchall()
+        except Exception as e:
+            logger.error(f"Session load error: {e}")
+            return []
+
+        states = []
+        for chat_id, raw in rows:
+            try:
+                state = json.loads(raw)
+                state["chat_id"] = chat_id
+                states.append(state)
+            except (ValueError, TypeError) as e:
+                logger.warning(f"Broken session state for {chat_id}: {e}")
+        return states
@@ -0,0 +1,186 @@
+import asyncio
+import logging
+import os
+import time
+from concurrent.futures import Executor
+from contextlib import aclosing
+from dataclasses import dataclass
+from pathlib import Path
+from typing import AsyncIterator, Callable, Dict, List, Optional
+
+import httpx
+
+logger = logging.getLogger(__name__)
+
+CHUNK_SIZE = 64 * 1024
+# Как http_chunk_size в yt-dlp: без Range YouTube режет скорость длинных запросов
+RANGE_SIZE = 10 * 1024 * 1024
+
+
+class PipelineError(Exception):
+    pass
+
+
+@dataclass
+class StreamProgress:
+    bytes_in: int = 0
+    bytes_out: int = 0
+    total_in: Optional[int] = None
+    first_byte_s: Optional[float] = None
+    elapsed_s: float = 0.0
+    done: bool = False
+
+
+def mp3_args(quality: str) -> List[str]:
+    return ["-vn", "-codec:a", "libmp3lame", "-b:a", f"{quality}k", "-f", "mp3"]
+
+
+async def http_source(url: str, headers: Optional[Dict[str, str]] = None, total: Optional[int] = None,
+                      client: Optional[httpx.AsyncClient] = None) -> AsyncIterator[bytes]:
+    """Байты по URL кусками Range; если сервер Range не поддерживает — одним ответом."""
+    own_client = client is None
+    client = client or httpx.AsyncClient(timeout=httpx.Timeout(15.0), follow_redirects=True)
+    try:
+        start = 0
+        while total is None or start < total:
+            end = start + RANGE_SIZE - 1
+            if total is not None: end = min(end, total - 1)
+            async with client.stream("GET", url, headers={**(headers or {}), "Range": f"bytes={start}-{end}"}) as resp:
+                resp.raise_for_status()
+                if total is None and resp.status_code == 206:
+                    # Content-Range: bytes 0-1023/4096
+                    size = resp.headers.get("content-range", "").rpartition("/")[2]
+                    total = int(size) if size.isdigit() else None
+                received = 0
+                async for chunk in resp.aiter_bytes(CHUNK_SIZE):
+                    received += len(chunk)
+                    yield chunk
+                if resp.status_code == 200: return
+            if received == 0 or (total is None and received < end - start + 1): return
+            start += received
+    finally:
+        if own_client: await client.aclose()
+
+
+async def file_source(path: Path, executor: Optional[Executor] = None) -> AsyncIterator[bytes]:
+    loop = asyncio.get_running_loop()
+    with open(path, "rb") as f:
+        while chunk := await loop.run_in_executor(executor, f.read, CHUNK_SIZE):
+            yield chunk
+
+
+class StreamPipeline:
+    """
+    source -> [ffmpeg stdin -> stdout] -> потребитель (файл или HTTP-ответ).
+    Обратное давление естественное: пока потребитель не читает, ffmpeg блокируется на stdout,
+    drain() на stdin ждет, и источник дальше не читается. Отмена убивает ffmpeg и закрывает источник.
+    Без ffmpeg_args байты идут насквозь (нативный контейнер).
+    """
+
+    def __init__(self, source: AsyncIterator[bytes], ffmpeg_args: Optional[List[str]] = None,
+                 on_progress: Optional[Callable[[StreamProgress], None]] = None, total_in: Optional[int] = None,
+                 ffmpeg_bin: str = "ffmpeg"):
+        self._source = source
+        self._ffmpeg_args = ffmpeg_args
+        self._on_progress = on_progress
+        self._ffmpeg_bin = ffmpeg_bin
+        self.progress = StreamProgress(total_in=total_in)
+        self._started = time.perf_counter()
+
+    def _report(self):
+        self.progress.elapsed_s = time.perf_counter() - self._started
+        if self._on_progress:
+            try: self._on_progress(self.progress)
+            except Exception as e: logger.warning(f"[Pipeline] Progress callback error: {e}")
+
+    async def _counted_source(self) -> AsyncIterator[bytes]:
+        async for chunk in self._source:
+            self.progress.bytes_in += len(chunk)
+            yield chunk
+
+    def _output(self, chunk: bytes):
+        if self.progress.first_byte_s is None:
+            self.progress.first_byte_s = time.perf_counter() - self._started
+        self.progress.bytes_out += len(chunk)
+        self._report()
+
+    def __aiter__(self) -> AsyncIterator[bytes]:
+        return self.chunks()
+
+    async def chunks(self) -> AsyncIterator[bytes]:
+        try:
+            # aclosing: при отмене вложенный генератор закрывается сразу, а не сборщиком мусора
+            async with aclosing(self._transcode() if self._ffmpeg_args else self._counted_source()) as chunks:
+                async for chunk in chunks:
+                    self._output(chunk)
+                    yield chunk
+            self.progress.done = True
+            self._report()
+        finally:
+            # aclose() источника при отмене/ошибке: закрывает HTTP-соединение или файл
+            if hasattr(self._source, "aclose"): await self._source.aclose()
+
+    async def _transcode(self) -> AsyncIterator[bytes]:
+        proc = await asyncio.create_subprocess_exec(
+            self._ffmpeg_bin, "-nostdin", "-loglevel", "error", "-i", "pipe:0", *self._ffmpeg_args, "pipe:1",
+            stdin=asyncio.subprocess.PIPE, stdout=asyncio.subprocess.PIPE, stderr=asyncio.subprocess.PIPE,
+        )
+        feeder = asyncio.create_task(self._feed(proc))
+        stderr_task = asyncio.create_task(proc.stderr.read())
+        try:
+            while chunk := await proc.stdout.read(CHUNK_SIZE):
+                yield chunk
+            await feeder
+            if await proc.wait() != 0:
+                stderr = (await stderr_task).decode(errors="replace").strip()
+                raise PipelineError(f"ffmpeg exited with {proc.returncode}: {stderr[-500:]}")
+        finally:
+            feeder.cancel()
+            if proc.returncode is None:
+                try: proc.kill()
+                except ProcessLookupError: pass
+            # Дочитываем каналы до EOF: при полном буфере stdout (обратное давление) wait() иначе не вернется
+            await asyncio.gather(feeder, stderr_task, proc.stdout.read(), return_exceptions=True)
+            await proc.wait()
+
+    async def _feed(self, proc: asyncio.subprocess.Process):
+        try:
+            async for chunk in self._counted_source():
+                proc.stdin.write(chunk)
+                await proc.stdin.drain()
+        except (BrokenPipeError, ConnectionResetError):
+            # ffmpeg закрыл вход раньше (ошибка формата) — причину покажет код выхода
+            return
+        finally:
+            if not proc.stdin.is_closing(): proc.stdin.close()
+
+    async def tee(self, path: Path, executor: Optional[Executor] = None) -> AsyncIterator[bytes]:
+        """
+        Отдает байты потребителю и одновременно пишет их в path (через .part, атомарно).
+        Открытие, запись и rename идут в executor: медленный диск не останавливает event loop.
+        """
+        loop = asyncio.get_running_loop()
+        tmp = path.with_name(f"{path.name}.part")
+        completed = False
+        f = None
+        try:
+            # Без буфера: close() в finally ничего не сбрасывает на диск и не блокирует
+            f = await loop.run_in_executor(executor, lambda: open(tmp, "wb", buffering=0))
+            async with aclosing(self.chunks()) as chunks:
+                async for chunk in chunks:
+                    await loop.run_in_executor(executor, f.write, chunk)
+                    yield chunk
+            f.close()
+            await loop.run_in_executor(executor, os.replace, tmp, path)
+            completed = True
+        finally:
+            if f is not None: f.close()
+            if not completed:
+                try: tmp.unlink()
+                except OSError: pass
+
+    async def to_file(self, path: Path, executor: Optional[Executor] = None) -> Path:
+        async with aclosing(self.tee(path, executor)) as chunks:
+            async for _ in chunks:
+                pass
+        return path
@@ -0,0 +1,67 @@
+import asyncio
+
+import pytest
+
+from ai_dj import AIDJService, FakeDJModel, normalize_prompt
+
+pytestmark = pytest.mark.anyio
+
+
+async def test_model_receives_original_prompt():
+    model = FakeDJModel()
+    service = AIDJService(model)
+    result = await service.generate("  Chill Lo-Fi для Работы ")
+    assert model.prompts[-1].endswith("Запрос: Chill Lo-Fi для Работы")
+    assert len(result["playlist"]) == 5
+    assert result["playlist"][0]["query"].startswith("Fake Artist 1 - ")
+
+
+async def test_results_are_cached_by_normalized_prompt_until_ttl():
+    model = FakeDJModel()
+    service = AIDJService(model, cache_ttl_s=0.1)
+    first = await service.generate("Deep House")
+    assert await service.generate("  deep   HOUSE ") is first
+    assert model.calls == 1
+    await asyncio.sleep(0.15)
+    await service.generate("deep house")
+    assert model.calls == 2
+
+
+async def test_identical_prompts_in_flight_are_coalesced():
+    model = FakeDJModel(latency_s=0.05)
+    service = AIDJService(model, concurrency=4)
+    prompts = ["Synthwave", "synthwave", " SYNTHWAVE ", "Synthwave", "synth wave"]
+    results = await asyncio.gather(*(service.generate(p) for p in prompts))
+    # "synth wave" — другой запрос после нормализации
+    assert model.calls == 2
+    assert results[0] is results[1] is results[2] is results[3]
+    assert {normalize_prompt(p) for p in prompts} == {"synthwave", "synth wave"}
+
+
+async def test_cancelled_caller_does_not_cancel_shared_request():
+    model = FakeDJModel(latency_s=0.05)
+    service = AIDJService(model)
+    first = asyncio.create_task(service.generate("jazz"))
+    second = asyncio.create_task(service.generate("jazz"))
+    await asyncio.sleep(0.01)
+    first.cancel()
+    assert (await second)["playlist"]
+    assert model.calls == 1
+
+
+async def test_timeout_keeps_slot_until_thread_finishes():
+    model = FakeDJModel(latency_s=0.2)
+    service = AIDJService(model, timeout_s=0.05, concurrency=1)
+    with pytest.raises(asyncio.TimeoutError):
+        await service.generate("slow prompt")
+    # Поток модели еще работает: слот занят, новый запрос ждет его
+    assert service._semaphore.locked()
+    await asyncio.sleep(0.25)
+    assert not service._semaphore.locked()
+
+    model.latency_s = 0
+    assert (await service.generate("fast prompt"))["playlist"]
+    assert not service._semaphore.locked()
+    # Неудачный запрос не попадает в кэш
+    await service.generate("slow prompt")
+    assert model.calls == 3
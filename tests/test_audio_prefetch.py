@@ -0,0 +1,83 @@
+import asyncio
+import time
+from pathlib import Path
+
+import pytest
+
+pytestmark = pytest.mark.anyio
+
+VIDEO_ID = "abcdefghijk"
+
+
+class CountingYoutubeDL:
+    """Подмена yt_dlp.YoutubeDL: info без сети, download пишет m4a с задержкой и считает вызовы."""
+
+    downloads = []
+
+    def __init__(self, opts):
+        self.opts = opts
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+    def extract_info(self, video_id, download=False):
+        return {
+            "id": video_id, "title": "Numb", "uploader": "Linkin Park", "duration": 185,
+            "formats": [{"format_id": "140", "ext": "m4a", "acodec": "mp4a.40.2", "vcodec": "none", "abr": 129.5}],
+        }
+
+    def download(self, urls):
+        for video_id in urls:
+            self.downloads.append(video_id)
+            time.sleep(0.2)
+            target = Path(self.opts["outtmpl"].replace("%(id)s", video_id).replace("%(ext)s", "m4a"))
+            target.write_bytes(b"\x00" * 4096)
+        return 0
+
+
+@pytest.fixture
+async def downloader(test_settings, tmp_path):
+    from cache_service import CacheService
+    from main import app
+    from youtube import YouTubeDownloader
+
+    settings = test_settings.model_copy(update={"DOWNLOADS_DIR": tmp_path / "downloads", "CACHE_DB_PATH": tmp_path / "cache.db"})
+    cache = CacheService(settings.CACHE_DB_PATH)
+    await cache.initialize()
+    CountingYoutubeDL.downloads = []
+    downloader = YouTubeDownloader(settings, cache, ydl_factory=CountingYoutubeDL)
+    # Начало веб-потока = запрос к upstream; сам поток в тестах не нужен
+    downloader.streams = []
+
+    async def resolve_stream_format(video_id):
+        downloader.streams.append(video_id)
+        return None
+
+    downloader._resolve_stream_format = resolve_stream_format
+    app.state.downloader = downloader
+    yield downloader
+    del app.state.downloader
+    downloader.executors.shutdown()
+    await cache.close()
+
+
+async def test_audio_request_waits_for_running_prefetch(client, downloader):
+    assert downloader.prefetch([VIDEO_ID]) == {VIDEO_ID: "queued"}
+    # Прогрев уже качает трек, когда плеер запрашивает его
+    await asyncio.sleep(0.05)
+    response = await client.get(f"/audio/{VIDEO_ID}")
+    assert response.status_code == 200
+    assert len(response.content) == 4096
+    assert CountingYoutubeDL.downloads == [VIDEO_ID]
+    assert downloader.streams == []
+
+
+async def test_head_on_cold_track_does_not_start_download(client, downloader):
+    response = await client.head(f"/audio/{VIDEO_ID}")
+    assert response.status_code == 404
+    assert response.content == b""
+    assert CountingYoutubeDL.downloads == []
+    assert downloader.streams == []
@@ -0,0 +1,36 @@
+import pytest
+
+from audio_serving import AudioFileResponse, OpenFileCache
+from disk_store import AudioStore
+
+
+@pytest.fixture
+def audio_files(tmp_path):
+    store = AudioStore(tmp_path / "downloads")
+    tmp = store.temp_path("abcdefghijk.m4a")
+    tmp.write_bytes(b"\x00" * 2048)
+    store.publish(tmp, "abcdefghijk", "m4a")
+    cache = OpenFileCache(store)
+    yield cache
+    cache.close_all()
+
+
+def respond(audio_files: OpenFileCache, headers: dict) -> AudioFileResponse:
+    entry = audio_files.acquire("abcdefghijk")
+    response = AudioFileResponse(entry, audio_files, headers)
+    audio_files.release(entry)
+    return response
+
+
+@pytest.mark.parametrize("if_none_match", ["{etag}", "W/{etag}", '"other", {etag}', "*"])
+def test_matching_if_none_match_returns_304(audio_files, if_none_match):
+    etag = respond(audio_files, {}).headers["etag"]
+    response = respond(audio_files, {"if-none-match": if_none_match.format(etag=etag)})
+    assert response.status_code == 304
+    assert response.headers["content-length"] == "0"
+
+
+def test_stale_etag_returns_file(audio_files):
+    response = respond(audio_files, {"if-none-match": '"stale"', "range": "bytes=0-1023"})
+    assert response.status_code == 206
+    assert response.headers["content-range"] == "bytes 0-1023/2048"
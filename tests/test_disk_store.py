@@ -0,0 +1,75 @@
+import json
+import os
+import time
+
+import pytest
+
+from audio_serving import OpenFileCache
+from disk_store import AudioStore
+
+pytestmark = pytest.mark.anyio
+
+DAY = 86400
+
+
+def publish(store: AudioStore, video_id: str, ext: str = "m4a", age_s: float = 0) -> None:
+    tmp = store.temp_path(f"{video_id}.{ext}")
+    tmp.write_bytes(b"\x00" * 1024)
+    path = store.publish(tmp, video_id, ext, duration=180, source="test")
+    if age_s:
+        # Возраст задается манифестом, как после реальной публикации давным-давно
+        manifest = store.manifest(path)
+        manifest["created_at"] -= age_s
+        store.manifest_path(path).write_text(json.dumps(manifest))
+
+
+async def test_evict_removes_old_files_manifests_and_locks(tmp_path):
+    store = AudioStore(tmp_path / "downloads")
+    files = OpenFileCache(store)
+    publish(store, "oldtrack001", age_s=2 * DAY)
+    publish(store, "oldtrack001", ext="mp3", age_s=2 * DAY)
+    publish(store, "newtrack001")
+    async with store.lock("oldtrack001"):
+        pass
+    entry = files.acquire("oldtrack001")
+    files.release(entry)
+
+    assert await store.evict(DAY) == 2
+    names = {p.name for p in store.directory.iterdir() if p.is_file()}
+    assert names == {"newtrack001.m4a", "newtrack001.m4a.json"}
+    assert list((store.directory / ".locks").glob("oldtrack001*")) == []
+    # Открытый дескриптор сброшен через слушателя хранилища
+    assert files.stats_counters["invalidated"] == 1
+    assert files.acquire("oldtrack001") is None
+
+
+async def test_evict_skips_video_in_use(tmp_path):
+    store = AudioStore(tmp_path / "downloads")
+    publish(store, "busytrack01", age_s=2 * DAY)
+    async with store.lock("busytrack01"):
+        assert await store.evict(DAY) == 0
+    assert store.find("busytrack01", "web")
+    assert await store.evict(DAY) == 1
+
+
+async def test_evict_drops_abandoned_temp_files(tmp_path):
+    store = AudioStore(tmp_path / "downloads")
+    abandoned = store.temp_dir("crashed0001")
+    (abandoned / "crashed0001.m4a.part").write_bytes(b"x")
+    old = time.time() - 2 * DAY
+    os.utime(abandoned, (old, old))
+    fresh = store.temp_path("writing0001.m4a")
+    fresh.write_bytes(b"x")
+
+    await store.evict(DAY)
+    assert not abandoned.exists()
+    assert fresh.exists()
+
+
+async def test_lock_survives_lock_file_removal(tmp_path):
+    store = AudioStore(tmp_path / "downloads")
+    async with store.lock("track000001"):
+        os.unlink(store.directory / ".locks" / "track000001.lock")
+    # Новая блокировка создает файл заново и видна другим процессам
+    async with store.lock("track000001"):
+        assert (store.directory / ".locks" / "track000001.lock").exists()
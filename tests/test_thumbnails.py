@@ -0,0 +1,144 @@
+import asyncio
+
+import pytest
+
+from thumbnails import THUMB_SIZES, ThumbnailCache
+
+pytestmark = pytest.mark.anyio
+
+
+class FakeFetcher:
+    """Подмена HttpThumbnailFetcher: фиксированные байты, счетчик вызовов, управляемые сбои."""
+
+    def __init__(self, payload: bytes = b"\xff\xd8" + b"x" * 998, latency_s: float = 0.0, fail: bool = False):
+        self.payload = payload
+        self.latency_s = latency_s
+        self.fail = fail
+        self.calls = []
+
+    async def __call__(self, url: str) -> bytes:
+        self.calls.append(url)
+        await asyncio.sleep(self.latency_s)
+        if self.fail:
+            raise OSError(f"404 for {url}")
+        return self.payload
+
+
+def make_cache(tmp_path, fetcher, **kwargs) -> ThumbnailCache:
+    cache = ThumbnailCache(tmp_path / "thumbs", fetcher=fetcher, **kwargs)
+    # Без ресайза байты вариантов равны исходнику: тесты не зависят от наличия Pillow
+    cache.can_resize = False
+    return cache
+
+
+async def test_concurrent_requests_share_one_fetch(tmp_path):
+    fetcher = FakeFetcher(latency_s=0.05)
+    cache = make_cache(tmp_path, fetcher)
+    results = await asyncio.gather(*(cache.get("abc123", size) for size in (96, 192, 512, 96, 300)))
+    assert all(r == fetcher.payload for r in results)
+    assert len(fetcher.calls) == 1
+    assert fetcher.calls[0] == "https://i.ytimg.com/vi/abc123/hqdefault.jpg"
+
+
+async def test_sizes_snap_to_standard_variants(tmp_path):
+    cache = make_cache(tmp_path, FakeFetcher())
+    assert [cache.snap_size(s) for s in (1, 96, 97, 192, 200, 512, 4000)] == [96, 96, 192, 192, 512, 512, 512]
+    await cache.get("abc123", 150)
+    assert {p.name for p in cache.directory.glob("*.jpg")} == {f"abc123_{s}.jpg" for s in THUMB_SIZES}
+
+
+async def test_resize_produces_square_variants(tmp_path):
+    Image = pytest.importorskip("PIL.Image")
+    import io
+
+    source = io.BytesIO()
+    Image.new("RGB", (480, 360), (200, 30, 30)).save(source, "JPEG")
+    cache = ThumbnailCache(tmp_path / "thumbs", fetcher=FakeFetcher(payload=source.getvalue()))
+    for size in THUMB_SIZES:
+        with Image.open(io.BytesIO(await cache.get("abc123", size))) as img:
+            assert img.size == (size, size)
+
+
+async def test_eviction_keeps_cache_within_byte_budget(tmp_path):
+    fetcher = FakeFetcher()
+    # 3 варианта по 1000 байт на видео: в бюджет помещаются ровно два видео
+    cache = make_cache(tmp_path, fetcher, max_bytes=6000)
+    for video_id in ("first", "second", "third"):
+        await cache.get(video_id, 96)
+    assert cache.stats()["bytes"] <= 6000
+    names = {p.name for p in cache.directory.glob("*.jpg")}
+    assert not any(n.startswith("first_") for n in names)
+    assert {f"third_{s}.jpg" for s in THUMB_SIZES} <= names
+    # Вытесненное видео скачивается заново
+    await cache.get("first", 96)
+    assert len(fetcher.calls) == 4
+
+
+async def test_failure_is_remembered_for_ttl(tmp_path):
+    fetcher = FakeFetcher(fail=True)
+    cache = make_cache(tmp_path, fetcher, failure_ttl_s=0.1)
+    assert await cache.get("broken", 96) is None
+    assert await cache.get("broken", 512) is None
+    assert len(fetcher.calls) == 1
+    await asyncio.sleep(0.15)
+    fetcher.fail = False
+    assert await cache.get("broken", 96) == fetcher.payload
+    assert len(fetcher.calls) == 2
+
+
+@pytest.mark.parametrize("source", [
+    "http://169.254.169.254/latest/meta-data",
+    "https://evil.example/cover.jpg",
+    "https://i.ytimg.com.evil.example/vi/x/hqdefault.jpg",
+    "http://i.ytimg.com/vi/abc123/hqdefault.jpg",
+])
+async def test_disallowed_source_falls_back_to_ytimg(tmp_path, source):
+    fetcher = FakeFetcher()
+
+    async def resolver(video_id):
+        return source
+
+    cache = make_cache(tmp_path, fetcher, resolver=resolver)
+    await cache.get("abc123", 96)
+    assert fetcher.calls == ["https://i.ytimg.com/vi/abc123/hqdefault.jpg"]
+
+
+async def test_allowed_source_is_used(tmp_path):
+    fetcher = FakeFetcher()
+
+    async def resolver(video_id):
+        return "https://lh3.googleusercontent.com/abc=w544-h544-l90-rj"
+
+    cache = make_cache(tmp_path, fetcher, resolver=resolver)
+    await cache.get("abc123", 96)
+    assert fetcher.calls[0].startswith("https://lh3.googleusercontent.com/abc=w")
+
+
+async def test_invalid_video_id_is_rejected(tmp_path):
+    fetcher = FakeFetcher()
+    cache = make_cache(tmp_path, fetcher)
+    assert await cache.get("../etc/passwd", 96) is None
+    assert fetcher.calls == []
+
+
+async def test_thumb_endpoint_returns_304_for_matching_etag(client, tmp_path):
+    from main import app
+
+    app.state.thumbnails = make_cache(tmp_path, FakeFetcher())
+    try:
+        first = await client.get("/thumb/abc123", params={"size": 192})
+        assert first.status_code == 200
+        assert first.headers["content-type"] == "image/jpeg"
+        assert "max-age" in first.headers["cache-control"]
+        etag = first.headers["etag"]
+
+        second = await client.get("/thumb/abc123", params={"size": 192}, headers={"If-None-Match": etag})
+        assert second.status_code == 304
+        assert second.content == b""
+        assert second.headers["etag"] == etag
+
+        missing = await client.get("/thumb/..bad..")
+        assert missing.status_code == 404
+    finally:
+        await app.state.thumbnails.close()
+        del app.state.thumbnails
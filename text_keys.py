@@ -0,0 +1,84 @@
+import re
+import unicodedata
+from typing import Iterable, List
+
+# Только stdlib: ключи нужны models.py, который не должен тянуть кэш и метрики
+
+_DASHES = "‐‑‒–—―−﹘﹣－"
+_DASH_RE = re.compile(f"[{_DASHES}-]")
+
+
+def _strip_punctuation(text: str) -> str:
+    # Пунктуация и символы (категории P*, S*) -> пробел; буквы и цифры остаются
+    return "".join(" " if unicodedata.category(ch)[0] in "PS" else ch for ch in text)
+
+
+def canonicalize_query(query: str, search_mode: str = "genre") -> str:
+    """
+    Каноническая форма запроса для ключа кэша:
+    NFKC, casefold, ё -> е, тире и пунктуация -> пробел, схлопывание пробелов.
+    Для поиска трека слова сортируются: "Numb — Linkin Park" == "linkin park numb".
+    """
+    text = unicodedata.normalize("NFKC", query).casefold().replace("ё", "е")
+    tokens = _strip_punctuation(_DASH_RE.sub(" ", text)).split()
+    if search_mode == "track":
+        tokens.sort()
+    return " ".join(tokens)
+
+
+# Пометки загрузки, а не части названия записи
+_RECORDING_NOISE = {
+    "official", "video", "audio", "lyrics", "lyric", "visualizer", "hd", "hq", "4k", "mv", "clip",
+    "remastered", "remaster", "music", "explicit", "клип", "текст", "премьера",
+}
+_BRACKETS_RE = re.compile(r"[(\[{【]([^)\]}】]*)[)\]}】]")
+_FEAT_RE = re.compile(r"\b(?:feat|ft|featuring)\b.*$")
+_ARTIST_SPLIT_RE = re.compile(r",|&|\bfeat\b|\bft\b|\bx\b|\bvs\b")
+_ARTIST_SUFFIX_RE = re.compile(r"(?:\s*-\s*topic|vevo|official)$")
+
+
+def _tokens(text: str) -> List[str]:
+    return _strip_punctuation(_DASH_RE.sub(" ", text)).split()
+
+
+def recording_key(artist: str, title: str, duration: int) -> str:
+    """
+    Ключ записи, общий для разных videoId одной песни (официальное аудио, Topic-канал, lyric video):
+    основной артист | название без пометок и feat | длительность корзинами по 10 с.
+    """
+    artist_f = unicodedata.normalize("NFKC", artist).casefold().replace("ё", "е").strip()
+    artist_f = _ARTIST_SUFFIX_RE.sub("", _ARTIST_SPLIT_RE.split(artist_f)[0].strip())
+    artist_tokens = _tokens(artist_f)
+
+    title_f = unicodedata.normalize("NFKC", title).casefold().replace("ё", "е")
+    # Скобки убираем, только если в них пометки: "(Official Video)" — да, "(Remix)" — нет
+    title_f = _BRACKETS_RE.sub(
+        lambda m: " " if set(_tokens(m.group(1))) & (_RECORDING_NOISE | {"feat", "ft", "featuring"}) else f" {m.group(1)} ",
+        title_f,
+    )
+    title_f = _FEAT_RE.sub("", title_f)
+    title_tokens = _tokens(title_f)
+    # "Artist - Title" в названии ролика (артист канала может быть слитным: LinkinParkVEVO)
+    artist_compact = "".join(artist_tokens)
+    for i in range(1, len(title_tokens)):
+        if "".join(title_tokens[:i]) == artist_compact:
+            title_tokens = title_tokens[i:]
+            break
+    title_tokens = [t for t in title_tokens if t not in _RECORDING_NOISE] or title_tokens
+
+    bucket = str(round(duration / 10)) if duration else "?"
+    return f"{artist_compact}|{' '.join(title_tokens)}|{bucket}"
+
+
+def recording_key_variants(key: str) -> List[str]:
+    """Ключ и соседние корзины длительности: 179 с и 181 с — одна запись."""
+    head, _, bucket = key.rpartition("|")
+    if not bucket.isdigit():
+        return [key]
+    b = int(bucket)
+    return [key] + [f"{head}|{n}" for n in (b - 1, b + 1) if n >= 0]
+
+
+def is_known_recording(key: str, known: Iterable[str]) -> bool:
+    known = known if isinstance(known, (set, frozenset, dict)) else set(known)
+    return any(k in known for k in recording_key_variants(key))
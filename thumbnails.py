@@ -0,0 +1,223 @@
+import asyncio
+import importlib.util
+import io
+import logging
+import os
+import re
+import time
+import uuid
+from collections import OrderedDict
+from concurrent.futures import Executor
+from pathlib import Path
+from typing import Any, Awaitable, Callable, Dict, Optional, Tuple
+from urllib.parse import urlsplit
+
+import httpx
+
+from metrics import THUMB_REQUESTS
+
+logger = logging.getLogger(__name__)
+
+# Стандартные размеры обложек (Media Session рекомендует 96..512); запрошенный округляется вверх
+THUMB_SIZES = (96, 192, 512)
+# Только CDN картинок YouTube/YTMusic: URL берется из индекса треков, прокси не должен ходить куда угодно
+ALLOWED_HOSTS = ("ytimg.com", "googleusercontent.com", "ggpht.com")
+VIDEO_ID_RE = re.compile(r"^[A-Za-z0-9_-]{1,64}$")
+# Суффикс размера в URL lh3.googleusercontent.com: "=w544-h544-l90-rj"
+_GOOGLE_SIZE_RE = re.compile(r"=w\d+-h\d+[^/]*$")
+
+ThumbnailFetcher = Callable[[str], Awaitable[bytes]]
+SourceResolver = Callable[[str], Awaitable[Optional[str]]]
+
+
+def youtube_thumbnail_url(video_id: str) -> str:
+    return f"https://i.ytimg.com/vi/{video_id}/hqdefault.jpg"
+
+
+def is_allowed_source(url: Optional[str]) -> bool:
+    if not url: return False
+    parts = urlsplit(url)
+    host = parts.hostname or ""
+    return parts.scheme == "https" and any(host == h or host.endswith(f".{h}") for h in ALLOWED_HOSTS)
+
+
+def sized_source_url(url: str, size: int) -> str:
+    """Без Pillow: googleusercontent умеет отдавать нужный размер сам, остальные URL — как есть."""
+    if "googleusercontent.com" in url and _GOOGLE_SIZE_RE.search(url):
+        return _GOOGLE_SIZE_RE.sub(f"=w{size}-h{size}-l90-rj", url)
+    return url
+
+
+def resize_variants(data: bytes, sizes: Tuple[int, ...]) -> Dict[int, bytes]:
+    """Квадратные JPEG всех размеров из исходной картинки (Pillow; выполняется в пуле потоков)."""
+    from PIL import Image
+
+    with Image.open(io.BytesIO(data)) as src:
+        img = src.convert("RGB")
+    side = min(img.size)
+    left, top = (img.width - side) // 2, (img.height - side) // 2
+    img = img.crop((left, top, left + side, top + side))
+    variants = {}
+    for size in sizes:
+        out = io.BytesIO()
+        img.resize((size, size), Image.LANCZOS).save(out, "JPEG", quality=85, optimize=True, progressive=True)
+        variants[size] = out.getvalue()
+    return variants
+
+
+class HttpThumbnailFetcher:
+    """Загрузка исходной картинки по HTTP; клиент создается при первом запросе."""
+
+    def __init__(self, timeout_s: float = 10.0, max_bytes: int = 4 * 1024 * 1024):
+        self._timeout_s = timeout_s
+        self._max_bytes = max_bytes
+        self._client: Optional[httpx.AsyncClient] = None
+
+    async def __call__(self, url: str) -> bytes:
+        if self._client is None:
+            self._client = httpx.AsyncClient(timeout=httpx.Timeout(self._timeout_s), follow_redirects=True)
+        resp = await self._client.get(url)
+        resp.raise_for_status()
+        if len(resp.content) > self._max_bytes:
+            raise ValueError(f"Thumbnail too large: {len(resp.content)} bytes")
+        return resp.content
+
+    async def aclose(self):
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+
+
+class ThumbnailCache:
+    """
+    Обложки треков в уменьшенных размерах на диске (<id>_<size>.jpg) с LRU-вытеснением по объему.
+    Исходник скачивается один раз на видео, все размеры режутся сразу; параллельные запросы
+    одного видео ждут одну загрузку. Ошибки источника запоминаются на failure_ttl_s.
+    Без Pillow файлы не уменьшаются: googleusercontent отдает нужный размер сам, остальное — оригинал.
+    """
+
+    def __init__(self, directory: Path, fetcher: ThumbnailFetcher, resolver: Optional[SourceResolver] = None,
+                 max_bytes: int = 64 * 1024 * 1024, executor: Optional[Executor] = None,
+                 failure_ttl_s: float = 300.0, sizes: Tuple[int, ...] = THUMB_SIZES):
+        self.directory = Path(directory)
+        self.directory.mkdir(parents=True, exist_ok=True)
+        self._fetcher = fetcher
+        self._resolver = resolver
+        self._max_bytes = max_bytes
+        self._executor = executor
+        self._failure_ttl_s = failure_ttl_s
+        self.sizes = tuple(sorted(sizes))
+        self.can_resize = importlib.util.find_spec("PIL") is not None
+        self._entries: "OrderedDict[str, int]" = OrderedDict()
+        self._total_bytes = 0
+        self._inflight: Dict[str, "asyncio.Future[bool]"] = {}
+        self._failed: Dict[str, float] = {}
+        self._load_index()
+
+    def _load_index(self):
+        # Пережившие рестарт файлы: порядок LRU — по времени изменения
+        files = []
+        for path in self.directory.glob("*.jpg"):
+            try: st = path.stat()
+            except OSError: continue
+            files.append((st.st_mtime, path.name, st.st_size))
+        for _, name, size in sorted(files):
+            self._entries[name] = size
+            self._total_bytes += size
+        self._evict()
+
+    def snap_size(self, size: int) -> int:
+        return next((s for s in self.sizes if s >= size), self.sizes[-1])
+
+    async def get(self, video_id: str, size: int) -> Optional[bytes]:
+        """JPEG обложки ближайшего стандартного размера или None (нет источника/ошибка)."""
+        if not VIDEO_ID_RE.match(video_id): return None
+        name = f"{video_id}_{self.snap_size(size)}.jpg"
+        if name in self._entries:
+            if (data := await self._read(name)) is not None:
+                self._entries.move_to_end(name)
+                THUMB_REQUESTS.inc(result="hit")
+                return data
+        if time.monotonic() < self._failed.get(video_id, 0):
+            THUMB_REQUESTS.inc(result="failed_recently")
+            return None
+        THUMB_REQUESTS.inc(result="miss")
+        if video_id not in self._inflight:
+            self._inflight[video_id] = asyncio.ensure_future(self._fill(video_id))
+            self._inflight[video_id].add_done_callback(lambda _: self._inflight.pop(video_id, None))
+        # shield: отключившийся клиент не отменяет загрузку для остальных
+        if not await asyncio.shield(self._inflight[video_id]): return None
+        return await self._read(name)
+
+    async def _fill(self, video_id: str) -> bool:
+        try:
+            source = await self._resolver(video_id) if self._resolver else None
+            if not is_allowed_source(source):
+                source = youtube_thumbnail_url(video_id)
+            variants = await self._variants(source)
+            loop = asyncio.get_running_loop()
+            for size, data in variants.items():
+                name = f"{video_id}_{size}.jpg"
+                await loop.run_in_executor(self._executor, self._write, name, data)
+                self._add(name, len(data))
+            return True
+        except Exception as e:
+            logger.warning(f"[Thumb] Failed for {video_id}: {e}")
+            now = time.monotonic()
+            if len(self._failed) > 4096:
+                self._failed = {k: until for k, until in self._failed.items() if until > now}
+            self._failed[video_id] = now + self._failure_ttl_s
+            THUMB_REQUESTS.inc(result="error")
+            return False
+
+    async def _variants(self, source: str) -> Dict[int, bytes]:
+        if self.can_resize:
+            data = await self._fetcher(source)
+            return await asyncio.get_running_loop().run_in_executor(self._executor, resize_variants, data, self.sizes)
+        fetched: Dict[str, bytes] = {}
+        variants = {}
+        for size in self.sizes:
+            url = sized_source_url(source, size)
+            if url not in fetched: fetched[url] = await self._fetcher(url)
+            variants[size] = fetched[url]
+        return variants
+
+    def _write(self, name: str, data: bytes):
+        tmp = self.directory / f".{name}.{uuid.uuid4().hex[:8]}"
+        tmp.write_bytes(data)
+        os.replace(tmp, self.directory / name)
+
+    async def _read(self, name: str) -> Optional[bytes]:
+        try:
+            return await asyncio.get_running_loop().run_in_executor(self._executor, (self.directory / name).read_bytes)
+        except FileNotFoundError:
+            # Убран другим воркером (каждый процесс ограничивает объем по своему индексу)
+            self._discard(name)
+            return None
+
+    def _add(self, name: str, size: int):
+        self._discard(name)
+        self._entries[name] = size
+        self._total_bytes += size
+        self._evict()
+
+    def _discard(self, name: str):
+        if (size := self._entries.pop(name, None)) is not None:
+            self._total_bytes -= size
+
+    def _evict(self):
+        while self._total_bytes > self._max_bytes and len(self._entries) > 1:
+            name, size = self._entries.popitem(last=False)
+            self._total_bytes -= size
+            try: (self.directory / name).unlink()
+            except OSError: pass
+
+    async def close(self):
+        for task in list(self._inflight.values()): task.cancel()
+        if aclose := getattr(self._fetcher, "aclose", None): await aclose()
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "files": len(self._entries), "bytes": self._total_bytes, "max_bytes": self._max_bytes,
+            "resize": self.can_resize, "in_flight": len(self._inflight),
+        }
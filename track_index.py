@@ -0,0 +1,176 @@
+import asyncio
+import logging
+import re
+from datetime import datetime
+from pathlib import Path
+from typing import Iterable, List, Optional, Set, Union
+
+import aiosqlite
+
+from models import TrackInfo, Source
+from metrics import TRACK_INDEX_LOOKUPS
+
+logger = logging.getLogger(__name__)
+
+# Слова, которые не делают совпадение названия менее точным
+_NOISE_TOKENS = {"official", "video", "audio", "lyrics", "lyric", "music", "hd", "hq", "remastered", "remaster", "feat", "ft", "version"}
+
+
+def tokenize(text: str) -> List[str]:
+    """Токены как у FTS5 unicode61 remove_diacritics (в т.ч. ё -> е)."""
+    return re.findall(r"\w+", text.casefold().replace("ё", "е"))
+
+
+class TrackIndex:
+    """
+    Локальный полнотекстовый индекс (SQLite FTS5) по всем трекам, которые мы видели:
+    результаты поиска, загрузки, file_id. Позволяет отвечать на /play без похода в YTMusic.
+    """
+
+    def __init__(self, db_path: Union[str, Path]):
+        self._db_path = Path(db_path)
+        self._db: Optional[aiosqlite.Connection] = None
+        self._lock = asyncio.Lock()
+
+    @property
+    def enabled(self) -> bool:
+        return self._db is not None
+
+    async def initialize(self):
+        db = await aiosqlite.connect(self._db_path)
+        try:
+            await db.executescript("""
+                CREATE TABLE IF NOT EXISTS tracks (
+                    identifier TEXT PRIMARY KEY,
+                    title TEXT NOT NULL,
+                    artist TEXT NOT NULL,
+                    duration INTEGER,
+                    thumbnail_url TEXT,
+                    file_id TEXT,
+                    seen INTEGER NOT NULL DEFAULT 0,
+                    plays INTEGER NOT NULL DEFAULT 0,
+                    updated_at TIMESTAMP
+                );
+                CREATE VIRTUAL TABLE IF NOT EXISTS tracks_fts USING fts5(
+                    title, artist, content='tracks', content_rowid='rowid',
+                    tokenize='unicode61 remove_diacritics 2'
+                );
+                CREATE TRIGGER IF NOT EXISTS tracks_ai AFTER INSERT ON tracks BEGIN
+                    INSERT INTO tracks_fts(rowid, title, artist) VALUES (new.rowid, new.title, new.artist);
+                END;
+                CREATE TRIGGER IF NOT EXISTS tracks_ad AFTER DELETE ON tracks BEGIN
+                    INSERT INTO tracks_fts(tracks_fts, rowid, title, artist) VALUES ('delete', old.rowid, old.title, old.artist);
+                END;
+                CREATE TRIGGER IF NOT EXISTS tracks_au AFTER UPDATE OF title, artist ON tracks BEGIN
+                    INSERT INTO tracks_fts(tracks_fts, rowid, title, artist) VALUES ('delete', old.rowid, old.title, old.artist);
+                    INSERT INTO tracks_fts(rowid, title, artist) VALUES (new.rowid, new.title, new.artist);
+                END;
+            """)
+            await db.commit()
+        except Exception as e:
+            # Сборка SQLite без FTS5: индекс просто выключен
+            logger.warning(f"Track index disabled: {e}")
+            await db.close()
+            return
+        self._db = db
+        logger.info(f"Track index initialized at {self._db_path}")
+
+    async def close(self):
+        if self._db:
+            await self._db.close()
+            self._db = None
+
+    async def _upsert(self, tracks: Iterable[TrackInfo], seen: int = 0, plays: int = 0, file_id: Optional[str] = None):
+        rows = [
+            (t.identifier, t.title, t.artist, t.duration, t.thumbnail_url, file_id, seen, plays, datetime.now().isoformat())
+            for t in tracks if t and t.identifier
+        ]
+        if not self._db or not rows:
+            return
+        try:
+            async with self._lock:
+                await self._db.executemany("""
+                    INSERT INTO tracks (identifier, title, artist, duration, thumbnail_url, file_id, seen, plays, updated_at)
+                    VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+                    ON CONFLICT(identifier) DO UPDATE SET
+                        title = excluded.title,
+                        artist = excluded.artist,
+                        duration = COALESCE(NULLIF(excluded.duration, 0), tracks.duration),
+                        thumbnail_url = COALESCE(excluded.thumbnail_url, tracks.thumbnail_url),
+                        file_id = COALESCE(excluded.file_id, tracks.file_id),
+                        seen = tracks.seen + excluded.seen,
+                        plays = tracks.plays + excluded.plays,
+                        updated_at = excluded.updated_at
+                """, rows)
+                await self._db.commit()
+        except Exception as e:
+            logger.error(f"Track index write error: {e}")
+
+    async def record_seen(self, tracks: List[TrackInfo]):
+        """Треки из результатов поиска."""
+        await self._upsert(tracks, seen=1)
+
+    async def record_play(self, track: TrackInfo):
+        """Трек успешно скачан / отправлен."""
+        await self._upsert([track], plays=1)
+
+    async def record_file_id(self, identifier: str, file_id: str):
+        """Известный Telegram file_id (трек к этому моменту уже есть в индексе после загрузки)."""
+        if not self._db:
+            return
+        try:
+            async with self._lock:
+                await self._db.execute("UPDATE tracks SET file_id = ? WHERE identifier = ?", (file_id, identifier))
+                await self._db.commit()
+        except Exception as e:
+            logger.error(f"Track index write error: {e}")
+
+    async def thumbnail_url(self, identifier: str) -> Optional[str]:
+        """URL обложки из последних результатов поиска (для /thumb)."""
+        if not self._db:
+            return None
+        try:
+            async with self._lock:
+                cursor = await self._db.execute("SELECT thumbnail_url FROM tracks WHERE identifier = ?", (identifier,))
+                row = await cursor.fetchone()
+        except Exception as e:
+            logger.warning(f"Track index read error for {identifier}: {e}")
+            return None
+        return row[0] if row else None
+
+    async def lookup(self, query: str) -> Optional[TrackInfo]:
+        """
+        Уверенное локальное совпадение или None.
+        Уверенным считаем трек, все слова названия которого есть в запросе, и при этом
+        запрос называет артиста или трек уже отдавался пользователям.
+        """
+        query_tokens = tokenize(query)
+        if not self._db or not query_tokens:
+            return None
+
+        match = " ".join(f'"{tok}"' for tok in query_tokens)
+        try:
+            async with self._lock:
+                cursor = await self._db.execute("""
+                    SELECT t.identifier, t.title, t.artist, t.duration, t.thumbnail_url, t.file_id, t.plays
+                    FROM tracks_fts JOIN tracks t ON t.rowid = tracks_fts.rowid
+                    WHERE tracks_fts MATCH ?
+                    ORDER BY bm25(tracks_fts, 2.0, 1.0) - (t.plays * 0.1) - (t.file_id IS NOT NULL) LIMIT 10
+                """, (match,))
+                rows = await cursor.fetchall()
+        except Exception as e:
+            logger.warning(f"Track index lookup error for '{query}': {e}")
+            return None
+
+        query_set: Set[str] = set(query_tokens)
+        for identifier, title, artist, duration, thumbnail_url, file_id, plays in rows:
+            title_tokens = set(tokenize(title)) - _NOISE_TOKENS
+            if not title_tokens or not title_tokens <= query_set:
+                continue
+            names_artist = bool(set(tokenize(artist)) & query_set)
+            if names_artist or plays > 0 or file_id:
+                TRACK_INDEX_LOOKUPS.inc(result="hit")
+                return TrackInfo(identifier=identifier, title=title, artist=artist, duration=duration or 0,
+                                 source=Source.YOUTUBE, thumbnail_url=thumbnail_url)
+        TRACK_INDEX_LOOKUPS.inc(result="miss")
+        return None
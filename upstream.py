@@ -0,0 +1,336 @@
+import asyncio
+import functools
+import logging
+import time
+from collections import deque
+from contextlib import asynccontextmanager
+from typing import Any, AsyncIterator, Callable, Deque, Dict, Optional, Tuple, Type
+
+from metrics import UPSTREAM_CALLS, UPSTREAM_CIRCUIT_STATE, UPSTREAM_HEDGES, UPSTREAM_LIMIT, UPSTREAM_WAIT
+
+logger = logging.getLogger(__name__)
+
+THROTTLE_MARKERS = ("429", "too many requests", "rate limit", "sign in to confirm")
+# Upstream ответил, но сам ролик недоступен: это не сбой сервиса
+CONTENT_ERROR_MARKERS = ("video unavailable", "private video", "has been removed", "not available in your country")
+
+
+class UpstreamUnavailable(Exception):
+    """Цепь разомкнута: вызов отклонен сразу, без обращения к upstream."""
+
+
+class UpstreamTimeout(Exception):
+    """Ни одна попытка не ответила до дедлайна."""
+
+
+def is_throttled(exc: BaseException) -> bool:
+    # ytmusicapi и yt-dlp не дают кода ответа отдельно, только в тексте ошибки
+    text = str(exc).lower()
+    return any(marker in text for marker in THROTTLE_MARKERS)
+
+
+def is_content_error(exc: BaseException) -> bool:
+    text = str(exc).lower()
+    return any(marker in text for marker in CONTENT_ERROR_MARKERS)
+
+
+class AdaptiveLimiter:
+    """
+    AIMD-ограничение параллельности: каждый быстрый успешный вызов добавляет 1/limit
+    (в сумме +1 за "окно" из limit вызовов), ошибка, 429 или превышение целевой задержки
+    делит лимит на 2. Снижение не чаще раза в decrease_cooldown_s, чтобы пачка
+    одновременных ошибок не обрушила лимит до минимума.
+    """
+
+    def __init__(self, initial: int, min_limit: int = 1, max_limit: int = 16,
+                 latency_target_s: float = 5.0, backoff: float = 0.5, decrease_cooldown_s: Optional[float] = None):
+        self.min_limit = min_limit
+        self.max_limit = max(max_limit, min_limit)
+        self.limit = float(min(max(initial, min_limit), self.max_limit))
+        self.latency_target_s = latency_target_s
+        self._backoff = backoff
+        self._decrease_cooldown_s = latency_target_s if decrease_cooldown_s is None else decrease_cooldown_s
+        self._last_decrease = float("-inf")
+        self.in_flight = 0
+        self._waiters: Deque[asyncio.Future] = deque()
+
+    async def acquire(self):
+        while self.in_flight >= int(self.limit):
+            waiter = asyncio.get_running_loop().create_future()
+            self._waiters.append(waiter)
+            try:
+                await waiter
+            except asyncio.CancelledError:
+                # Нас могли разбудить прямо перед отменой: передаем место следующему
+                self._wake()
+                raise
+            finally:
+                if waiter in self._waiters: self._waiters.remove(waiter)
+        self.in_flight += 1
+
+    def release(self, latency_s: float, ok: bool):
+        if ok and latency_s <= self.latency_target_s:
+            self.limit = min(self.max_limit, self.limit + 1 / self.limit)
+        elif time.monotonic() - self._last_decrease >= self._decrease_cooldown_s:
+            self._last_decrease = time.monotonic()
+            self.limit = max(self.min_limit, self.limit * self._backoff)
+        self.in_flight -= 1
+        self._wake()
+
+    def _wake(self):
+        free = int(self.limit) - self.in_flight
+        for waiter in self._waiters:
+            if free <= 0: break
+            if not waiter.done():
+                waiter.set_result(None)
+                free -= 1
+
+
+class CircuitBreaker:
+    """
+    closed -> open, когда в скользящем окне из window вызовов доля ошибок >= failure_ratio.
+    open: вызовы отклоняются open_s секунд, затем half_open пропускает один пробный вызов.
+    Проба удалась — цепь замкнута; нет — снова open на вдвое больший срок (до max_open_s).
+    """
+    CLOSED, OPEN, HALF_OPEN = "closed", "open", "half_open"
+    STATE_CODES = {CLOSED: 0, HALF_OPEN: 1, OPEN: 2}
+
+    def __init__(self, failure_ratio: float = 0.5, window: int = 20, min_calls: int = 5,
+                 open_s: float = 30.0, max_open_s: float = 300.0):
+        self._failure_ratio = failure_ratio
+        self._min_calls = min_calls
+        self._base_open_s = open_s
+        self._max_open_s = max_open_s
+        self._open_s = open_s
+        self._outcomes: Deque[bool] = deque(maxlen=window)
+        self._opened_until = 0.0
+        self._probe_in_flight = False
+        self.state = self.CLOSED
+        self.opened_total = 0
+
+    def allow(self) -> bool:
+        if self.state == self.OPEN and time.monotonic() >= self._opened_until:
+            self.state, self._probe_in_flight = self.HALF_OPEN, False
+        if self.state == self.CLOSED: return True
+        if self.state == self.HALF_OPEN and not self._probe_in_flight:
+            self._probe_in_flight = True
+            return True
+        return False
+
+    def record(self, ok: bool):
+        if self.state == self.HALF_OPEN:
+            if ok:
+                self.state, self._open_s = self.CLOSED, self._base_open_s
+                self._outcomes.clear()
+            else:
+                self._open(min(self._open_s * 2, self._max_open_s))
+            return
+        if self.state == self.OPEN: return  # поздний ответ вызова, начатого до размыкания
+        self._outcomes.append(ok)
+        failures = self._outcomes.count(False)
+        if len(self._outcomes) >= self._min_calls and failures / len(self._outcomes) >= self._failure_ratio:
+            self._open(self._open_s)
+
+    def _open(self, open_s: float):
+        self.state, self._open_s = self.OPEN, open_s
+        self._opened_until = time.monotonic() + open_s
+        self._outcomes.clear()
+        self.opened_total += 1
+
+    def abandon_probe(self):
+        """Пробный вызов так и не начался (отменен в очереди): следующий запрос станет пробой."""
+        if self.state == self.HALF_OPEN: self._probe_in_flight = False
+
+    def retry_in(self) -> float:
+        return max(0.0, self._opened_until - time.monotonic()) if self.state == self.OPEN else 0.0
+
+
+class LatencyWindow:
+    """Задержки последних успешных вызовов для порога хеджирования."""
+
+    def __init__(self, size: int = 200, min_samples: int = 20):
+        self._samples: Deque[float] = deque(maxlen=size)
+        self._min_samples = min_samples
+
+    def add(self, latency_s: float):
+        self._samples.append(latency_s)
+
+    def percentile(self, q: float) -> Optional[float]:
+        if len(self._samples) < self._min_samples: return None
+        ordered = sorted(self._samples)
+        return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+
+class HedgeBudget:
+    """Каждый вызов копит ratio токена (не больше burst), повторная попытка тратит целый токен."""
+
+    def __init__(self, ratio: float = 0.1, burst: float = 5.0):
+        self._ratio = ratio
+        self._burst = burst
+        self.tokens = burst
+
+    def earn(self):
+        self.tokens = min(self._burst, self.tokens + self._ratio)
+
+    def try_spend(self) -> bool:
+        if self.tokens < 1: return False
+        self.tokens -= 1
+        return True
+
+
+class Upstream:
+    """
+    Внешний сервис (YTMusic, yt-dlp) за адаптивным лимитом и автоматом размыкания.
+    Исключения из ignore (например, ошибки ffmpeg) не считаются отказом upstream.
+    """
+
+    def __init__(self, name: str, limiter: AdaptiveLimiter, breaker: CircuitBreaker,
+                 ignore: Tuple[Type[BaseException], ...] = (), executors: Optional[Any] = None):
+        self.name = name
+        self._executors = executors
+        self.limiter = limiter
+        self.breaker = breaker
+        self._ignore = ignore
+        self.latencies = LatencyWindow()
+        self.hedge_budget = HedgeBudget()
+        self.stats_counters: Dict[str, int] = {"ok": 0, "error": 0, "throttled": 0, "rejected": 0,
+                                               "hedged": 0, "hedge_won": 0, "timeout": 0}
+        self._publish()
+
+    def _admit(self):
+        if not self.breaker.allow():
+            self._count("rejected")
+            raise UpstreamUnavailable(f"{self.name} circuit open, retry in {self.breaker.retry_in():.1f}s")
+
+    async def _acquire(self):
+        started = time.perf_counter()
+        try:
+            await self.limiter.acquire()
+        except BaseException:
+            self.breaker.abandon_probe()
+            raise
+        UPSTREAM_WAIT.observe(time.perf_counter() - started, upstream=self.name)
+
+    def _finish(self, started: float, exc: Optional[BaseException]):
+        latency_s = time.perf_counter() - started
+        if exc is None or isinstance(exc, self._ignore) or is_content_error(exc):
+            result, ok = "ok", True
+        else:
+            result, ok = ("throttled" if is_throttled(exc) else "error"), False
+        if exc is None: self.latencies.add(latency_s)
+        was_open = self.breaker.state
+        self.breaker.record(ok)
+        self.limiter.release(latency_s, ok)
+        if self.breaker.state != was_open:
+            logger.warning(f"[Upstream] {self.name}: circuit {was_open} -> {self.breaker.state} (limit {self.limiter.limit:.1f})")
+        self._count(result)
+
+    async def call(self, fn: Callable[..., Any], *args: Any, pool: Optional[str] = None, **kwargs: Any) -> Any:
+        """
+        fn в именованном пуле (pool) или пуле по умолчанию.
+        Слот освобождается, когда поток реально завершился (даже при отмене ожидающего).
+        """
+        self._admit()
+        await self._acquire()
+        started = time.perf_counter()
+        try:
+            job = functools.partial(fn, *args, **kwargs)
+            if self._executors is not None and pool:
+                call = self._executors.run(pool, job)
+            else:
+                call = asyncio.get_running_loop().run_in_executor(None, job)
+        except BaseException as e:
+            self._finish(started, e)
+            raise
+        call.add_done_callback(lambda f: self._finish(started, None if f.cancelled() else f.exception()))
+        return await asyncio.shield(call)
+
+    async def hedged_call(self, fn: Callable[..., Any], *args: Any, deadline_s: float, hedge_quantile: Optional[float] = 0.9,
+                          min_hedge_delay_s: float = 0.2, **kwargs: Any) -> Any:
+        """
+        call() с дедлайном: если первая попытка не ответила за quantile-задержку (p90), запускается
+        вторая (пока хватает бюджета) и берется первый успешный ответ. Ошибка одной попытки не ждет
+        другую, если та еще не запущена: это не повтор, а срезание хвоста.
+        """
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + deadline_s
+        self.hedge_budget.earn()
+        attempts = [asyncio.ensure_future(self.call(fn, *args, **kwargs))]
+        threshold = self.latencies.percentile(hedge_quantile) if hedge_quantile else None
+        last_exc: Optional[BaseException] = None
+        try:
+            if threshold is not None:
+                done, _ = await asyncio.wait(attempts, timeout=min(max(threshold, min_hedge_delay_s), deadline_s))
+                if not done and self.hedge_budget.try_spend():
+                    self.stats_counters["hedged"] += 1
+                    UPSTREAM_HEDGES.inc(upstream=self.name, result="sent")
+                    attempts.append(asyncio.ensure_future(self.call(fn, *args, **kwargs)))
+            pending = set(attempts)
+            while pending:
+                done, pending = await asyncio.wait(pending, timeout=max(0.0, deadline - loop.time()), return_when=asyncio.FIRST_COMPLETED)
+                if not done: break
+                for attempt in done:
+                    if attempt.exception() is None:
+                        if attempt is not attempts[0]:
+                            self.stats_counters["hedge_won"] += 1
+                            UPSTREAM_HEDGES.inc(upstream=self.name, result="won")
+                        return attempt.result()
+                    last_exc = attempt.exception()
+            if last_exc is not None and not pending: raise last_exc
+            self.stats_counters["timeout"] += 1
+            UPSTREAM_CALLS.inc(upstream=self.name, result="timeout")
+            raise UpstreamTimeout(f"{self.name}: no answer in {deadline_s:.1f}s")
+        finally:
+            # Потоки не прерываются, но ждать их ответа больше некому; слоты освободятся по их завершении
+            for attempt in attempts:
+                if not attempt.done(): attempt.cancel()
+
+    @asynccontextmanager
+    async def slot(self) -> AsyncIterator[None]:
+        """Для асинхронной работы (HTTP-поток к upstream): исход определяется исключением из блока."""
+        self._admit()
+        await self._acquire()
+        started = time.perf_counter()
+        exc: Optional[BaseException] = None
+        try:
+            yield
+        except Exception as e:
+            # Отмена (CancelledError) — решение клиента, а не отказ upstream, поэтому только Exception
+            exc = e
+            raise
+        finally:
+            self._finish(started, exc)
+
+    def _count(self, result: str):
+        self.stats_counters[result] += 1
+        UPSTREAM_CALLS.inc(upstream=self.name, result=result)
+        self._publish()
+
+    def _publish(self):
+        UPSTREAM_LIMIT.set(self.limiter.limit, upstream=self.name)
+        UPSTREAM_CIRCUIT_STATE.set(CircuitBreaker.STATE_CODES[self.breaker.state], upstream=self.name)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "circuit": self.breaker.state, "retry_in_s": round(self.breaker.retry_in(), 1),
+            "limit": round(self.limiter.limit, 2), "in_flight": self.limiter.in_flight,
+            "opened_total": self.breaker.opened_total, "p90_s": self.latencies.percentile(0.9),
+            "hedge_tokens": round(self.hedge_budget.tokens, 2), **self.stats_counters,
+        }
+
+
+def build_upstream(name: str, settings: Any, prefix: str, ignore: Tuple[Type[BaseException], ...] = (),
+                   executors: Optional[Any] = None) -> Upstream:
+    """Параметры из Settings: <PREFIX>_CONCURRENCY, _MAX_CONCURRENCY, _LATENCY_TARGET_S, [_HEDGE_BUDGET] и общие BREAKER_*."""
+    limiter = AdaptiveLimiter(
+        initial=getattr(settings, f"{prefix}_CONCURRENCY"),
+        max_limit=getattr(settings, f"{prefix}_MAX_CONCURRENCY"),
+        latency_target_s=getattr(settings, f"{prefix}_LATENCY_TARGET_S"),
+    )
+    breaker = CircuitBreaker(
+        failure_ratio=settings.BREAKER_FAILURE_RATIO, min_calls=settings.BREAKER_MIN_CALLS,
+        open_s=settings.BREAKER_OPEN_S, max_open_s=settings.BREAKER_MAX_OPEN_S,
+    )
+    upstream = Upstream(name, limiter, breaker, ignore=ignore, executors=executors)
+    upstream.hedge_budget = HedgeBudget(ratio=getattr(settings, f"{prefix}_HEDGE_BUDGET", 0.1))
+    return upstream
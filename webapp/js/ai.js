@@ -1,14 +1,36 @@
-import { fetchPlaylist } from './api.js';
+import { fetchPlaylist, resolvePlaylist } from './api.js';
 const SYNTH = window.speechSynthesis;
 
-export async function askAurora(userPrompt) {
+async function fetchDJ(userPrompt) {
+    try {
+        const response = await fetch(`/api/ai/dj?prompt=${encodeURIComponent(userPrompt)}`);
+        if (!response.ok) return null;
+        const data = await response.json();
+        return data.playlist?.length ? data : null;
+    } catch (e) {
+        console.warn('[AI] DJ недоступен:', e);
+        return null;
+    }
+}
+
+/**
+ * onTrack(track) вызывается для каждого найденного трека, как только он готов.
+ */
+export async function askAurora(userPrompt, onTrack) {
     console.log(`[AI] Input: ${userPrompt}`);
     const intros = ["Принято. Ищу лучшие треки.", "Запускаю поиск.", "Отличный выбор.", "Аврора на связи."];
-    const randomIntro = intros[Math.floor(Math.random() * intros.length)];
-    speak(randomIntro);
-    
-    // Используем простой поиск, так как это надежнее и бесплатно
-    return await fetchPlaylist(userPrompt + " mix");
+    const dj = await fetchDJ(userPrompt);
+    speak(dj?.dj_intro || intros[Math.floor(Math.random() * intros.length)]);
+
+    if (dj) {
+        // Все треки ищутся на сервере параллельно, первый можно играть сразу
+        const playlist = await resolvePlaylist(dj.playlist.map(t => t.query), onTrack);
+        if (playlist.length > 0) return playlist;
+    }
+    // Запасной вариант: простой поиск
+    const playlist = await fetchPlaylist(userPrompt + " mix");
+    if (onTrack) playlist.forEach(onTrack);
+    return playlist;
 }
 
 function speak(text) {
@@ -17,3 +17,93 @@ export async function fetchPlaylist(query) {
         return [];
     }
 }
+
+/**
+ * Просит сервер заранее скачать следующие треки очереди (ближайший первым).
+ * Ошибки не важны: это только прогрев.
+ */
+export async function prefetchTracks(identifiers) {
+    if (!identifiers.length) return;
+    try {
+        await fetch('/api/player/prefetch', {
+            method: 'POST',
+            headers: { 'Content-Type': 'application/json' },
+            body: JSON.stringify({ identifiers }),
+        });
+    } catch (e) {
+        console.warn('[API] Prefetch не удался:', e);
+    }
+}
+
+/**
+ * Читает NDJSON-ответ построчно, вызывая onItem для каждого объекта.
+ */
+export async function readNDJSON(response, onItem) {
+    const reader = response.body.getReader();
+    const decoder = new TextDecoder();
+    let buffer = '';
+    while (true) {
+        const { value, done } = await reader.read();
+        if (value) buffer += decoder.decode(value, { stream: !done });
+        let newline;
+        while ((newline = buffer.indexOf('\n')) >= 0) {
+            const line = buffer.slice(0, newline).trim();
+            buffer = buffer.slice(newline + 1);
+            if (line) onItem(JSON.parse(line));
+        }
+        if (done) break;
+    }
+    if (buffer.trim()) onItem(JSON.parse(buffer));
+}
+
+/**
+ * Превращает список "Artist - Title" в треки одним запросом.
+ * onTrack вызывается по мере готовности (первый трек можно играть сразу).
+ */
+export async function resolvePlaylist(queries, onTrack) {
+    console.log(`[API] Resolve: ${queries.length} запросов`);
+    const resolved = [];
+    try {
+        const response = await fetch('/api/player/resolve', {
+            method: 'POST',
+            headers: { 'Content-Type': 'application/json' },
+            body: JSON.stringify({ queries, prefetch: 1, stream: true }),
+        });
+        if (!response.ok) throw new Error(`Network response was not ok: ${response.statusText}`);
+        await readNDJSON(response, (item) => {
+            if (!item.track) return;
+            resolved[item.index] = item.track;
+            if (onTrack) onTrack(item.track);
+        });
+    } catch (e) {
+        console.error('[API] Ошибка resolve:', e);
+    }
+    return resolved.filter(Boolean);
+}
+
+/**
+ * Стриминговый поиск: onTrack вызывается для каждого трека, как только сервер его нашел.
+ * Возвращает полный список по завершении потока.
+ */
+export async function streamPlaylist(query, onTrack) {
+    console.log(`[API] Стрим плейлиста для: ${query}`);
+    const playlist = [];
+    try {
+        const response = await fetch(`/api/player/playlist/stream?query=${encodeURIComponent(query)}`);
+        if (!response.ok || !response.body) throw new Error(`Network response was not ok: ${response.statusText}`);
+        await readNDJSON(response, (item) => {
+            if (!item.track) return;
+            playlist.push(item.track);
+            if (onTrack) onTrack(item.track);
+        });
+    } catch (e) {
+        console.error('[API] Ошибка стрима, обычный запрос:', e);
+        if (playlist.length === 0) {
+            const fallback = await fetchPlaylist(query);
+            if (onTrack) fallback.forEach(onTrack);
+            return fallback;
+        }
+    }
+    console.log(`[API] Получено треков: ${playlist.length}`);
+    return playlist;
+}
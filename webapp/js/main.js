@@ -1,5 +1,5 @@
 import { store } from './store.js';
-import { fetchPlaylist } from './api.js';
+import { streamPlaylist } from './api.js';
 import { Player } from './player.js';
 import { Visualizer } from './visualizer.js';
 import { UI } from './ui.js';
@@ -72,9 +72,14 @@ document.addEventListener('DOMContentLoaded', () => {
         if(tTitle) tTitle.textContent = "Scanning...";
         if(tArtist) tArtist.textContent = "Please wait...";
         try {
-            const playlist = await fetchPlaylist(query);
-            store.playlist = playlist;
-            if (playlist && playlist.length > 0) { logger.print(`FOUND ${playlist.length} TRACKS`, 'success'); Player.playTrack(0); } 
+            store.playlist = [];
+            // Первый трек стартует, не дожидаясь конца поиска
+            const playlist = await streamPlaylist(query, (track) => {
+                // Присваивание, а не push: подписчики store (список в шторке) срабатывают только на set
+                store.playlist = [...store.playlist, track];
+                if (store.playlist.length === 1) Player.playTrack(0);
+            });
+            if (playlist && playlist.length > 0) { logger.print(`FOUND ${playlist.length} TRACKS`, 'success'); } 
             else { logger.print('NO SIGNALS FOUND', 'error'); if(tTitle) tTitle.textContent = "Empty"; }
         } catch (err) { logger.print('NET ERROR', 'error'); if(tTitle) tTitle.textContent = "Connection Fail"; }
     };
@@ -107,8 +112,12 @@ document.addEventListener('DOMContentLoaded', () => {
         aiInput.value = '';
         document.getElementById('track-title').textContent = "NEURAL PROCESSING...";
         document.documentElement.style.setProperty('--reactor-color', '#bc13fe');
-        const playlist = await AI.askAurora(prompt);
-        if (playlist && playlist.length > 0) { store.playlist = playlist; Player.playTrack(0); }
+        store.playlist = [];
+        let started = false;
+        await AI.askAurora(prompt, (track) => {
+            store.playlist = [...store.playlist, track];
+            if (!started) { started = true; Player.playTrack(0); }
+        });
     };
 
     UI.initialize(Player);
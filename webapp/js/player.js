@@ -1,5 +1,6 @@
 import { store } from './store.js';
 import { Visualizer } from './visualizer.js';
+import { prefetchTracks } from './api.js';
 
 const audio = document.getElementById('audio-player');
 let onStatusChange = null;
@@ -59,8 +60,9 @@ function updateMediaSession() {
     const track = store.playlist[store.currentTrackIndex];
     if (!track) return;
     
-    const artwork = track.thumbnail_url 
-        ? [{ src: track.thumbnail_url, sizes: '512x512', type: 'image/jpeg' }]
+    // Уменьшенные копии с нашего сервера (/thumb), а не полноразмерная обложка с CDN Google
+    const artwork = track.identifier
+        ? [96, 192, 512].map(size => ({ src: `/thumb/${track.identifier}?size=${size}`, sizes: `${size}x${size}`, type: 'image/jpeg' }))
         : [{ src: 'https://cdn-icons-png.flaticon.com/512/4430/4430494.png', sizes: '512x512', type: 'image/png' }];
 
     navigator.mediaSession.metadata = new MediaMetadata({
@@ -85,6 +87,14 @@ function updateMediaSession() {
 function reportStatus(state, message) { if (onStatusChange) onStatusChange(state, message); }
 function setStatusCallback(fn) { onStatusChange = fn; }
 
+const PREFETCH_AHEAD = 2;
+
+// Следующие треки очереди (по кругу, как nextTrack), без текущего
+function upcomingTracks(index) {
+    const count = Math.min(PREFETCH_AHEAD, store.playlist.length - 1);
+    return Array.from({ length: Math.max(0, count) }, (_, i) => store.playlist[(index + 1 + i) % store.playlist.length]);
+}
+
 async function playTrack(index) {
     if (index < 0 || index >= store.playlist.length) return;
     store.currentTrackIndex = index;
@@ -92,7 +102,11 @@ async function playTrack(index) {
     store.isPlaying = true;
     reportStatus('loading', `ЗАГРУЗКА: ${track.title.toUpperCase().substring(0, 20)}...`);
     document.documentElement.style.setProperty('--reactor-color', '#ffe600');
-    audio.src = `/audio/${track.identifier}.mp3`;
+    // URL трека всегда один и тот же (/audio/<id>), иначе браузер не переиспользует уже скачанное;
+    // следующие треки прогреваются на сервере через /api/player/prefetch
+    audio.src = `/audio/${track.identifier}`;
+    const upcoming = upcomingTracks(index);
+    prefetchTracks(upcoming.map(t => t.identifier));
     updateMediaSession();
     audio.load();
     await safePlay();
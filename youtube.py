@@ -2,18 +2,27 @@ from __future__ import annotations
 import asyncio
 import logging
 import os
-import glob
 import re
+import threading
 import time
+from contextlib import aclosing, nullcontext
 from pathlib import Path
-from typing import Any, Dict, List, Optional
+from typing import Any, AsyncIterator, Callable, Dict, List, Optional, Set, Tuple
 
-import yt_dlp
-from ytmusicapi import YTMusic
+import httpx
 
 from config import Settings
 from models import DownloadResult, Source, TrackInfo
 from cache_service import CacheService
+from track_index import TrackIndex
+from audio_formats import AUDIO_MIME_TYPES, NATIVE_FORMAT, TARGET_TELEGRAM, TARGET_WEB, TELEGRAM_EXTS, select_audio_format
+from disk_store import AudioStore, DownloadLockTimeout
+from stream_pipeline import PipelineError, StreamPipeline, StreamProgress, file_source, http_source, mp3_args
+from query_canon import CacheHitStats, QueryAliases
+from text_keys import canonicalize_query, is_known_recording, recording_key_variants
+from upstream import CircuitBreaker, UpstreamTimeout, UpstreamUnavailable, Upstream, build_upstream
+from executors import DOWNLOAD, EXTRACT, IO, METADATA, SEARCH, Executors
+from metrics import DOWNLOADS_IN_FLIGHT, DOWNLOADS_REJECTED, PREFETCH_REQUESTS, STREAM_FIRST_BYTE, FFMPEG_POSTPROCESS, SEARCH_LATENCY, UPSTREAM_STALE_SERVED, YTDLP_DOWNLOAD
 
 logger = logging.getLogger(__name__)
 
@@ -22,16 +31,54 @@ class SilentLogger:
     def warning(self, msg: str): pass
     def error(self, msg: str): logger.error(f"[yt-dlp] {msg}")
 
+# Опции, которые не передать в другой процесс (объекты и колбэки этого процесса)
+LOCAL_YDL_OPTS = ("logger", "progress_hooks", "postprocessor_hooks")
+
+def extract_info_isolated(video_id: str, opts: Dict[str, Any]) -> Optional[Dict]:
+    """extract_info в процессном пуле: возвращает очищенный (сериализуемый) info."""
+    import yt_dlp
+    with yt_dlp.YoutubeDL({**opts, "logger": SilentLogger()}) as ydl:
+        return ydl.sanitize_info(ydl.extract_info(video_id, download=False))
+
+def build_ytmusic(timeout_s: float) -> Any:
+    """
+    YTMusic с таймаутом запросов: ytmusicapi не передает timeout в requests, и без него
+    зависший поиск держит поток бесконечно. Импорт здесь, а не в модуле: он дорогой для старта.
+    """
+    import requests
+    from ytmusicapi import YTMusic
+
+    class TimeoutSession(requests.Session):
+        def request(self, *args, **kwargs):
+            kwargs.setdefault("timeout", timeout_s)
+            return super().request(*args, **kwargs)
+
+    return YTMusic(requests_session=TimeoutSession())
+
 class YouTubeDownloader:
     FORBIDDEN_WORDS = ['tutorial', 'making of', 'lesson', 'course', 'podcast', 'backing track', 'karaoke']
+    # Битрейты mp3 для Telegram по убыванию: берется первый, при котором файл влезает в лимит
+    MP3_QUALITIES = ['192', '160', '128', '96']
 
-    def __init__(self, settings: Settings, cache_service: CacheService):
+    def __init__(self, settings: Settings, cache_service: CacheService, ytmusic: Optional[Any] = None, ydl_factory: Optional[Callable[[Dict], Any]] = None, track_index: Optional[TrackIndex] = None, executors: Optional[Executors] = None):
         self._settings = settings
         self._cache = cache_service
+        self._track_index = track_index
+        self._aliases = QueryAliases(cache_service)
+        self.search_cache_stats = CacheHitStats()
         self._settings.DOWNLOADS_DIR.mkdir(exist_ok=True)
-        self._ytmusic = YTMusic()
-        self.semaphore = asyncio.Semaphore(3)
-        self.search_semaphore = asyncio.Semaphore(5)
+        self.audio_store = AudioStore(self._settings.DOWNLOADS_DIR, lock_timeout_s=self._settings.DOWNLOAD_LOCK_TIMEOUT_S)
+        # ytmusic / ydl_factory подменяются в бенчмарках записанными заглушками.
+        # Настоящие клиенты создаются при первом использовании (или в prewarm), не при старте
+        self._ytmusic = ytmusic
+        self._ydl_factory = ydl_factory
+        self._clients_lock = threading.Lock()
+        # Параллельность к YTMusic и yt-dlp подстраивается под их ответы; при сбоях цепь размыкается
+        self.executors = executors or Executors.from_settings(self._settings)
+        self.ytmusic_upstream = build_upstream("ytmusic", self._settings, "YTMUSIC", executors=self.executors)
+        self.ytdlp_upstream = build_upstream("ytdlp", self._settings, "YTDLP", ignore=(PipelineError, OSError), executors=self.executors)
+        # Локальное перекодирование упирается в CPU, а не в upstream
+        self._transcode_semaphore = asyncio.Semaphore(os.cpu_count() or 2)
         
         cookies_content = os.getenv("COOKIES_CONTENT")
         cookie_file_path = None
@@ -43,24 +90,59 @@ class YouTubeDownloader:
 
         self.ydl_opts = {
             "quiet": True, "no_warnings": True, "noplaylist": True,
-            "format": "bestaudio/best", "logger": SilentLogger(),
-            "postprocessors": [{'key': 'FFmpegExtractAudio','preferredcodec': 'mp3','preferredquality': '192'}],
+            # Без FFmpegExtractAudio: файл остается в исходном контейнере, mp3 — только для Telegram
+            "format": NATIVE_FORMAT, "logger": SilentLogger(),
             "outtmpl": str(self._settings.DOWNLOADS_DIR / "%(id)s.%(ext)s"),
             'nocheckcertificate': True, 'socket_timeout': 15, 'retries': 3,
+            "progress_hooks": [self._progress_hook],
+            "postprocessor_hooks": [self._postprocessor_hook],
         }
+        self._pp_started: Dict[tuple, float] = {}
+        self.in_flight_downloads = 0
+        self._background_tasks: Set[asyncio.Task] = set()
+        # Прогрев следующих треков веб-плеера: отдельный небольшой лимит поверх лимита yt-dlp
+        self._prefetch_semaphore = asyncio.Semaphore(self._settings.PREFETCH_CONCURRENCY)
+        self._prefetching: Set[str] = set()
+        # Идущие download() по videoId: первый веб-плей ждет их файла, а не качает трек второй раз
+        self._downloading: Dict[str, int] = {}
         if cookie_file_path: self.ydl_opts['cookiefile'] = cookie_file_path
         logger.info("YouTubeDownloader initialized")
 
-    def _is_track_valid(self, entry: Dict, decade: Optional[str] = None, is_russian_query: bool = False, strict: bool = True) -> bool:
+    def _progress_hook(self, d: Dict):
+        if d.get('status') == 'finished' and d.get('elapsed') is not None:
+            YTDLP_DOWNLOAD.observe(d['elapsed'])
+
+    def _postprocessor_hook(self, d: Dict):
+        # Хуки вызываются из потока загрузки; ключ — (видео, постпроцессор)
+        key = ((d.get('info_dict') or {}).get('id'), d.get('postprocessor'))
+        if d.get('status') == 'started':
+            self._pp_started[key] = time.perf_counter()
+        elif d.get('status') == 'finished':
+            started = self._pp_started.pop(key, None)
+            if started is not None:
+                FFMPEG_POSTPROCESS.observe(time.perf_counter() - started, postprocessor=key[1] or "unknown")
+
+    def _duration_bounds(self, search_mode: str, strict: bool) -> Tuple[int, int]:
+        """
+        Жанровый поиск (радио, каталог): строго — GENRE_SEARCH_*, в режиме добора — RADIO_*.
+        Поиск трека: строго — RADIO_*, иначе почти без ограничений (пользователь просил конкретную песню).
+        """
+        s = self._settings
+        if search_mode == 'genre':
+            if strict: return s.GENRE_SEARCH_MIN_DURATION_S, s.GENRE_SEARCH_MAX_DURATION_S
+            return s.RADIO_MIN_DURATION_S, s.RADIO_MAX_DURATION_S
+        if strict: return s.RADIO_MIN_DURATION_S, s.RADIO_MAX_DURATION_S
+        return 20, 10**9
+
+    def _is_track_valid(self, entry: Dict, decade: Optional[str] = None, is_russian_query: bool = False, strict: bool = True, search_mode: str = 'genre') -> bool:
         if not entry or entry.get('resultType') not in ['song', 'video']: return False
         title = entry.get('title', '').lower()
         if any(word in title for word in self.FORBIDDEN_WORDS): return False
         duration_sec = entry.get('duration_seconds', 0)
         
-        if strict:
-            if not (45 < duration_sec < 900): return False
-        else:
-            return duration_sec > 20
+        min_s, max_s = self._duration_bounds(search_mode, strict)
+        if not (min_s <= duration_sec <= max_s): return False
+        if not strict: return True
 
         if is_russian_query:
             artist_list = entry.get('artists', [])
@@ -70,49 +152,242 @@ class YouTubeDownloader:
         return True
 
     async def search(self, query: str, search_mode: str = 'genre', decade: Optional[str] = None, limit: int = 20) -> List[TrackInfo]:
-        async with self.search_semaphore:
-            cache_key = f"yt_search_v11:{query.lower().strip()}:{search_mode}"
-            cached = await self._cache.get(cache_key)
-            if cached: return cached
-
-            suffixes = ["", " music", " official", " audio", " remix"]
-            is_russian = any(word in query.lower() for word in ['советск', 'русск', 'ссср', 'песни'])
-            all_valid_tracks = []
-            
-            for suffix in suffixes:
-                actual_query = f"{query}{suffix}"
-                logger.info(f"[Search] Trying: '{actual_query}'")
-                
-                def do_search():
-                    try: return self._ytmusic.search(actual_query, filter="songs", limit=limit+5)
-                    except: return []
-
-                results = await asyncio.get_running_loop().run_in_executor(None, do_search)
-                valid = [e for e in results if self._is_track_valid(e, decade, is_russian, strict=True)]
-                if len(valid) < 5:
-                    valid = [e for e in results if self._is_track_valid(e, decade, is_russian, strict=False)]
-                
-                all_valid_tracks.extend([self._parse_ytmusic_entry(e) for e in valid])
-                if len(all_valid_tracks) >= 5: break
-
-            if not all_valid_tracks:
-                logger.warning(f"[Search] Total failure for '{query}', disabling all filters.")
-                def emergency_search():
-                    try: return self._ytmusic.search(query, limit=10)
-                    except: return []
-                results = await asyncio.get_running_loop().run_in_executor(None, emergency_search)
-                all_valid_tracks = [self._parse_ytmusic_entry(e) for e in results if e.get('videoId')]
-
-            unique = []
-            seen = set()
-            for t in all_valid_tracks:
-                if t.identifier not in seen:
-                    unique.append(t)
-                    seen.add(t.identifier)
-
-            final = unique[:limit]
-            if final: await self._cache.set(cache_key, final, ttl=3600)
-            return final
+        return [t async for t in self.search_stream(query, search_mode=search_mode, decade=decade, limit=limit)]
+
+    async def search_stream(self, query: str, search_mode: str = 'genre', decade: Optional[str] = None, limit: int = 20) -> AsyncIterator[TrackInfo]:
+        """
+        Треки отдаются сразу после обработки каждого варианта запроса (без дублей).
+        Поток закрывается по достижении limit; в кэш попадает все, что успели найти.
+        Ключ кэша — канонический запрос (или выученный для него синоним).
+        """
+        canonical = canonicalize_query(query, search_mode)
+        primary = await self._aliases.resolve(canonical, search_mode)
+        cache_key = f"yt_search_v15:{primary}:{search_mode}"
+        stale_key = f"yt_search_stale_v2:{primary}:{search_mode}"
+        legacy_key = f"{query.lower().strip()}:{search_mode}"
+        cached = await self._cache.get(cache_key)
+        # В кэше лежит и лимит, с которым искали: короткий результат /play не годится для плейлиста
+        hit = bool(cached and cached["limit"] >= limit)
+        self.search_cache_stats.record_lookup(legacy_key, hit, via_alias=primary != canonical)
+        if hit:
+            for t in cached["tracks"][:limit]: yield t
+            return
+
+        found: List[TrackInfo] = []
+        seen: Set[str] = set()
+        # Одна запись под разными videoId (официальное аудио, Topic, lyric video) — один трек
+        seen_recordings: Set[str] = set()
+        emitted = 0
+
+        # Поиск трека: сначала локальный индекс (мгновенно), затем YTMusic за остальным
+        if search_mode == 'track' and self._track_index:
+            if local := await self._track_index.lookup(query):
+                logger.info(f"[Search] Local hit for '{query}': {local.artist} - {local.title}")
+                seen.add(local.identifier)
+                seen_recordings.add(local.recording_key)
+                emitted += 1
+                yield local
+                if limit <= 1: return
+
+        suffixes = ["", " music", " official", " audio", " remix"]
+        is_russian = any(word in query.lower() for word in ['советск', 'русск', 'ссср', 'песни'])
+        upstream_failed = False
+
+        for suffix in suffixes:
+            if len(found) >= 5 or emitted >= limit: break
+            actual_query = f"{query}{suffix}"
+            logger.info(f"[Search] Trying: '{actual_query}'")
+
+            try:
+                with SEARCH_LATENCY.time(suffix=suffix.strip() or "base"):
+                    results = await self._ytmusic_search(actual_query, filter="songs", limit=limit+5)
+            except (UpstreamUnavailable, UpstreamTimeout) as e:
+                # Цепь разомкнута или YTMusic не ответил за дедлайн: остальные варианты ждали бы так же,
+                # сразу идем в старый кэш
+                logger.warning(f"[Search] '{actual_query}': {e!r}")
+                upstream_failed = True
+                break
+            except Exception as e:
+                logger.warning(f"[Search] '{actual_query}' failed: {e}")
+                upstream_failed = True
+                continue
+            valid = [e for e in results if self._is_track_valid(e, decade, is_russian, strict=True, search_mode=search_mode)]
+            if len(valid) < 5:
+                valid = [e for e in results if self._is_track_valid(e, decade, is_russian, strict=False, search_mode=search_mode)]
+
+            for e in valid:
+                track = self._parse_ytmusic_entry(e)
+                if track.identifier in seen or is_known_recording(track.recording_key, seen_recordings): continue
+                seen.add(track.identifier)
+                seen_recordings.add(track.recording_key)
+                found.append(track)
+                if emitted < limit:
+                    emitted += 1
+                    yield track
+
+        if not found and not upstream_failed:
+            logger.warning(f"[Search] Total failure for '{query}', disabling all filters.")
+            try:
+                with SEARCH_LATENCY.time(suffix="emergency"):
+                    results = await self._ytmusic_search(query, limit=10)
+            except Exception as e:
+                logger.warning(f"[Search] Emergency search for '{query}' failed: {e}")
+                upstream_failed, results = True, []
+            for e in results:
+                if not e.get('videoId') or e['videoId'] in seen: continue
+                seen.add(e['videoId'])
+                track = self._parse_ytmusic_entry(e)
+                if is_known_recording(track.recording_key, seen_recordings): continue
+                seen_recordings.add(track.recording_key)
+                found.append(track)
+                if emitted < limit:
+                    emitted += 1
+                    yield track
+
+        if not found and upstream_failed:
+            if stale := await self._cache.get(stale_key):
+                UPSTREAM_STALE_SERVED.inc(upstream=self.ytmusic_upstream.name)
+                logger.info(f"[Search] YTMusic unavailable, serving {len(stale)} stale tracks for '{query}'")
+                for track in stale:
+                    if emitted >= limit: break
+                    if track.identifier in seen: continue
+                    emitted += 1
+                    yield track
+            return
+
+        if found:
+            if primary == canonical:
+                # Та же выдача, что у уже известного запроса -> запоминаем псевдоним, дальше читаем его запись
+                primary = await self._aliases.learn(canonical, search_mode, [t.identifier for t in found]) or primary
+                cache_key = f"yt_search_v15:{primary}:{search_mode}"
+            entry = {"limit": max(limit, len(found)), "tracks": found}
+            # Запись основного запроса пишем за псевдоним, только если она не богаче:
+            # /play (limit=1) по псевдониму не должен затирать плейлист основного запроса
+            existing = await self._cache.get(cache_key) if primary != canonical else None
+            if not existing or existing["limit"] <= entry["limit"]:
+                await self._cache.set(cache_key, entry, ttl=3600)
+                # Долгоживущая копия: отдается, только если YTMusic недоступен
+                await self._cache.set(f"yt_search_stale_v2:{primary}:{search_mode}", found, ttl=self._settings.SEARCH_STALE_TTL_S)
+            self.search_cache_stats.record_store(legacy_key)
+            if self._track_index: await self._track_index.record_seen(found)
+
+    # ==================== КЛИЕНТЫ ====================
+
+    def _ytmusic_client(self) -> Any:
+        if self._ytmusic is None:
+            with self._clients_lock:
+                if self._ytmusic is None:
+                    self._ytmusic = build_ytmusic(self._settings.YTMUSIC_DEADLINE_S)
+        return self._ytmusic
+
+    def _ytmusic_client_search(self, query: str, **kwargs: Any) -> List[Dict]:
+        # Вызывается в пуле потоков: клиент при первом поиске создается там же, а не в event loop
+        return self._ytmusic_client().search(query, **kwargs)
+
+    def _new_ydl(self, opts: Dict[str, Any]) -> Any:
+        if self._ydl_factory is None:
+            import yt_dlp  # первый вызов платит за импорт, дальше модуль уже в sys.modules
+            return yt_dlp.YoutubeDL(opts)
+        return self._ydl_factory(opts)
+
+    def _prewarm_sync(self):
+        import yt_dlp  # noqa: F401
+        self._ytmusic_client()
+
+    async def prewarm(self):
+        """Фоновый прогрев после старта: импорт yt-dlp и создание клиента YTMusic до первого запроса."""
+        started = time.perf_counter()
+        try:
+            await self.executors.run(METADATA, self._prewarm_sync)
+            logger.info(f"🔥 Clients prewarmed in {time.perf_counter() - started:.2f}s")
+        except Exception as e:
+            logger.warning(f"Prewarm failed: {e}")
+
+    async def _ytmusic_search(self, query: str, **kwargs: Any) -> List[Dict]:
+        return await self.ytmusic_upstream.hedged_call(
+            self._ytmusic_client_search, query, deadline_s=self._settings.YTMUSIC_DEADLINE_S,
+            hedge_quantile=self._settings.YTMUSIC_HEDGE_QUANTILE or None, pool=SEARCH, **kwargs)
+
+    async def resolve_queries(self, queries: List[str], concurrency: int = 4, timeout: float = 20.0) -> AsyncIterator[Tuple[int, str, Optional[TrackInfo]]]:
+        """
+        Параллельный поиск по списку "Artist - Title": отдает (индекс, запрос, трек|None)
+        по мере готовности. Не более concurrency поисков одновременно, общий дедлайн timeout.
+        """
+        budget = asyncio.Semaphore(concurrency)
+
+        async def resolve_one(idx: int, query: str) -> Tuple[int, str, Optional[TrackInfo]]:
+            async with budget:
+                try:
+                    tracks = await self.search(query, search_mode='track', limit=1)
+                except Exception as e:
+                    logger.warning(f"[Resolve] '{query}' failed: {e}")
+                    tracks = []
+            return idx, query, (tracks[0] if tracks else None)
+
+        tasks = [asyncio.create_task(resolve_one(i, q)) for i, q in enumerate(queries)]
+        try:
+            for next_done in asyncio.as_completed(tasks, timeout=timeout):
+                yield await next_done
+        except asyncio.TimeoutError:
+            logger.warning(f"[Resolve] Deadline {timeout}s reached, {sum(not t.done() for t in tasks)} unresolved")
+        finally:
+            for t in tasks:
+                if not t.done(): t.cancel()
+
+    def schedule_download(self, video_id: str, target: str = TARGET_WEB) -> asyncio.Task:
+        """Фоновая загрузка (прогрев), ссылка на задачу держится до ее завершения."""
+        task = asyncio.create_task(self.download(video_id, target=target))
+        self._background_tasks.add(task)
+        task.add_done_callback(self._background_tasks.discard)
+        return task
+
+    def prefetch(self, video_ids: List[str]) -> Dict[str, str]:
+        """
+        Низкоприоритетный прогрев следующих треков: cached — уже на диске, queued — поставлен
+        (или уже в очереди), rejected — очередь прогрева заполнена.
+        """
+        statuses = {}
+        for video_id in video_ids:
+            if video_id in self._prefetching:
+                status = "queued"
+            elif self.audio_store.find(video_id, TARGET_WEB):
+                status = "cached"
+            elif len(self._prefetching) >= self._settings.PREFETCH_MAX_QUEUED:
+                status = "rejected"
+            else:
+                self._prefetching.add(video_id)
+                task = asyncio.create_task(self._prefetch_one(video_id))
+                self._background_tasks.add(task)
+                task.add_done_callback(self._background_tasks.discard)
+                status = "queued"
+            statuses[video_id] = status
+            PREFETCH_REQUESTS.inc(result=status)
+        return statuses
+
+    async def evict_loop(self):
+        """Фоновая очистка загрузок: раз в CLEANUP_INTERVAL_SECONDS удаляет файлы старше FILE_MAX_AGE_SECONDS."""
+        while True:
+            try:
+                await self.audio_store.evict(self._settings.FILE_MAX_AGE_SECONDS, self.executors.get(IO))
+            except Exception as e:
+                logger.warning(f"[Store] Eviction failed: {e}")
+            await asyncio.sleep(self._settings.CLEANUP_INTERVAL_SECONDS)
+
+    def _prefetch_headroom(self) -> bool:
+        # Пользовательские загрузки важнее: прогрев только при закрытой цепи и свободном слоте сверх одного
+        upstream = self.ytdlp_upstream
+        return upstream.breaker.state == CircuitBreaker.CLOSED and upstream.limiter.in_flight < upstream.limiter.limit - 1
+
+    async def _prefetch_one(self, video_id: str):
+        try:
+            async with self._prefetch_semaphore:
+                if not self._prefetch_headroom():
+                    PREFETCH_REQUESTS.inc(result="deferred")
+                    return
+                result = await self.download(video_id, target=TARGET_WEB)
+                PREFETCH_REQUESTS.inc(result="done" if result.success else "failed")
+        finally:
+            self._prefetching.discard(video_id)
 
     def _parse_ytmusic_entry(self, entry: Dict) -> TrackInfo:
         artists = ", ".join([a['name'] for a in entry.get('artists', []) if a.get('name')])
@@ -128,67 +403,326 @@ class YouTubeDownloader:
         )
 
     async def get_track_info(self, video_id: str) -> Optional[TrackInfo]:
-        cache_key = f"track_info:{video_id}"
+        cache_key = f"track_info_v2:{video_id}"
         cached_info = await self._cache.get(cache_key)
         if cached_info: return cached_info
         
-        loop = asyncio.get_running_loop()
-        def do_extract_info():
-            try:
-                with yt_dlp.YoutubeDL(self.ydl_opts) as ydl:
-                    return ydl.extract_info(video_id, download=False)
-            except Exception: return None
-        info = await loop.run_in_executor(None, do_extract_info)
+        info = await self._extract_info(video_id)
         if not info: return None
         track_info = TrackInfo.from_yt_info(info)
         await self._cache.set(cache_key, track_info, ttl=86400)
+        # План загрузки считаем по тем же метаданным, пока info под рукой
+        await self._cache.set(f"download_plan:{video_id}", self._plan_download(info), ttl=86400)
         return track_info
 
-    async def download(self, video_id: str) -> DownloadResult:
-        async with self.semaphore:
-            track_info = await self.get_track_info(video_id)
-            if not track_info: return DownloadResult(success=False, error_message="Info failed")
-            
-            file_id_cache_key = f"file_id:{video_id}"
-            cached_file_id = await self._cache.get(file_id_cache_key)
-            if cached_file_id: return DownloadResult(success=True, file_id=cached_file_id, track_info=track_info)
-            
-            existing_path = self._find_downloaded_file(video_id)
-            if existing_path: return DownloadResult(success=True, file_path=existing_path, track_info=track_info)
-
-            logger.info(f"[Download] Starting: {video_id}")
-            loop = asyncio.get_running_loop()
-            def do_download():
+    async def _extract_info(self, video_id: str) -> Optional[Dict]:
+        def do_extract_info():
+            with self._new_ydl(self.ydl_opts) as ydl:
+                return ydl.extract_info(video_id, download=False)
+        try:
+            # Процессный пул только для настоящего yt-dlp: подмененная фабрика (бенчмарки) живет в этом процессе
+            if self.executors.has(EXTRACT) and self._ydl_factory is None:
+                opts = {k: v for k, v in self.ydl_opts.items() if k not in LOCAL_YDL_OPTS}
+                return await self.ytdlp_upstream.call(extract_info_isolated, video_id, opts, pool=EXTRACT)
+            return await self.ytdlp_upstream.call(do_extract_info, pool=METADATA)
+        except Exception as e:
+            logger.warning(f"[Info] {video_id}: {e}")
+            return None
+
+    def _plan_download(self, info: Dict) -> Dict[str, Any]:
+        """
+        Решение до загрузки: битрейт mp3, при котором файл влезает в MAX_FILE_SIZE_MB,
+        или причина отказа. Длительность берется из info, иначе оценивается по размеру формата.
+        ext — контейнер, который придет с YouTube (решает, понадобится ли ffmpeg для Telegram).
+        """
+        if info.get('is_live') or info.get('live_status') in ('is_live', 'is_upcoming'):
+            return {"reject": "live"}
+        native = select_audio_format(info.get('formats'))
+        ext = native.get('ext') if native else None
+        duration = info.get('duration') or 0
+        if not duration:
+            audio_formats = [f for f in info.get('formats') or [] if f.get('vcodec') == 'none' and f.get('abr')]
+            for f in sorted(audio_formats, key=lambda f: f['abr'], reverse=True):
+                size = f.get('filesize') or f.get('filesize_approx')
+                if size:
+                    duration = size * 8 / (f['abr'] * 1000)
+                    break
+        if not duration:
+            return {"quality": self.MP3_QUALITIES[0], "ext": ext}
+        # Запас на ID3-теги и неточность VBR
+        budget = self._settings.MAX_FILE_SIZE_MB * 1024 * 1024 * 0.95
+        for quality in self.MP3_QUALITIES:
+            if duration * int(quality) * 1000 / 8 <= budget:
+                return {"quality": quality, "ext": ext}
+        return {"reject": "size"}
+
+    @staticmethod
+    def _rejected_for(reason: Optional[str], target: str) -> bool:
+        """Лимит размера — ограничение send_audio; эфир не скачать ни для какой цели."""
+        return bool(reason) and (reason != "size" or target == TARGET_TELEGRAM)
+
+    async def download(self, video_id: str, target: str = TARGET_TELEGRAM) -> DownloadResult:
+        self._downloading[video_id] = self._downloading.get(video_id, 0) + 1
+        try:
+            return await self._download(video_id, target)
+        finally:
+            self._downloading[video_id] -= 1
+            if not self._downloading[video_id]: del self._downloading[video_id]
+
+    async def _download(self, video_id: str, target: str) -> DownloadResult:
+        """
+        На диск всегда качается нативный контейнер (m4a/opus) без перекодирования.
+        Для Telegram mp3 делается из него локально, только если нативный файл не подходит для send_audio.
+        """
+        # Отказы по размеру/эфиру помним, чтобы не запрашивать info снова
+        if self._rejected_for(rejected := await self._cache.get(f"download_rejected_v2:{video_id}"), target):
+            return DownloadResult(success=False, error_message=f"Rejected before download: {rejected}")
+        track_info = await self.get_track_info(video_id)
+        if not track_info: return DownloadResult(success=False, error_message="Info failed")
+        
+        # Сначала сам ролик, затем уже скачанные ролики той же записи
+        candidates = [video_id] + await self._equivalent_videos(track_info)
+        if target == TARGET_TELEGRAM:
+            for candidate_id in candidates:
+                cached_file_id = await self._cache.get(f"file_id:{candidate_id}")
+                if cached_file_id:
+                    if candidate_id != video_id: logger.info(f"[Download] {video_id}: reusing file_id of {candidate_id}")
+                    return DownloadResult(success=True, file_id=cached_file_id, track_info=track_info)
+
+        plan = await self._cache.get(f"download_plan:{video_id}") or self._plan_download({"duration": track_info.duration})
+        if target == TARGET_TELEGRAM and (ready := self._find_downloaded_file(video_id, TARGET_TELEGRAM)):
+            return DownloadResult(success=True, file_path=ready, track_info=track_info, transcoded=ready.suffix == ".mp3")
+        source_id, native_path = video_id, None
+        for candidate_id in candidates:
+            if native_path := self._find_downloaded_file(candidate_id):
+                source_id = candidate_id
+                if candidate_id != video_id: logger.info(f"[Download] {video_id}: reusing file of {candidate_id}")
+                break
+        else:
+            if self._rejected_for(reason := plan.get("reject"), target):
+                DOWNLOADS_REJECTED.inc(reason=reason)
+                message = f"Rejected before download: {reason}"
+                logger.info(f"[Download] {video_id}: {message} ({track_info.duration}s, limit {self._settings.MAX_FILE_SIZE_MB} MB)")
+                # Храним причину, а не вердикт: длинный трек по-прежнему можно слушать в вебе
+                await self._cache.set(f"download_rejected_v2:{video_id}", reason, ttl=7 * 86400)
+                return DownloadResult(success=False, error_message=message, track_info=track_info)
+
+            try:
+                # Один загрузчик на видео во всех процессах; остальные ждут и берут готовый файл
+                async with self.audio_store.lock(video_id):
+                    native_path = self._find_downloaded_file(video_id)
+                    if native_path:
+                        logger.info(f"[Download] {video_id}: downloaded by another worker")
+                    else:
+                        # Исходник не годится для send_audio: качаем и перекодируем одним потоком, без копии на диске
+                        if target == TARGET_TELEGRAM and plan.get("ext") and plan["ext"] not in TELEGRAM_EXTS:
+                            if mp3_path := await self._stream_to_mp3(video_id, plan["quality"], track_info.duration):
+                                await self._record_downloaded(track_info)
+                                return DownloadResult(success=True, file_path=mp3_path, track_info=track_info, transcoded=True)
+
+                        native_path = await self._fetch_native(video_id, track_info.duration)
+                        if not native_path: return DownloadResult(success=False, error_message="Download Error", track_info=track_info)
+                        await self._record_downloaded(track_info)
+            except DownloadLockTimeout:
+                return DownloadResult(success=False, error_message="Download busy", track_info=track_info)
+            except UpstreamUnavailable as e:
+                logger.warning(f"[Download] {video_id}: {e}")
+                return DownloadResult(success=False, error_message="Source unavailable", track_info=track_info)
+
+        if target != TARGET_TELEGRAM:
+            return DownloadResult(success=True, file_path=native_path, track_info=track_info)
+        telegram_path = await self._telegram_variant(source_id, native_path, plan.get("quality") or self.MP3_QUALITIES[-1], track_info.duration)
+        if not telegram_path: return DownloadResult(success=False, error_message="Transcode Error", track_info=track_info)
+        return DownloadResult(success=True, file_path=telegram_path, track_info=track_info, transcoded=telegram_path != native_path)
+
+    async def _record_downloaded(self, track_info: TrackInfo):
+        if self._track_index: await self._track_index.record_play(track_info)
+        await self._cache.set(f"recording:{track_info.recording_key}", track_info.identifier, ttl=0)
+
+    async def _fetch_native(self, video_id: str, duration: Optional[int]) -> Optional[Path]:
+        """yt-dlp во временную папку и публикация в хранилище. Вызывать под audio_store.lock(video_id)."""
+        logger.info(f"[Download] Starting: {video_id}")
+        tmp_dir = self.audio_store.temp_dir(video_id)
+        ydl_opts = {**self.ydl_opts, "outtmpl": str(tmp_dir / "%(id)s.%(ext)s")}
+        def do_download():
+            with self._new_ydl(ydl_opts) as ydl:
+                ydl.download([video_id])
+        
+        self.in_flight_downloads += 1
+        DOWNLOADS_IN_FLIGHT.inc()
+        try:
+            try:
+                await self.ytdlp_upstream.call(do_download, pool=DOWNLOAD)
+            except UpstreamUnavailable:
+                raise
+            except Exception as e:
+                logger.error(f"Download error {video_id}: {e}")
+                return None
+            # yt-dlp сам дописывает .part и переименовывает; готов единственный аудиофайл без хвостов
+            produced = [p for p in tmp_dir.glob(f"{video_id}.*") if p.suffix.lstrip(".") in AUDIO_MIME_TYPES]
+            if not produced:
+                logger.error(f"[Download] {video_id}: yt-dlp finished without an audio file")
+                return None
+            path = max(produced, key=lambda p: p.stat().st_size)
+            return self.audio_store.publish(path, video_id, path.suffix.lstrip("."), duration=duration, source="yt-dlp")
+        finally:
+            self.in_flight_downloads -= 1
+            DOWNLOADS_IN_FLIGHT.dec()
+            self.audio_store.discard(tmp_dir)
+
+    async def _telegram_variant(self, video_id: str, native_path: Path, quality: str, duration: Optional[int] = None) -> Optional[Path]:
+        """Файл для send_audio: нативный m4a, если он в лимите, иначе (уже готовый или новый) mp3."""
+        if existing := self._find_downloaded_file(video_id, TARGET_TELEGRAM):
+            return existing
+        try:
+            async with self.audio_store.lock(f"{video_id}.mp3"):
+                if existing := self._find_downloaded_file(video_id, TARGET_TELEGRAM):
+                    return existing
+                logger.info(f"[Download] {video_id}: {native_path.suffix} -> mp3 {quality}k for Telegram")
+                pipeline = StreamPipeline(file_source(native_path, self.executors.get(IO)), mp3_args(quality), on_progress=self._stream_progress("file_to_mp3"))
+                async with self._transcode_semaphore:
+                    return await self._run_to_file(pipeline, video_id, "mp3", duration, source="transcode")
+        except DownloadLockTimeout:
+            return None
+
+    async def _stream_to_mp3(self, video_id: str, quality: str, duration: Optional[int] = None) -> Optional[Path]:
+        if not self._settings.AUDIO_STREAMING_ENABLED: return None
+        fmt = await self._resolve_stream_format(video_id)
+        if not fmt: return None
+        async with self.audio_store.lock(f"{video_id}.mp3"):
+            logger.info(f"[Download] {video_id}: streaming {fmt['ext']} -> mp3 {quality}k")
+            pipeline = StreamPipeline(
+                http_source(fmt["url"], fmt["headers"], fmt["filesize"]), mp3_args(quality),
+                on_progress=self._stream_progress("telegram"), total_in=fmt["filesize"],
+            )
+            return await self._run_to_file(pipeline, video_id, "mp3", duration, source="stream_transcode", upstream=self.ytdlp_upstream)
+
+    async def _run_to_file(self, pipeline: StreamPipeline, video_id: str, ext: str, duration: Optional[int], source: str,
+                           upstream: Optional[Upstream] = None) -> Optional[Path]:
+        tmp_path = self.audio_store.temp_path(f"{video_id}.{ext}")
+        self.in_flight_downloads += 1
+        DOWNLOADS_IN_FLIGHT.inc()
+        try:
+            async with upstream.slot() if upstream else nullcontext():
+                await pipeline.to_file(tmp_path, self.executors.get(IO))
+            return self.audio_store.publish(tmp_path, video_id, ext, duration=duration, source=source)
+        except (OSError, PipelineError, httpx.HTTPError, UpstreamUnavailable) as e:
+            logger.error(f"[Pipeline] {video_id}.{ext} failed: {e}")
+            return None
+        finally:
+            self.in_flight_downloads -= 1
+            DOWNLOADS_IN_FLIGHT.dec()
+            self.audio_store.discard(tmp_path)
+
+    async def _resolve_stream_format(self, video_id: str) -> Optional[Dict[str, Any]]:
+        """Прямая ссылка на аудиоформат (ссылки живут несколько часов, поэтому не кэшируются)."""
+        info = await self._extract_info(video_id)
+        fmt = select_audio_format(info.get('formats')) if info else None
+        if not fmt: return None
+        return {
+            "url": fmt["url"], "ext": fmt.get("ext") or "webm",
+            "headers": fmt.get("http_headers") or info.get("http_headers") or {},
+            "filesize": fmt.get("filesize"),
+            "duration": info.get("duration"),
+        }
+
+    async def stream_audio(self, video_id: str) -> Optional[Tuple[str, AsyncIterator[bytes]]]:
+        """
+        Первое воспроизведение в вебе: нативные байты идут клиенту сразу и параллельно пишутся на диск.
+        None — поток получить не удалось, трек отклонен, его уже стримит другой клиент
+        или уже качает download() (прогрев, Telegram, другой процесс): тогда обычная загрузка дождется этого файла.
+        """
+        if not self._settings.AUDIO_STREAMING_ENABLED: return None
+        if video_id in self._downloading or self.audio_store.is_locked(video_id): return None
+        if self._rejected_for(await self._cache.get(f"download_rejected_v2:{video_id}"), TARGET_WEB): return None
+        plan = await self._cache.get(f"download_plan:{video_id}")
+        if plan and self._rejected_for(plan.get("reject"), TARGET_WEB): return None
+        stream = self._stream_and_publish(video_id)
+        # Первый шаг генератора берет блокировку и ссылку; после него aclose() всегда освободит блокировку
+        try:
+            ext = await stream.__anext__()
+        except StopAsyncIteration:
+            return None
+        return ext, stream
+
+    async def _stream_and_publish(self, video_id: str) -> AsyncIterator[Any]:
+        """
+        Первым значением отдает расширение, затем байты; файл публикуется, только если поток дошел до конца.
+        Темп задает клиент (пауза останавливает tee), поэтому блокировка видео на время потока не берется:
+        загрузка для Telegram/радио идет независимо, а поток лишь публикует файл, если его еще нет.
+        """
+        try:
+            async with self.audio_store.lock(f"{video_id}.stream", blocking=False):
+                fmt = await self._resolve_stream_format(video_id)
+                if not fmt: return
+                yield fmt["ext"]
+                pipeline = StreamPipeline(
+                    http_source(fmt["url"], fmt["headers"], fmt["filesize"]),
+                    on_progress=self._stream_progress("web"), total_in=fmt["filesize"],
+                )
+                tmp_path = self.audio_store.temp_path(f"{video_id}.{fmt['ext']}")
+                self.in_flight_downloads += 1
+                DOWNLOADS_IN_FLIGHT.inc()
                 try:
-                    with yt_dlp.YoutubeDL(self.ydl_opts) as ydl:
-                        ydl.download([video_id])
-                    return True
-                except Exception as e: 
-                    logger.error(f"Download error {video_id}: {e}")
-                    return False
-            
-            success = await loop.run_in_executor(None, do_download)
-            if not success: return DownloadResult(success=False, error_message="Download Error", track_info=track_info)
-
-            final_path = await self.wait_for_download_completion(video_id)
-            if not final_path: return DownloadResult(success=False, error_message="File lost", track_info=track_info)
-            
-            return DownloadResult(success=True, file_path=final_path, track_info=track_info)
+                    async with aclosing(pipeline.tee(tmp_path, self.executors.get(IO))) as chunks:
+                        async for chunk in chunks:
+                            yield chunk
+                    await self._publish_streamed(tmp_path, video_id, fmt)
+                finally:
+                    self.in_flight_downloads -= 1
+                    DOWNLOADS_IN_FLIGHT.dec()
+                    self.audio_store.discard(tmp_path)
+        except DownloadLockTimeout:
+            return
+
+    async def _publish_streamed(self, tmp_path: Path, video_id: str, fmt: Dict[str, Any]):
+        """Публикация под блокировкой видео без ожидания: занята — файл опубликует тот, кто качает."""
+        try:
+            async with self.audio_store.lock(video_id, blocking=False):
+                if not self._find_downloaded_file(video_id):
+                    self.audio_store.publish(tmp_path, video_id, fmt["ext"], duration=fmt.get("duration"), source="stream")
+        except DownloadLockTimeout:
+            logger.info(f"[Download] {video_id}: downloaded concurrently, dropping streamed copy")
+
+    def _stream_progress(self, mode: str) -> Callable[[StreamProgress], None]:
+        first_byte_reported = False
+        def on_progress(p: StreamProgress):
+            nonlocal first_byte_reported
+            if not first_byte_reported and p.first_byte_s is not None:
+                first_byte_reported = True
+                STREAM_FIRST_BYTE.observe(p.first_byte_s, mode=mode)
+            if p.done:
+                logger.info(f"[Pipeline] {mode}: {p.bytes_in} -> {p.bytes_out} bytes in {p.elapsed_s:.1f}s, first byte {p.first_byte_s or 0:.2f}s")
+        return on_progress
+
+    async def _equivalent_videos(self, track_info: TrackInfo) -> List[str]:
+        """videoId уже скачанных роликов с тем же ключом записи."""
+        candidates = []
+        for key in recording_key_variants(track_info.recording_key):
+            other_id = await self._cache.get(f"recording:{key}")
+            if other_id and other_id != track_info.identifier and other_id not in candidates:
+                candidates.append(other_id)
+        return candidates
+
+    def upstream_stats(self) -> Dict[str, Any]:
+        return {u.name: u.stats() for u in (self.ytmusic_upstream, self.ytdlp_upstream)}
 
     async def cache_file_id(self, video_id: str, file_id: str):
         await self._cache.set(f"file_id:{video_id}", file_id, ttl=0)
+        if self._track_index: await self._track_index.record_file_id(video_id, file_id)
+
+    def _find_downloaded_file(self, video_id: str, target: str = TARGET_WEB) -> Optional[Path]:
+        max_bytes = self._settings.MAX_FILE_SIZE_MB * 1024 * 1024 if target == TARGET_TELEGRAM else None
+        return self.audio_store.find(video_id, target, max_bytes)
 
-    def _find_downloaded_file(self, video_id: str) -> Optional[Path]:
-        exact_path = self._settings.DOWNLOADS_DIR / f"{video_id}.mp3"
-        if exact_path.exists() and exact_path.stat().st_size > 1024: return exact_path
-        return None
+    def discard_file(self, path: Path):
+        """Удаление опубликованного варианта (вместе с манифестом)."""
+        self.audio_store.remove(Path(path))
 
     async def wait_for_download_completion(self, video_id: str, timeout: int = 45) -> Optional[Path]:
-        start_time = time.time()
-        final_path = self._settings.DOWNLOADS_DIR / f"{video_id}.mp3"
-        while time.time() - start_time < timeout:
-            if final_path.exists() and final_path.stat().st_size > 1024:
-                part_files = glob.glob(str(self._settings.DOWNLOADS_DIR / f"{video_id}.*.part"))
-                if not part_files: return final_path
-            await asyncio.sleep(0.5)
-        return None
\ No newline at end of file
+        """Ждет файл, который публикует другой процесс или корутина (по манифесту, а не по размеру)."""
+        try:
+            async with self.audio_store.lock(video_id, timeout_s=timeout):
+                return self._find_downloaded_file(video_id)
+        except DownloadLockTimeout:
+            return None